@@ -0,0 +1,37 @@
+from channels.db import database_sync_to_async
+from djangochannelsrestframework.permissions import IsAuthenticated
+from djangochannelsrestframework.generics import GenericAsyncAPIConsumer
+from djangochannelsrestframework.decorators import action
+from merchant.fanout import get_order_group
+from merchant.models import Order
+from merchant.wire import WireFormatMixin
+
+
+class OrderConsumer(WireFormatMixin, GenericAsyncAPIConsumer):
+    '''
+    Sends the status, ETA and other changes of one of the client's orders. See `merchant.fanout`.
+    '''
+    permission_classes = [IsAuthenticated]
+
+    async def websocket_connect(self, event):
+        # Set by `delivery.authentication.TokenAuthMiddleware`, with the user's client loaded
+        self.user = self.scope['user']
+        self.order_id = int(self.scope['url_route']['kwargs']['order_id'])
+
+        client = getattr(self.user, 'client', None)
+        if client is None or not await database_sync_to_async(self.is_client_order)(client):
+            # Rejects the handshake. DenyConnection is only handled when raised from `connect`.
+            await self.close()
+            return
+
+        return await super().websocket_connect(event)
+
+    def is_client_order(self, client):
+        return Order.objects.filter(id=self.order_id, client=client).exists()
+
+    @action()
+    async def subscribe_to_order_activity(self, request_id, **kwargs):
+        await self.add_group(get_order_group(self.order_id))
+
+    async def order_batch(self, event):
+        await self.send_order_activity(event)
@@ -0,0 +1,11 @@
+from django.urls import re_path
+
+from client.consumers import OrderConsumer
+
+websocket_urlpatterns = [
+    re_path(
+        r'client/orders/(?P<order_id>\d+)/', 
+        OrderConsumer.as_asgi(), 
+        name='order_detail_ws'
+    ),
+]
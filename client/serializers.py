@@ -1,15 +1,16 @@
 from datetime import timedelta
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from client.fields import ModelField
 from client.models import Client, Review
+from delivery.cache import LayeredCache
 from delivery.serializers import RegisterSerializer
-from delivery.settings import ADDITIONAL_DELIVERY_TIME_PER_METER, DELIVERY_COST_PER_METER
 
 from merchant.models import Delivery, Menu, MenuCategory, MenuItem, MenuItemOption, MenuItemOptionGroup, Order, OrderItem, OrderItemOption, OrderItemOptionGroup, Restaurant, SelfPickup
 from merchant.serializers import PriceAdjustmentSerializer
-from merchant.utils import calc_delivery_cost, calc_distance_from_coords, round_to_base
+from merchant.utils import calc_delivery_cost, calc_delivery_quotes, calc_distance_from_coords, round_to_base
 from rider.models import Rider, Session
 
 
@@ -25,37 +26,48 @@ class ClientRegisterSerializer(RegisterSerializer):
         return user
 
 
+class NearbyRestaurantsQuerySerializer(serializers.Serializer):
+    '''
+    Query parameters of the restaurant list
+    '''
+    user_latitude = serializers.FloatField(min_value=-90, max_value=90)
+    user_longitude = serializers.FloatField(min_value=-180, max_value=180)
+    radius = serializers.FloatField(min_value=1, max_value=50000, default=5000)  # meters
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
 class RestaurantListSerializer(serializers.ModelSerializer):
-    distance = serializers.SerializerMethodField('calc_distance')
-    delivery_cost = serializers.SerializerMethodField('calc_delivery_cost')
-    delivery_time = serializers.SerializerMethodField('calc_delivery_time')
+    '''
+    Reads distances, delivery costs and delivery times from the `delivery_quotes` context, which the view 
+    computes for the whole list at once with `calc_delivery_quotes`.
+    '''
+    distance = serializers.SerializerMethodField('get_distance')
+    delivery_cost = serializers.SerializerMethodField('get_delivery_cost')
+    delivery_time = serializers.SerializerMethodField('get_delivery_time')
 
     class Meta:
         model = Restaurant
         fields = ['id', 'name', 'distance', 'delivery_cost', 'delivery_time', 'rating']
     
-    def validate(self, attrs):
-        try:
-            self.user_latitude = float(self.context.get('request').query_params.get('user_latitude'))
-            self.user_longitude = float(self.context.get('request').query_params.get('user_longitude'))
-        except:
-            raise serializers.ValidationError('Invalid latitude or longitude!')
-        return attrs
+    def get_delivery_quote(self, obj):
+        delivery_quotes = self.context.get('delivery_quotes')
+        if delivery_quotes is None or obj.id not in delivery_quotes:
+            try:
+                user_latitude = float(self.context.get('request').query_params.get('user_latitude'))
+                user_longitude = float(self.context.get('request').query_params.get('user_longitude'))
+            except (TypeError, ValueError):
+                raise serializers.ValidationError('Invalid latitude or longitude!')
+            delivery_quotes = calc_delivery_quotes([obj], user_latitude, user_longitude)
+        return delivery_quotes[obj.id]
         
-    def calc_distance(self, obj):
-        restaurant_latitude = float(obj.latitude)
-        restaurant_longitude = float(obj.longitude)
-        user_latitude = float(self.context.get('request').query_params.get('user_latitude'))
-        user_longitude = float(self.context.get('request').query_params.get('user_longitude'))
-        dist = calc_distance_from_coords(user_latitude, user_longitude, restaurant_latitude, restaurant_longitude)
-        return round(dist)
+    def get_distance(self, obj):
+        return self.get_delivery_quote(obj).distance
     
-    def calc_delivery_cost(self, obj):
-        return round(self.calc_distance(obj) * DELIVERY_COST_PER_METER, 1)
+    def get_delivery_cost(self, obj):
+        return self.get_delivery_quote(obj).delivery_cost
     
-    def calc_delivery_time(self, obj):
-        delivery_time = timedelta(minutes=20 + self.calc_distance(obj) * ADDITIONAL_DELIVERY_TIME_PER_METER) 
-        return delivery_time + obj.order_fulfillment_time
+    def get_delivery_time(self, obj):
+        return self.get_delivery_quote(obj).delivery_time
 
 
 class ClientSerializer(serializers.ModelSerializer):
@@ -67,11 +79,13 @@ class ClientSerializer(serializers.ModelSerializer):
 
 
 class ReviewSerializer(serializers.ModelSerializer):
-    client = ClientSerializer()
+    # Set from the reviewed order by `ReviewCreate`
+    client = ClientSerializer(read_only=True)
 
     class Meta:
         model = Review
         fields = ['client', 'rating', 'text', 'created']
+        extra_kwargs = {'created': {'read_only': True}}
         
 
 class MenuItemOptionSerializer(serializers.ModelSerializer):
@@ -117,11 +131,19 @@ class MenuSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'categories']
 
 
+# Keyed by menu id and version, so entries never have to be invalidated
+menu_document_cache = LayeredCache('client.menu_document', timeout=24 * 60 * 60, local_timeout=60 * 60)
+
+
+def get_menu_document_key(menu):
+    return f'{menu.id}:{menu.version}'
+
+
 class RestaurantDetailSerializer(serializers.ModelSerializer):
     distance = serializers.SerializerMethodField('calc_distance_with_rounding')
     delivery_cost = serializers.SerializerMethodField('calc_delivery_cost')
     delivery_time = serializers.SerializerMethodField('calc_delivery_time')
-    current_menu = MenuSerializer()
+    current_menu = serializers.SerializerMethodField('get_current_menu')
 
     class Meta:
         model = Restaurant
@@ -146,42 +168,44 @@ class RestaurantDetailSerializer(serializers.ModelSerializer):
     def calc_delivery_time(self, obj):
         return round_to_base(20 + self._calc_distance(obj) * 60 / 20, 5)
 
+    def get_current_menu(self, obj):
+        '''
+        The current menu rendered by `MenuSerializer`, which is only done once per menu version
+        '''
+        menu = self.context['current_menu'] if 'current_menu' in self.context else obj.current_menu
+        if menu is None:
+            return None
+
+        def build():
+            prefetch_related_objects([menu], 'categories__items')
+            return MenuSerializer(menu).data
+
+        return menu_document_cache.get_or_build(get_menu_document_key(menu), build)
+
 
 class OrderItemOptionListSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField(method_name='get_id', read_only=True)
-    name = serializers.SerializerMethodField(method_name='get_name', read_only=True)
+    id = serializers.IntegerField(source='menu_item_option_id', read_only=True)
+    name = serializers.CharField(source='menu_item_option.name', read_only=True)
     
     class Meta:
         model = OrderItemOption
         fields = ['id', 'name']
-    
-    def get_id(self, obj):
-        return obj.menu_item_option.id
-    
-    def get_name(self, obj):
-        return obj.menu_item_option.name
 
 
 class OrderItemOptionGroupListSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField(method_name='get_id', read_only=True)
-    name = serializers.SerializerMethodField(method_name='get_name', read_only=True)
+    id = serializers.IntegerField(source='menu_item_option_group_id', read_only=True)
+    name = serializers.CharField(source='menu_item_option_group.name', read_only=True)
     options = OrderItemOptionListSerializer(many=True)
     
     class Meta:
         model = OrderItemOptionGroup
         fields = ['id', 'name', 'options']
-
-    def get_id(self, obj):
-        return obj.menu_item_option_group.id
-    
-    def get_name(self, obj):
-        return obj.menu_item_option_group.name
         
 
 class OrderItemListSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField(method_name='get_id', read_only=True)
+    id = serializers.IntegerField(source='menu_item_id', read_only=True)
     instance_id = serializers.IntegerField(source='id')
-    name = serializers.SerializerMethodField(method_name='get_name', read_only=True)
+    name = serializers.CharField(source='menu_item.name', read_only=True)
     option_groups = OrderItemOptionGroupListSerializer(many=True)
     price_adjustment = PriceAdjustmentSerializer()
     
@@ -195,14 +219,8 @@ class OrderItemListSerializer(serializers.ModelSerializer):
         return ret
 
 
-    def get_id(self, obj):
-        return obj.menu_item.id
-
-    def get_name(self, obj):
-        return obj.menu_item.name
-
-
 class OrderListSerializer(serializers.ModelSerializer):
+    price = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Order
@@ -216,10 +234,13 @@ class OrderDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['id', 'restaurant', 'type', 'items', 'created', 'status', 'price', 'estimated_completion_datetime']
+        # Used by `get_estimated_completion_datetime`
+        select_related = ['delivery', 'self_pickup']
     
     # NOTE: Djangochannelsrestframework uses msgpack, which cannot serialize decimal.Decimal
     # and datetime.datetime. All nested representations should be converted to str too.
     # https://github.com/msgpack/msgpack-python/issues/12
+    # The msgpack WebSocket format of `merchant.wire` sends them as msgpack extension types.
     def to_representation(self, instance):
         ret = super().to_representation(instance)
         ret['price'] = str(ret['price'])
@@ -234,7 +255,8 @@ class OrderDetailSerializer(serializers.ModelSerializer):
 
 
 class OrderItemOptionCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=MenuItemOption.objects.all(), source='menu_item_option')
+    # Validated against the menu in `OrderCreateSerializer.validate`
+    id = serializers.IntegerField(source='menu_item_option_id')
     
     class Meta:
         model = OrderItemOption
@@ -242,7 +264,8 @@ class OrderItemOptionCreateSerializer(serializers.ModelSerializer):
 
 
 class OrderItemOptionGroupCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=MenuItemOptionGroup.objects.all(), source='menu_item_option_group')
+    # Validated against the menu in `OrderCreateSerializer.validate`
+    id = serializers.IntegerField(source='menu_item_option_group_id')
     options = OrderItemOptionCreateSerializer(many=True)
     
     class Meta:
@@ -251,16 +274,21 @@ class OrderItemOptionGroupCreateSerializer(serializers.ModelSerializer):
         
 
 class OrderItemCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=MenuItem.objects.all(), source='menu_item')
+    # Validated against the menu in `OrderCreateSerializer.validate`
+    id = serializers.IntegerField(source='menu_item_id')
     option_groups = OrderItemOptionGroupCreateSerializer(many=True)
     
     class Meta:
         model = OrderItem
         fields = ['id', 'option_groups', 'quantity']
+        extra_kwargs = {
+            'quantity': {'min_value': 1},
+        }
 
 
 class OrderCreateSerializer(serializers.ModelSerializer):
     items = OrderItemCreateSerializer(many=True)
+    initial_status = Order.IN_KITCHEN
 
     class Meta:
         model = Order
@@ -274,28 +302,80 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Restaurant is closed')
         return restaurant
 
+    def validate(self, data):
+        '''
+        Validates the ordered items and options against the restaurant's current menu, and prices them.
+        '''
+        menu = data['restaurant'].current_menu
+        if menu is None:
+            raise serializers.ValidationError('Restaurant is closed')
+
+        menu_graph = menu.graph
+        for item_data in data['items']:
+            item_data['unit_price'], option_prices = menu_graph.price_item(
+                item_data['menu_item_id'],
+                [
+                    (
+                        option_group_data['menu_item_option_group_id'], 
+                        [option_data['menu_item_option_id'] for option_data in option_group_data['options']]
+                    )
+                    for option_group_data in item_data['option_groups']
+                ],
+            )
+            for option_group_data in item_data['option_groups']:
+                for option_data in option_group_data['options']:
+                    option_data['price'] = option_prices[option_data['menu_item_option_id']]
+                    item_data['unit_price'] += option_data['price']
+        return data
+
     @transaction.atomic
     def create(self, validated_data):
+        # Prices are copied from the menu so that later menu changes don't affect the order
+        items_data = validated_data['items']
+        items_price = [item_data['unit_price'] * item_data.get('quantity', 1) for item_data in items_data]
         order = Order.objects.create(
             client=validated_data['client'], 
             restaurant=validated_data['restaurant'], 
             created=timezone.now(),
+            status=self.initial_status,
+            price=sum(items_price),
         )
-        for item_data in validated_data['items']:
-            order_item = OrderItem.objects.create(
-                menu_item=item_data['menu_item'], 
-                order=order
+
+        # One INSERT per table, regardless of the number of items and options
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(
+                menu_item_id=item_data['menu_item_id'], 
+                order=order,
+                quantity=item_data.get('quantity', 1),
+                unit_price=item_data['unit_price'],
+                price=price,
             )
-            for option_group_data in item_data['option_groups']:
-                order_item_option_group = OrderItemOptionGroup.objects.create(
-                    menu_item_option_group=option_group_data['menu_item_option_group'],
-                    order_item=order_item
-                )
-                for option_data in option_group_data['options']:
-                    OrderItemOption.objects.create(
-                        menu_item_option=option_data['menu_item_option'],
-                        order_item_option_group=order_item_option_group
-                    )
+            for item_data, price in zip(items_data, items_price)
+        ])
+        order_item_option_groups = OrderItemOptionGroup.objects.bulk_create([
+            OrderItemOptionGroup(
+                menu_item_option_group_id=option_group_data['menu_item_option_group_id'],
+                order_item=order_item
+            )
+            for item_data, order_item in zip(items_data, order_items)
+            for option_group_data in item_data['option_groups']
+        ])
+        option_groups_data = [
+            option_group_data 
+            for item_data in items_data
+            for option_group_data in item_data['option_groups']
+        ]
+        OrderItemOption.objects.bulk_create([
+            OrderItemOption(
+                menu_item_option_id=option_data['menu_item_option_id'],
+                order_item_option_group=order_item_option_group,
+                price=option_data['price'],
+            )
+            for option_group_data, order_item_option_group in zip(option_groups_data, order_item_option_groups)
+            for option_data in option_group_data['options']
+        ])
+        # For the response, which lists the order's items and options
+        prefetch_related_objects([order], 'items__option_groups__options')
         return order
 
 
@@ -342,6 +422,7 @@ class DeliveryOrderCreateSerializer(OrderCreateSerializer):
         method_name='get_estimated_delivery_datetime'
     )
     delivery_cost = serializers.SerializerMethodField(method_name='get_delivery_cost')
+    initial_status = Order.SEARCHING_FOR_RIDER
     
     class Meta(OrderCreateSerializer.Meta):
         fields = OrderCreateSerializer.Meta.fields \
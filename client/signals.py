@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from client.models import Review
+from merchant.models import Restaurant
+
+
+@receiver(pre_save, sender=Review)
+def load_previous_restaurant(sender, instance, **kwargs):
+    if not instance._state.adding:
+        # An edited review may have moved to another restaurant, whose rating it must be removed from
+        instance.previous_restaurant_id = Review.objects.filter(id=instance.id) \
+            .values_list('restaurant_id', flat=True).first()
+
+
+@receiver(post_save, sender=Review)
+def add_review_rating(sender, instance, created, **kwargs):
+    if created:
+        Restaurant.objects.filter(id=instance.restaurant_id).add_rating(instance.rating)
+    else:
+        # Reviews are rarely edited, so recalculate instead of tracking the previous rating
+        restaurant_ids = {instance.restaurant_id, getattr(instance, 'previous_restaurant_id', None)} - {None}
+        Restaurant.objects.filter(id__in=restaurant_ids).rebuild_ratings()
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    Restaurant.objects.filter(id=instance.restaurant_id).remove_rating(instance.rating)
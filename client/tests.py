@@ -1,3 +1,157 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from client.models import Review
+from delivery.authentication import TokenAuthMiddleware
+from delivery.routing import websocket_urlpatterns
+from delivery.testing import clear_caches, create_client, create_order, create_restaurant
+from merchant.models import Order, Restaurant
+
+
+class PrefetchPlanTests(TestCase):
+    '''
+    Endpoints with nested serializers take the same number of queries regardless of the payload size
+    '''
+    def setUp(self):
+        self.client_ = create_client()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_.user)
+
+    def test_order_detail(self):
+        restaurant = create_restaurant(num_items=10, num_option_groups=3, num_options=3)
+        for num_items in (1, 10):
+            order = create_order(restaurant, self.client_, num_items=num_items)
+            with self.assertNumQueries(4):
+                response = self.api.get(f'/client/orders/{order.id}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['items']), num_items)
+
+    def test_menu_item_detail(self):
+        for num_option_groups in (1, 5):
+            restaurant = create_restaurant(num_option_groups=num_option_groups, num_options=3)
+            menu_item = restaurant.menus.get().categories.get().items.get()
+            with self.assertNumQueries(3):
+                response = self.api.get(f'/client/restaurants/{restaurant.id}/items/{menu_item.id}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['option_groups']), num_option_groups)
+
+    def test_review_list(self):
+        restaurant = create_restaurant()
+        for num_reviews in (1, 10):
+            for _ in range(num_reviews):
+                Review.objects.create(client=create_client(), restaurant=restaurant, rating=5, text='Good')
+            with self.assertNumQueries(1):
+                response = self.api.get(f'/client/restaurants/{restaurant.id}/reviews/')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 11)
+
+
+class ReviewCreateTests(TestCase):
+    '''
+    Clients review the restaurants of their orders from the last 5 days
+    '''
+    def setUp(self):
+        self.client_ = create_client()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_.user)
+        self.order = create_order(create_restaurant(), self.client_)
+
+    def post(self, order):
+        return self.api.post(f'/client/orders/{order.id}/review/', {'rating': 4, 'text': 'Good food'})
+
+    def test_review(self):
+        response = self.post(self.order)
+        self.assertEqual(response.status_code, 201)
+        review = Review.objects.get()
+        self.assertEqual((review.client, review.restaurant), (self.client_, self.order.restaurant))
+        self.assertEqual(response.data['client']['id'], self.client_.id)
+
+    def test_order_older_than_5_days(self):
+        Order.objects.filter(id=self.order.id).update(created=timezone.now() - timedelta(days=6))
+        self.assertEqual(self.post(self.order).status_code, 400)
+        self.assertFalse(Review.objects.exists())
+
+    def test_order_of_another_client(self):
+        self.assertEqual(self.post(create_order(self.order.restaurant, create_client())).status_code, 404)
+        self.assertFalse(Review.objects.exists())
+
+
+class RatingTests(TestCase):
+    '''
+    Restaurant ratings are kept up to date as reviews are written
+    '''
+    def test_saving_a_stale_restaurant(self):
+        restaurant = create_restaurant()
+        stale_restaurant = Restaurant.objects.get(id=restaurant.id)
+        Review.objects.create(client=create_client(), restaurant=restaurant, rating=4, text='Good')
+        stale_restaurant.name = 'Renamed'
+        stale_restaurant.save()
+
+        restaurant.refresh_from_db()
+        self.assertEqual(restaurant.name, 'Renamed')
+        self.assertEqual((restaurant.rating_sum, restaurant.rating_count), (4, 1))
+
+    def test_review_moved_to_another_restaurant(self):
+        restaurant, other_restaurant = create_restaurant(), create_restaurant()
+        review = Review.objects.create(client=create_client(), restaurant=restaurant, rating=4, text='Good')
+        review.restaurant = other_restaurant
+        review.save()
+
+        restaurant.refresh_from_db()
+        other_restaurant.refresh_from_db()
+        self.assertEqual((restaurant.rating_sum, restaurant.rating_count), (0, 0))
+        self.assertEqual((other_restaurant.rating_sum, other_restaurant.rating_count), (4, 1))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'delivery.layers.BoundedInMemoryChannelLayer'}})
+class OrderSocketTests(TransactionTestCase):
+    '''
+    Clients subscribe to the activity of their own orders only
+    '''
+    def setUp(self):
+        clear_caches()
+        self.client_ = create_client()
+        self.key = Token.objects.create(user=self.client_.user).key
+
+    def subscribe(self, order):
+        '''
+        Subscribes to the order, cancels it, and returns whether the connection was accepted and the order's
+        status in the events received until the cancellation
+        '''
+        async def subscribe():
+            communicator = WebsocketCommunicator(
+                TokenAuthMiddleware(URLRouter(websocket_urlpatterns)),
+                f'/client/orders/{order.id}/?token={self.key}',
+            )
+            connected, _ = await communicator.connect()
+            statuses = []
+            if connected:
+                await communicator.send_json_to({'action': 'subscribe_to_order_activity', 'request_id': 1})
+                # Joins the group before the order is cancelled
+                await communicator.receive_nothing()
+                await database_sync_to_async(order.cancel)('Reason')
+                # The order's creation is also sent, if it is flushed after the subscription
+                while Order.CANCELLED not in statuses:
+                    message = await communicator.receive_json_from(timeout=5)
+                    statuses.extend(event.get('status') for event in message['orders'])
+            await communicator.disconnect()
+            return connected, statuses
+
+        return async_to_sync(subscribe)()
+
+    def test_own_order(self):
+        connected, statuses = self.subscribe(create_order(create_restaurant(), self.client_))
+        self.assertTrue(connected)
+        self.assertEqual(statuses[-1], Order.CANCELLED)
+
+    def test_order_of_another_client(self):
+        connected, _ = self.subscribe(create_order(create_restaurant(), create_client()))
+        self.assertFalse(connected)
@@ -1,7 +1,10 @@
 from django.db import transaction
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from datetime import timedelta
+import hashlib
+import json
 from rest_framework import views
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
@@ -9,10 +12,12 @@ from rest_framework.response import Response
 from rest_framework import status
 from client.models import Review
 from client.permissions import IsClient
-from client.serializers import ClientRegisterSerializer, DeliveryOrderCreateSerializer, MenuItemDetailSerializer, OrderDetailSerializer, ReviewSerializer, SelfPickupOrderCreateSerializer, OrderListSerializer, RestaurantDetailSerializer, RestaurantListSerializer
+from client.serializers import ClientRegisterSerializer, DeliveryOrderCreateSerializer, MenuItemDetailSerializer, NearbyRestaurantsQuerySerializer, OrderDetailSerializer, ReviewSerializer, SelfPickupOrderCreateSerializer, OrderListSerializer, RestaurantDetailSerializer, RestaurantListSerializer, get_menu_document_key
 from delivery import settings
+from delivery.mixins import PrefetchPlanMixin
 from delivery.views import BaseRegister
 from merchant.models import MenuItem, Order, Restaurant
+from merchant.utils import calc_delivery_quotes
 
 
 class Register(BaseRegister):
@@ -20,33 +25,62 @@ class Register(BaseRegister):
 
 
 class RestaurantList(generics.ListAPIView):
-    # TODO: Sort by closest
-    # TODO: Cache, page, limit.
+    '''
+    Lists the `limit` nearest open restaurants within `radius` meters of the user, closest first
+    '''
     permission_classes = [IsAuthenticated, IsClient]
-    queryset = Restaurant.objects.all()
+    queryset = Restaurant.objects.with_num_orders_in_progress()
     serializer_class = RestaurantListSerializer
     # filter_backends = [filters.SearchFilter]
     # search_fields = ["name"]
 
-    def list(self, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
+    def list(self, request, *args, **kwargs):
+        query_serializer = NearbyRestaurantsQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        params = query_serializer.validated_data
+
+        restaurants = self.filter_queryset(self.get_queryset()).nearest(
+            latitude=params['user_latitude'], 
+            longitude=params['user_longitude'], 
+            radius=params['radius'], 
+            limit=params['limit']
+        )
+        context = self.get_serializer_context()
+        context['delivery_quotes'] = calc_delivery_quotes(
+            restaurants, params['user_latitude'], params['user_longitude']
+        )
+        serializer = self.get_serializer_class()(restaurants, many=True, context=context)
         return Response(serializer.data)
 
     
 class RestaurantDetail(generics.RetrieveAPIView):
+    '''
+    Supports If-None-Match, so that clients can revalidate a restaurant and its menu without downloading it
+    '''
     permission_classes = [IsAuthenticated, IsClient]
     queryset = Restaurant.objects.all()
     serializer_class = RestaurantDetailSerializer
     lookup_url_kwarg = 'restaurant_id'
 
-
-class ReviewList(generics.ListAPIView):
+    def retrieve(self, request, *args, **kwargs):
+        restaurant = self.get_object()
+        current_menu = restaurant.current_menu
+        context = {**self.get_serializer_context(), 'current_menu': current_menu}
+        data = self.get_serializer_class()(restaurant, context=context).data
+
+        # The menu is identified by its version rather than hashed
+        etag_data = {
+            **data, 
+            'current_menu': get_menu_document_key(current_menu) if current_menu is not None else None,
+        }
+        etag = quote_etag(hashlib.md5(json.dumps(etag_data, sort_keys=True, default=str).encode()).hexdigest())
+        headers = {'ETag': etag}
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(data, headers=headers)
+
+
+class ReviewList(PrefetchPlanMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated, IsClient]
     serializer_class = ReviewSerializer
     lookup_url_kwarg = 'restaurant_id'
@@ -62,14 +96,14 @@ class ReviewCreate(generics.CreateAPIView):
     lookup_url_kwarg = 'restaurant_id'
 
     def post(self, *args, **kwargs):
-        order = Order.objects.get(id=self.kwargs['order_id'])
-        if order.created >= timezone.now() - timedelta(days=5):
+        self.order = generics.get_object_or_404(Order, id=self.kwargs['order_id'], client=self.request.user.client)
+        if self.order.created < timezone.now() - timedelta(days=5):
             return Response(
                 status=status.HTTP_400_BAD_REQUEST, 
                 data={'Cannot review based on order created more than 5 days ago.'}
             )
 
-        reviews = Review.objects.filter(client=order.client, restaurant=order.restaurant)
+        reviews = Review.objects.filter(client=self.order.client, restaurant=self.order.restaurant)
         if reviews.exists():
             return Response(
                 status=status.HTTP_400_BAD_REQUEST, 
@@ -77,9 +111,12 @@ class ReviewCreate(generics.CreateAPIView):
             )
         
         return super().post(*args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save(client=self.order.client, restaurant=self.order.restaurant)
     
 
-class MenuItemDetail(generics.RetrieveAPIView):
+class MenuItemDetail(PrefetchPlanMixin, generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated, IsClient]
     serializer_class = MenuItemDetailSerializer
     lookup_url_kwarg = 'menu_item_id'
@@ -94,16 +131,16 @@ class OrderList(generics.ListAPIView):
     serializer_class = OrderListSerializer
 
     def get_queryset(self):
-        return Order.objects.filter(client=self.request.user.client)
+        return Order.objects.filter(client=self.request.user.client).with_type()
 
 
-class OrderDetail(generics.RetrieveAPIView):
+class OrderDetail(PrefetchPlanMixin, generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated, IsClient]
     serializer_class = OrderDetailSerializer
     lookup_url_kwarg = 'order_id'
 
     def get_queryset(self):
-        return Order.objects.filter(client=self.request.user.client)
+        return Order.objects.filter(client=self.request.user.client).with_type()
 
 
 class DeliveryOrderCreate(generics.CreateAPIView):
@@ -137,10 +174,7 @@ class OrderCancel(views.APIView):
         except ValidationError as e:
             return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': e.message}) 
         
-        # TODO: Notify restaurant
-
-        # TODO: Notify rider    
-
+        # The restaurant and the rider are notified by `merchant.fanout`
         return Response(status=status.HTTP_200_OK)
 
 
@@ -157,8 +191,5 @@ class OrderComplete(views.APIView):
         except ValidationError as e:
             return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': e.message}) 
         
-        # TODO: Notify restaurant
-        
-        # TODO: Notify rider
-
+        # The restaurant and the rider are notified by `merchant.fanout`
         return Response(status=status.HTTP_200_OK)
@@ -20,11 +20,15 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'delivery.settings')
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
+from delivery.authentication import TokenAuthMiddleware  # noqa: E402
+
 application = ProtocolTypeRouter({
     'http': django_asgi_app,
     'websocket': AllowedHostsOriginValidator(
-        URLRouter(
-            websocket_urlpatterns
+        TokenAuthMiddleware(
+            URLRouter(
+                websocket_urlpatterns
+            )
         )
     ),
 })
@@ -0,0 +1,129 @@
+'''
+Token authentication for the REST API and the WebSocket consumers. Tokens are the opaque keys of
+`rest_framework.authtoken`, issued by `delivery.views.Login`, so passwords are only hashed at login.
+
+Resolving a token to its user and the user's role (client, merchant or rider) is cached, so that authenticating
+a request or a WebSocket connection doesn't query the database. The cache holds field values rather than model
+instances, and every request gets its own instances, so that relations loaded during one request aren't seen
+by another.
+'''
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from delivery.cache import LayeredCache
+from delivery.models import User
+
+
+ROLES = ['client', 'merchant', 'rider']
+
+# Token key -> the token's user id, or None. Keys are random and never reassigned, so only deleted tokens
+# are invalidated. The local timeouts bound how long other processes accept a revoked token or a deactivated user.
+token_cache = LayeredCache('delivery.token', timeout=15 * 60, local_timeout=3)
+# User id -> `get_principal_values` of the user, or None
+principal_cache = LayeredCache('delivery.principal', timeout=15 * 60, local_timeout=3)
+
+
+def get_field_values(instance, exclude=()):
+    fields = [field for field in instance._meta.concrete_fields if field.attname not in exclude]
+    return [field.attname for field in fields], [getattr(instance, field.attname) for field in fields]
+
+
+def get_principal_values(user_id):
+    try:
+        user = User.objects.select_related(*ROLES).get(id=user_id)
+    except User.DoesNotExist:
+        return None
+    roles = {}
+    for role in ROLES:
+        role_object = getattr(user, role, None)
+        if role_object is not None:
+            roles[role] = get_field_values(role_object)
+    # The password is left deferred, so that its hash isn't cached
+    return get_field_values(user, exclude={'password'}), roles
+
+
+def get_user_for_token(key):
+    '''
+    Returns the token's user with its role loaded, so that `user.client`, `user.merchant` and `user.rider`
+    don't query the database, or None if the token doesn't exist
+    '''
+    user_id = token_cache.get_or_build(
+        key, lambda: Token.objects.filter(key=key).values_list('user_id', flat=True).first()
+    )
+    if user_id is None:
+        return None
+    values = principal_cache.get_or_build(user_id, lambda: get_principal_values(user_id))
+    if values is None:
+        return None
+
+    (field_names, field_values), roles = values
+    user = User.from_db(DEFAULT_DB_ALIAS, field_names, field_values)
+    for role in ROLES:
+        related = getattr(User, role).related
+        role_object = None
+        if role in roles:
+            role_object = related.related_model.from_db(DEFAULT_DB_ALIAS, *roles[role])
+            related.field.set_cached_value(role_object, user)
+        related.set_cached_value(user, role_object)
+    return user
+
+
+def get_role(user):
+    return next((role for role in ROLES if hasattr(user, role)), None)
+
+
+def invalidate_token(key):
+    # After commit, so that the token cannot be resolved from the old rows in the meantime
+    transaction.on_commit(lambda: token_cache.invalidate(key))
+
+
+def invalidate_principal(user_id):
+    transaction.on_commit(lambda: principal_cache.invalidate(user_id))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    `TokenAuthentication` that resolves tokens with `get_user_for_token`
+    '''
+
+    def authenticate_credentials(self, key):
+        user = get_user_for_token(key)
+        if user is None:
+            raise AuthenticationFailed('Invalid token.')
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return user, key
+
+
+class TokenAuthMiddleware:
+    '''
+    Sets `scope['user']` of WebSocket connections from the token in the `Authorization: Token <key>` header,
+    or in the `token` query parameter for browsers, which can't set headers on WebSockets
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        key = self.get_key(scope)
+        user = None
+        if key is not None:
+            user = await database_sync_to_async(get_user_for_token)(key)
+        if user is None or not user.is_active:
+            user = AnonymousUser()
+        return await self.app({**scope, 'user': user}, receive, send)
+
+    def get_key(self, scope):
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                keyword, _, key = value.decode('latin1').partition(' ')
+                if keyword == CachedTokenAuthentication.keyword and key:
+                    return key
+        keys = parse_qs(scope.get('query_string', b'').decode()).get('token')
+        return keys[0] if keys else None
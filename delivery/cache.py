@@ -0,0 +1,109 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.core.cache import cache as shared_cache
+
+
+_MISSING = object()
+
+
+class LayeredCache:
+    '''
+    An in-process LRU in front of Django's default cache, which is shared between processes when `CACHES`
+    points at a shared backend. Local entries expire after `local_timeout` seconds, which bounds how long
+    other processes can serve an entry after it is invalidated.
+
+    Invalidating a key bumps its version in the shared cache, and shared entries are stored with the version
+    that was current before they were built, so that a value built from rows read before an invalidation can't
+    be written back after it.
+    '''
+    # Every layered cache in the process, so that tests can drop local entries between cases
+    instances = weakref.WeakSet()
+
+    def __init__(self, prefix, timeout, local_timeout, max_local_entries=1024):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.local_timeout = local_timeout
+        self.max_local_entries = max_local_entries
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        LayeredCache.instances.add(self)
+
+    def _shared_key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def _version_key(self, key):
+        return f'{self.prefix}:{key}:version'
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._local.move_to_end(key)
+                    return value
+                del self._local[key]
+        return _MISSING
+
+    def _get_shared(self, key):
+        '''
+        Returns the shared entry, or `_MISSING` if there is none of the current version, and the current version
+        '''
+        shared_key, version_key = self._shared_key(key), self._version_key(key)
+        entries = shared_cache.get_many([shared_key, version_key])
+        version = entries.get(version_key, 0)
+        entry = entries.get(shared_key)
+        if entry is None or entry[0] != version:
+            return _MISSING, version
+        return entry[1], version
+
+    def _set(self, key, value, version):
+        shared_cache.set(self._shared_key(key), (version, value), self.timeout)
+        self._set_local(key, value)
+
+    def get(self, key, default=None):
+        value = self._get_local(key)
+        if value is _MISSING:
+            value, _ = self._get_shared(key)
+            if value is _MISSING:
+                return default
+            self._set_local(key, value)
+        return value
+
+    def set(self, key, value):
+        self._set(key, value, shared_cache.get(self._version_key(key), 0))
+
+    def get_or_build(self, key, build):
+        value = self._get_local(key)
+        if value is _MISSING:
+            # The version is read before building, so that an invalidation during the build discards the value
+            value, version = self._get_shared(key)
+            if value is _MISSING:
+                value = build()
+                self._set(key, value, version)
+            else:
+                self._set_local(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+        # Versions outlive the entries written with them, so that a version that expires can't revive them
+        version_key = self._version_key(key)
+        shared_cache.add(version_key, 0, 2 * self.timeout)
+        shared_cache.incr(version_key)
+        shared_cache.delete(self._shared_key(key))
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._local[key] = (value, time.monotonic() + self.local_timeout)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
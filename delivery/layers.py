@@ -0,0 +1,259 @@
+'''
+An in-memory channel layer for single-process deployments and tests, which needs no Redis. Like
+`channels.layers.InMemoryChannelLayer`, it only reaches the consumers of its own process. Unlike it:
+- Messages can be sent from any thread, such as `merchant.fanout`'s timer thread. Receivers are woken on
+  their own event loop.
+- Each channel's queue is bounded. Sending to a full channel raises `ChannelFull`, and group sends skip full
+  channels, so that a slow consumer neither holds back the others nor grows the process' memory. Skipped
+  messages are counted in the metrics.
+- Expired messages and group memberships are cleaned up as the channels and groups are used, rather than by
+  scanning every channel on each receive and group send.
+- A group send copies the message once, and the copy is shared by the channels of the group. Consumers must
+  not modify the messages they receive.
+'''
+import asyncio
+import random
+import string
+import threading
+import time
+from collections import deque
+from copy import deepcopy
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+
+class ChannelQueue:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.messages = deque()  # (expiry time, message)
+        self.waiters = deque()  # Futures of the receivers waiting for a message
+
+
+class ChannelLayerMetrics:
+    '''
+    Counters of the layer since the last `snapshot`
+    '''
+
+    def __init__(self):
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        self.started = now
+        self.sent = 0
+        self.received = 0
+        self.full = 0  # Messages not sent because the channel was full
+        self.expired = 0  # Messages expired before they were received
+        self.group_sends = 0
+        self.max_queued = 0  # Most messages queued on a channel
+
+    def snapshot(self, channels, groups, queued):
+        now = time.monotonic()
+        elapsed = max(now - self.started, 1e-9)
+        snapshot = {
+            'seconds': elapsed,
+            'sent_per_second': self.sent / elapsed,
+            'received_per_second': self.received / elapsed,
+            'group_sends_per_second': self.group_sends / elapsed,
+            'full': self.full,
+            'expired': self.expired,
+            'max_queued': self.max_queued,
+            'channels': channels,
+            'groups': groups,
+            'queued': queued,
+        }
+        self._reset(now)
+        return snapshot
+
+
+class BoundedInMemoryChannelLayer(BaseChannelLayer):
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.group_expiry = group_expiry
+        self.metrics = ChannelLayerMetrics()
+        self._lock = threading.Lock()
+        self._channels = {}  # Channel -> `ChannelQueue`
+        self._groups = {}  # Group -> channel -> time joined
+        self._channel_groups = {}  # Channel -> groups, to remove channels whose messages expire from their groups
+        self._next_sweep = time.time() + expiry
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+
+        message = deepcopy(message)
+        with self._lock:
+            if not self._put(channel, message, time.time()):
+                raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        '''
+        Receives the first message on the channel. If several coroutines wait on the channel, the longest
+        waiting one gets it.
+        '''
+        assert self.valid_channel_name(channel)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                now = time.time()
+                self._sweep(now)
+                queue = self._get_queue(channel)
+                self._expire(channel, queue, now)
+                if queue.messages:
+                    _, message = queue.messages.popleft()
+                    self.metrics.received += 1
+                    self._discard_if_unused(channel, queue)
+                    return message
+                waiter = loop.create_future()
+                queue.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                with self._lock:
+                    if waiter in queue.waiters:
+                        queue.waiters.remove(waiter)
+                    elif waiter.cancelled() and queue.messages:
+                        # Woken, then cancelled before it received
+                        self._wake_next(queue)
+                    self._discard_if_unused(channel, queue)
+
+    async def new_channel(self, prefix='specific.'):
+        return '%s.inmemory!%s' % (prefix, ''.join(random.choice(string.ascii_letters) for i in range(12)))
+
+    # Flush extension
+
+    async def flush(self):
+        with self._lock:
+            self._channels = {}
+            self._groups = {}
+            self._channel_groups = {}
+
+    async def close(self):
+        pass
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        with self._lock:
+            self._groups.setdefault(group, {})[channel] = time.time()
+            self._channel_groups.setdefault(channel, set()).add(group)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+        with self._lock:
+            self._discard(group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+
+        message = deepcopy(message)
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            self.metrics.group_sends += 1
+            members = self._groups.get(group)
+            if not members:
+                return
+            for channel, joined in list(members.items()):
+                if joined < now - self.group_expiry:
+                    self._discard(group, channel)
+                    continue
+                # Full channels are skipped, and counted by `_put`
+                self._put(channel, message, now)
+
+    # Metrics
+
+    def metrics_snapshot(self):
+        '''
+        Returns the rates and backpressure counters since the last snapshot, and the current number of channels,
+        groups and queued messages
+        '''
+        with self._lock:
+            queued = sum(len(queue.messages) for queue in self._channels.values())
+            return self.metrics.snapshot(len(self._channels), len(self._groups), queued)
+
+    # The methods below are called with the lock held
+
+    def _get_queue(self, channel):
+        queue = self._channels.get(channel)
+        if queue is None:
+            queue = self._channels[channel] = ChannelQueue(self.get_capacity(channel))
+        return queue
+
+    def _put(self, channel, message, now):
+        '''
+        Queues the message and wakes a receiver. Returns False if the channel is full.
+        '''
+        queue = self._get_queue(channel)
+        if len(queue.messages) >= queue.capacity:
+            self._expire(channel, queue, now)
+        if len(queue.messages) >= queue.capacity:
+            self.metrics.full += 1
+            return False
+
+        queue.messages.append((now + self.expiry, message))
+        self.metrics.sent += 1
+        self.metrics.max_queued = max(self.metrics.max_queued, len(queue.messages))
+        self._wake_next(queue)
+        return True
+
+    def _wake_next(self, queue):
+        while queue.waiters:
+            waiter = queue.waiters.popleft()
+            if not waiter.done():
+                waiter.get_loop().call_soon_threadsafe(wake, waiter)
+                return
+
+    def _expire(self, channel, queue, now):
+        expired = False
+        while queue.messages and queue.messages[0][0] < now:
+            queue.messages.popleft()
+            self.metrics.expired += 1
+            expired = True
+        if expired:
+            # Nothing has received from the channel for `expiry` seconds, so its consumer is gone
+            for group in list(self._channel_groups.get(channel, ())):
+                self._discard(group, channel)
+
+    def _discard(self, group, channel):
+        members = self._groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self._groups[group]
+        groups = self._channel_groups.get(channel)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self._channel_groups[channel]
+
+    def _sweep(self, now):
+        # At most once per `expiry`, so that the channels of consumers that are gone without leaving their groups
+        # don't keep their messages
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.expiry
+        for channel, queue in list(self._channels.items()):
+            self._expire(channel, queue, now)
+            self._discard_if_unused(channel, queue)
+
+    def _discard_if_unused(self, channel, queue):
+        if not queue.messages and not queue.waiters and self._channels.get(channel) is queue:
+            del self._channels[channel]
+
+
+def wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
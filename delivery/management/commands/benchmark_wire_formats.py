@@ -0,0 +1,74 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from merchant.fanout import serialize_orders
+from merchant.models import Order
+from merchant.wire import encode_dictionary, encode_orders
+
+
+class Command(BaseCommand):
+    help = 'Compares the bytes per message and encoding time of the JSON and msgpack v1 WebSocket formats of ' \
+           'order events, on the open orders of the database. Run `manage.py seed_city` first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=1, help='Orders per message')
+        parser.add_argument('--repeat', type=int, default=5, help='Times each message is encoded, to time it')
+
+    def handle(self, *args, **options):
+        order_ids = list(Order.objects.open().order_by('id').values_list('id', flat=True)[:options['orders']])
+        if not order_ids:
+            raise CommandError('No open orders. Run `manage.py seed_city` first.')
+        documents = list(serialize_orders(order_ids).values())
+        deltas = [delta for document in documents for delta in get_deltas(document)]
+
+        batch_size = options['batch_size']
+        for title, events in [('Documents', documents), ('Deltas', deltas)]:
+            batches = [events[i:i + batch_size] for i in range(0, len(events), batch_size)]
+            self.stdout.write(f'{title}: {len(batches)} messages of {batch_size} events')
+            self.report('JSON', batches, encode_json, options['repeat'])
+            self.report('msgpack v1', batches, lambda batch: encode_orders(batch)[0], options['repeat'])
+            # The names are sent once per connection, so this is the most that a message costs
+            self.report('msgpack v1 with dictionary', batches, encode_with_dictionary, options['repeat'])
+
+    def report(self, title, batches, encode, repeat):
+        # Also warms up the encoder before it is timed
+        size = sum(len(encode(batch)) for batch in batches) / len(batches)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for batch in batches:
+                encode(batch)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'  {title}: {size:.0f} bytes/message, '
+                          f'{elapsed * 1e6 / (repeat * len(batches)):.1f} µs/encode')
+
+
+def encode_json(batch):
+    # As `send_json` encodes it, for each connection
+    return json.dumps({'type': 'order_activity', 'orders': batch}).encode()
+
+
+def encode_with_dictionary(batch):
+    frame, names = encode_orders(batch)
+    return encode_dictionary(names) + frame
+
+
+def get_deltas(document):
+    '''
+    Returns the deltas that `merchant.fanout` sends for typical changes of the order
+    '''
+    item = document['items'][0]
+    return [
+        # Status changes
+        {'id': document['id'], 'status': Order.READY_TO_PICKUP_AT_RESTAURANT},
+        # A rider accepting the order
+        {'id': document['id'], 'rider_session': 1, 'estimated_completion_datetime':
+            document['estimated_completion_datetime'], 'status': Order.IN_KITCHEN},
+        # A price adjustment
+        {'id': document['id'], 'price': document['price'], 'items': [
+            {'instance_id': item['instance_id'], 'price': item['price'],
+             'price_adjustment': {'adjustment': '-1.00', 'reason': 'Out of stock'}},
+        ]},
+    ]
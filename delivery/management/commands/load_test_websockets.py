@@ -0,0 +1,124 @@
+import asyncio
+import json
+import statistics
+import time
+
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from delivery.authentication import TokenAuthMiddleware
+from delivery.routing import websocket_urlpatterns
+from merchant.fanout import order_fanout
+from merchant.models import Merchant, Order
+
+
+class Command(BaseCommand):
+    help = 'Connects simulated merchant WebSockets in this process, and measures the latency of order changes ' \
+           'fanned out to them. Run `manage.py seed_city` first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--restaurants', type=int, default=200, help='Restaurants that the connections are spread over')
+        parser.add_argument('--changes', type=int, default=5000, help='Order changes to fan out')
+        parser.add_argument('--rate', type=float, default=1000, help='Order changes per second')
+        parser.add_argument('--idle-timeout', type=float, default=2,
+                            help='Seconds without frames after the last change before stopping')
+
+    def handle(self, *args, **options):
+        merchants = list(Merchant.objects.filter(restaurant__orders__status__in=Order.OPEN_STATUSES)
+                         .distinct().order_by('restaurant_id')[:options['restaurants']])
+        if not merchants:
+            raise CommandError('No restaurants with open orders. Run `manage.py seed_city` first.')
+        tokens = [Token.objects.get_or_create(user_id=merchant.user_id)[0].key for merchant in merchants]
+        orders = list(Order.objects.open().filter(restaurant__in=[merchant.restaurant_id for merchant in merchants])
+                      .values_list('id', 'restaurant_id'))
+
+        self.stdout.write(f'Channel layer: {type(get_channel_layer()).__name__}')
+        self.stdout.write(f'{options["connections"]} connections to {len(merchants)} restaurants with '
+                          f'{len(orders)} open orders')
+        latencies, frames, connect_time = asyncio.run(self.run(merchants, tokens, orders, options))
+        self.report(latencies, frames, connect_time)
+
+    async def run(self, merchants, tokens, orders, options):
+        app = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+        start = time.perf_counter()
+        communicators = []
+        for i in range(options['connections']):
+            merchant, token = merchants[i % len(merchants)], tokens[i % len(merchants)]
+            communicator = WebsocketCommunicator(app, f'/merchant/restaurants/{merchant.restaurant_id}/orders/'
+                                                      f'?token={token}')
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError(f'Connection to restaurant {merchant.restaurant_id} was rejected')
+            await communicator.send_json_to({'action': 'subscribe_to_order_activity', 'request_id': i})
+            communicators.append(communicator)
+        connect_time = time.perf_counter() - start
+        # The subscriptions aren't acknowledged
+        await asyncio.sleep(1)
+
+        sent = {}  # Sequence number -> time the change was buffered
+        latencies = []
+        frames = [0]
+        last_frame = [time.perf_counter()]
+
+        async def read(communicator):
+            while True:
+                output = await communicator.output_queue.get()
+                now = time.perf_counter()
+                frames[0] += 1
+                last_frame[0] = now
+                for event in json.loads(output['text'])['orders']:
+                    # The latency of an event is from the last change merged into it
+                    latencies.append(now - sent[event['sequence']])
+
+        readers = [asyncio.create_task(read(communicator)) for communicator in communicators]
+        order_fanout.metrics.snapshot()
+        layer = get_channel_layer()
+        if hasattr(layer, 'metrics_snapshot'):
+            layer.metrics_snapshot()
+
+        start = time.perf_counter()
+        await self.change_orders(orders, sent, options['changes'], options['rate'])
+        # The rate is lower than --rate when the consumers saturate the event loop
+        self.num_changes, self.change_time = options['changes'], time.perf_counter() - start
+        while time.perf_counter() - max(last_frame[0], max(sent.values())) < options['idle_timeout']:
+            await asyncio.sleep(0.1)
+
+        for reader in readers:
+            reader.cancel()
+        self.fanout_metrics = order_fanout.metrics.snapshot()
+        self.layer_metrics = layer.metrics_snapshot() if hasattr(layer, 'metrics_snapshot') else None
+        for communicator in communicators:
+            await communicator.disconnect()
+        return latencies, frames[0], connect_time
+
+    async def change_orders(self, orders, sent, num_changes, rate):
+        # On the event loop rather than in a thread, which the consumers would starve of the GIL.
+        # `order_changed` only buffers the change.
+        start = time.perf_counter()
+        for sequence in range(num_changes):
+            delay = start + sequence / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            order_id, restaurant_id = orders[sequence % len(orders)]
+            sent[sequence] = time.perf_counter()
+            order_fanout.order_changed(order_id, restaurant_id, {'sequence': sequence})
+
+    def report(self, latencies, frames, connect_time):
+        self.stdout.write(f'Connected in {connect_time:.1f} s')
+        self.stdout.write(f'Sent {self.num_changes} changes in {self.change_time:.1f} s '
+                          f'({self.num_changes / self.change_time:.0f} changes/s)')
+        self.stdout.write(f'Received {len(latencies)} order events in {frames} frames')
+        if latencies:
+            latencies = sorted(latency * 1000 for latency in latencies)
+            quantiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(f'Latency: p50 {quantiles[49]:.1f} ms, p95 {quantiles[94]:.1f} ms, '
+                              f'p99 {quantiles[98]:.1f} ms, max {latencies[-1]:.1f} ms')
+        self.stdout.write('Fan-out: ' + ', '.join(f'{key} {value:.1f}' for key, value in self.fanout_metrics.items()))
+        if self.layer_metrics is not None:
+            self.stdout.write('Channel layer: ' + ', '.join(f'{key} {value:.1f}' if isinstance(value, float)
+                                                            else f'{key} {value}'
+                                                            for key, value in self.layer_metrics.items()))
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery.seed import DEFAULT_BOUNDING_BOX, seed_dataset
+
+
+class Command(BaseCommand):
+    help = 'Seeds a city of restaurants, clients and riders with historical orders, for load tests and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=10000)
+        parser.add_argument('--menus', type=int, default=2, help='Menus per restaurant, which split its opening hours')
+        parser.add_argument('--categories', type=int, default=2, help='Categories per menu')
+        parser.add_argument('--items', type=int, default=5, help='Menu items per category')
+        parser.add_argument('--holidays', type=int, default=500, help='Restaurants with an upcoming holiday')
+        parser.add_argument('--pauses', type=int, default=200, help='Restaurants that are currently paused')
+        parser.add_argument('--clients', type=int, default=50000)
+        parser.add_argument('--riders', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=5000, help='Current orders, in every status')
+        parser.add_argument('--historical-orders', type=int, default=200000)
+        parser.add_argument('--history-days', type=int, default=30, help='Days of rider sessions and historical orders')
+        parser.add_argument('--reviews', type=int, default=100000)
+        parser.add_argument('--bbox', type=float, nargs=4, default=DEFAULT_BOUNDING_BOX,
+                            metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['menus'] * options['categories'] * options['items'] < 2:
+            raise CommandError('Restaurants need at least 2 menu items, as every order has 2 items')
+        if options['history_days'] < 1:
+            raise CommandError('--history-days must be at least 1')
+        if max(options['holidays'], options['pauses']) > options['restaurants']:
+            raise CommandError('--holidays and --pauses cannot exceed --restaurants')
+
+        start = time.perf_counter()
+        counts = seed_dataset(
+            num_restaurants=options['restaurants'],
+            num_clients=options['clients'],
+            num_riders=options['riders'],
+            num_orders=options['orders'],
+            num_historical_orders=options['historical_orders'],
+            num_menus=options['menus'],
+            num_categories=options['categories'],
+            num_items=options['items'],
+            num_reviews=options['reviews'],
+            num_holidays=options['holidays'],
+            num_pauses=options['pauses'],
+            history_days=options['history_days'],
+            bounding_box=tuple(options['bbox']),
+            random_seed=options['seed'],
+            batch_size=options['batch_size'],
+            chunk_size=options['chunk_size'],
+        )
+        elapsed = time.perf_counter() - start
+
+        for label, count in sorted(counts.items()):
+            self.stdout.write(f'{label:>30} {count:>10}')
+        total = sum(counts.values())
+        self.stdout.write(f'Seeded {total} rows in {elapsed:.1f} s ({total / elapsed:.0f} rows/s)')
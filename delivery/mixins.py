@@ -0,0 +1,12 @@
+from delivery.prefetch import apply_prefetch_plan
+
+
+class PrefetchPlanMixin:
+    '''
+    Applies the prefetch plan of the view's serializer to its queryset, so that rendering the response
+    takes the same number of queries regardless of its size. See `delivery.prefetch.get_prefetch_plan`.
+    '''
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return apply_prefetch_plan(queryset, self.get_serializer())
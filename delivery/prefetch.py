@@ -0,0 +1,81 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+def get_prefetch_plan(serializer, model):
+    '''
+    Returns the `select_related` and `prefetch_related` lookups needed to render instances of `model` with
+    `serializer` without lazily loading relations.
+
+    The plan follows the serializer's fields through the model's relations: forward and reverse one-to-one
+    relations and foreign keys are selected, and reverse foreign keys and many-to-many relations are
+    prefetched with their own plans. Relations used by `SerializerMethodField`s can't be followed, so they
+    are declared in the serializer's `Meta.select_related` and `Meta.prefetch_related`.
+    '''
+    if isinstance(serializer, ListSerializer):
+        serializer = serializer.child
+    meta = getattr(serializer, 'Meta', None)
+    select_related = list(getattr(meta, 'select_related', []))
+    prefetch_related = [
+        Prefetch(lookup) if isinstance(lookup, str) else lookup 
+        for lookup in getattr(meta, 'prefetch_related', [])
+    ]
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        # Follow the field's source through relations, up to the first to-many relation
+        field_model = model
+        lookup = []
+        relation = None
+        for attr in field.source_attrs:
+            try:
+                model_field = field_model._meta.get_field(attr)
+            except FieldDoesNotExist:
+                break
+            # `get_field` also resolves foreign key columns, e.g. `menu_item_id`
+            if not model_field.is_relation or attr != model_field.name:
+                break
+            relation = model_field
+            lookup.append(attr)
+            field_model = relation.related_model
+            if relation.one_to_many or relation.many_to_many:
+                break
+        if not lookup:
+            continue
+
+        path = '__'.join(lookup)
+        renders_relation = len(lookup) == len(field.source_attrs)
+        if relation.one_to_many or relation.many_to_many:
+            queryset = field_model._default_manager.all()
+            if renders_relation and isinstance(field, BaseSerializer):
+                queryset = apply_prefetch_plan(queryset, field)
+            prefetch_related.append(Prefetch(path, queryset=queryset))
+        elif renders_relation and isinstance(field, BaseSerializer):
+            child_select_related, child_prefetch_related = get_prefetch_plan(field, field_model)
+            select_related.append(path)
+            select_related += [f'{path}__{lookup}' for lookup in child_select_related]
+            prefetch_related += [
+                Prefetch(f'{path}__{prefetch.prefetch_through}', queryset=prefetch.queryset)
+                for prefetch in child_prefetch_related
+            ]
+        elif renders_relation and isinstance(field, PrimaryKeyRelatedField):
+            # Rendered from the foreign key column
+            if len(lookup) > 1:
+                select_related.append('__'.join(lookup[:-1]))
+        else:
+            select_related.append(path)
+
+    return select_related, prefetch_related
+
+
+def apply_prefetch_plan(queryset, serializer):
+    select_related, prefetch_related = get_prefetch_plan(serializer, queryset.model)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
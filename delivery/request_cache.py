@@ -0,0 +1,18 @@
+'''
+Objects that the permissions and the view of a request share, such as the order in the url, so that each one is
+loaded once per request. They are stored on the request, so they are released with it.
+'''
+
+
+def memoize(request, key, load):
+    '''
+    Returns the object stored on `request` under `key`, calling `load` to get it on first use. Exceptions 
+    raised by `load` aren't memoized.
+    '''
+    try:
+        objects = request._memoized_objects
+    except AttributeError:
+        objects = request._memoized_objects = {}
+    if key not in objects:
+        objects[key] = load()
+    return objects[key]
@@ -1,4 +1,6 @@
 
+from client.routing import websocket_urlpatterns as client_websocket_urlpatterns
 from merchant.routing import websocket_urlpatterns as merchant_websocket_urlpatterns
+from rider.routing import websocket_urlpatterns as rider_websocket_urlpatterns
 
-websocket_urlpatterns = merchant_websocket_urlpatterns
+websocket_urlpatterns = client_websocket_urlpatterns + merchant_websocket_urlpatterns + rider_websocket_urlpatterns
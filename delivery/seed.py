@@ -0,0 +1,353 @@
+'''
+Seeds a realistic dataset with bulk inserts, for benchmarks and regression tests. Bulk inserts skip
+`save()` and signals, so derived columns (geohashes, ratings) are filled in here.
+
+Rows are created `chunk_size` at a time and only ids and prices are kept between chunks, so that millions of
+rows can be seeded without holding their model instances in memory.
+'''
+import random
+import uuid
+from collections import Counter
+from datetime import time, timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from client.models import Client, Review
+from delivery.models import User
+from merchant.models import Delivery, Holiday, Menu, MenuCategory, MenuHours, MenuItem, MenuItemOption, \
+    MenuItemOptionGroup, Merchant, Order, OrderCancellation, OrderItem, OrderItemOption, OrderItemOptionGroup, \
+    PauseHours, Restaurant, SelfPickup
+from merchant.utils import encode_geohash
+from rider.models import Rider, Session
+
+
+# (min_latitude, min_longitude, max_latitude, max_longitude)
+DEFAULT_BOUNDING_BOX = (1.25, 103.65, 1.45, 104.0)
+
+# Every 5th restaurant only opens for lunch and dinner, the others are open all day
+ALL_DAY = [(time(0), time(23, 59, 59))]
+LUNCH_AND_DINNER = [(time(11), time(14)), (time(17), time(22))]
+
+DELIVERY_STATUSES = [Order.SEARCHING_FOR_RIDER, Order.IN_KITCHEN, Order.READY_TO_PICKUP_AT_RESTAURANT,
+                     Order.DELIVERY_IN_TRANSIT, Order.COMPLETED, Order.CANCELLED]
+SELF_PICKUP_STATUSES = [Order.IN_KITCHEN, Order.READY_TO_PICKUP_AT_RESTAURANT, Order.COMPLETED, Order.CANCELLED]
+
+# Sessions last 4 hours, and historical orders are created in the first 3 hours of a session
+SESSION_LENGTH = timedelta(hours=4)
+HISTORICAL_CANCELLATION_RATE = 0.05
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def random_price(rng, low, high):
+    return Decimal(rng.randrange(int(low * 10), int(high * 10) + 1)) / 10
+
+
+def to_time(seconds):
+    return time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def get_menu_hours(restaurant_index, num_menus):
+    '''
+    Returns the (start_time, end_time) tuples of each of the restaurant's menus. The restaurant's opening
+    hours are split evenly between its menus, e.g. into a breakfast, a lunch and a dinner menu.
+    '''
+    menu_hours = [[] for _ in range(num_menus)]
+    for start, end in (LUNCH_AND_DINNER if restaurant_index % 5 == 4 else ALL_DAY):
+        start_seconds = start.hour * 3600 + start.minute * 60 + start.second
+        end_seconds = end.hour * 3600 + end.minute * 60 + end.second
+        # Split on whole minutes, with the last menu closing when the restaurant closes
+        boundaries = [start_seconds + (end_seconds - start_seconds) * i // num_menus // 60 * 60
+                      for i in range(num_menus)] + [end_seconds]
+        for menu_index in range(num_menus):
+            menu_hours[menu_index].append((to_time(boundaries[menu_index]), to_time(boundaries[menu_index + 1])))
+    return menu_hours
+
+
+class Seeder:
+    '''
+    Bulk creates rows in batches of `batch_size`, and counts them by model
+    '''
+    def __init__(self, rng, batch_size):
+        self.rng = rng
+        self.batch_size = batch_size
+        self.counts = Counter()
+
+    def create(self, model, objects):
+        objects = model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.counts[model._meta.label] += len(objects)
+        return objects
+
+    def create_users(self, role, indices, run):
+        return self.create(User, [
+            User(username=f'{role}{i}.{run}@example.com', first_name=role.title(), last_name=str(i),
+                 phone_number='+6591234567', password='!')
+            for i in indices
+        ])
+
+    def seed_menus(self, restaurants, restaurant_indices, num_menus, num_categories, num_items):
+        '''
+        Returns the menu items of each restaurant as (menu_item_id, price, size, add_ons) tuples, where the
+        size and add-ons are (option_group_id, options) tuples and options are (option_id, price) tuples
+        '''
+        rng = self.rng
+        menus = self.create(Menu, [
+            Menu(name=f'Menu {i}', restaurant_id=restaurant.id)
+            for restaurant in restaurants for i in range(num_menus)
+        ])
+        self.create(MenuHours, [
+            MenuHours(menu_id=menu.id, day_of_the_week=day, start_time=start, end_time=end)
+            for restaurant_index, restaurant_menus in zip(restaurant_indices, chunked(menus, num_menus))
+            for menu, menu_hours in zip(restaurant_menus, get_menu_hours(restaurant_index, num_menus))
+            for day in range(7)
+            for start, end in menu_hours
+        ])
+        categories = self.create(MenuCategory, [
+            MenuCategory(name=f'Category {i}', menu_id=menu.id) for menu in menus for i in range(num_categories)
+        ])
+        items = self.create(MenuItem, [
+            MenuItem(name=f'Item {i}', price=random_price(rng, 3, 25), menu_category_id=category.id)
+            for category in categories for i in range(num_items)
+        ])
+
+        # Each item has a size to pick and optional add-ons
+        option_groups = self.create(MenuItemOptionGroup, [
+            MenuItemOptionGroup(name=name, type=type, menu_item_id=item.id)
+            for item in items
+            for name, type in [('Size', MenuItemOptionGroup.MANDATORY_ONE_ONLY),
+                               ('Add-ons', MenuItemOptionGroup.OPTIONAL_MULTIPLE)]
+        ])
+        options = self.create(MenuItemOption, [
+            MenuItemOption(name=f'Option {i}', option_group_id=option_group.id, price=random_price(rng, 0, 3))
+            for option_group in option_groups
+            for i in range(3)
+        ])
+
+        options_by_group = {}
+        for option in options:
+            options_by_group.setdefault(option.option_group_id, []).append((option.id, option.price))
+        restaurant_ids_by_menu = {menu.id: menu.restaurant_id for menu in menus}
+        restaurant_ids_by_category = {
+            category.id: restaurant_ids_by_menu[category.menu_id] for category in categories
+        }
+        items_by_restaurant = {}
+        for item, (size, add_ons) in zip(items, chunked(option_groups, 2)):
+            items_by_restaurant.setdefault(restaurant_ids_by_category[item.menu_category_id], []).append((
+                item.id,
+                item.price,
+                (size.id, options_by_group[size.id]),
+                (add_ons.id, options_by_group[add_ons.id]),
+            ))
+        return items_by_restaurant
+
+    def seed_orders(self, order_specs, items_by_restaurant):
+        '''
+        Creates orders from (is_delivery, status, created, restaurant_id, client_id, session_id) tuples
+        '''
+        rng = self.rng
+        orders = []
+        order_items = []
+        for is_delivery, status, created, restaurant_id, client_id, _ in order_specs:
+            order = Order(
+                client_id=client_id,
+                restaurant_id=restaurant_id,
+                created=created,
+                status=status,
+                kitchen_completed=created + timedelta(minutes=15) if status in (
+                    Order.READY_TO_PICKUP_AT_RESTAURANT, Order.DELIVERY_IN_TRANSIT, Order.COMPLETED) else None,
+                completed=created + timedelta(minutes=40) if status == Order.COMPLETED else None,
+                price=0,
+            )
+            for menu_item_id, price, (size_id, sizes), (add_ons_id, add_ons) in \
+                    rng.sample(items_by_restaurant[restaurant_id], 2):
+                quantity = rng.randint(1, 3)
+                picked = [(size_id, [rng.choice(sizes)]), (add_ons_id, rng.sample(add_ons, rng.randint(0, 2)))]
+                unit_price = price + sum(option_price for _, options in picked for _, option_price in options)
+                order.price += unit_price * quantity
+                order_items.append((order, menu_item_id, quantity, unit_price, picked))
+            orders.append(order)
+        self.create(Order, orders)
+
+        self.create(OrderCancellation, [
+            OrderCancellation(order_id=order.id, reason='Seeded cancellation')
+            for order in orders if order.status == Order.CANCELLED
+        ])
+        deliveries = []
+        self_pickups = []
+        for order, (is_delivery, status, created, _, _, session_id) in zip(orders, order_specs):
+            if is_delivery:
+                deliveries.append(Delivery(
+                    order_id=order.id,
+                    session_id=session_id,
+                    delivery_cost=random_price(rng, 1, 10),
+                    estimated_delivery_datetime=created + timedelta(minutes=45),
+                    rider_pickup_datetime=created + timedelta(minutes=20) if status in (
+                        Order.DELIVERY_IN_TRANSIT, Order.COMPLETED) else None,
+                ))
+            else:
+                self_pickups.append(SelfPickup(order_id=order.id,
+                                               estimated_pickup_datetime=created + timedelta(minutes=25)))
+        self.create(Delivery, deliveries)
+        self.create(SelfPickup, self_pickups)
+
+        created_items = self.create(OrderItem, [
+            OrderItem(order_id=order.id, menu_item_id=menu_item_id, quantity=quantity, unit_price=unit_price,
+                      price=unit_price * quantity)
+            for order, menu_item_id, quantity, unit_price, _ in order_items
+        ])
+        group_specs = [
+            (order_item, option_group_id, options)
+            for order_item, (_, _, _, _, picked) in zip(created_items, order_items)
+            for option_group_id, options in picked
+        ]
+        created_groups = self.create(OrderItemOptionGroup, [
+            OrderItemOptionGroup(order_item_id=order_item.id, menu_item_option_group_id=option_group_id)
+            for order_item, option_group_id, _ in group_specs
+        ])
+        self.create(OrderItemOption, [
+            OrderItemOption(order_item_option_group_id=order_item_option_group.id, menu_item_option_id=option_id,
+                            price=option_price)
+            for order_item_option_group, (_, _, options) in zip(created_groups, group_specs)
+            for option_id, option_price in options
+        ])
+
+
+def get_order_specs(rng, num_orders, num_historical_orders, restaurant_ids, client_ids, current_session_ids,
+                    session_starts_by_day, now):
+    '''
+    Yields (is_delivery, status, created, restaurant_id, client_id, session_id) tuples. Current orders are in
+    every status, and historical orders were completed or cancelled during the riders' past sessions.
+    '''
+    # Two thirds of the orders are deliveries, and each type of current order cycles through its statuses
+    for i in range(num_orders):
+        is_delivery = i % 3 != 0
+        statuses = DELIVERY_STATUSES if is_delivery else SELF_PICKUP_STATUSES
+        status = statuses[(i - i // 3 - 1 if is_delivery else i // 3) % len(statuses)]
+        # Current sessions started an hour ago
+        created = now - timedelta(minutes=rng.randrange(5, 55)) \
+            if status in (Order.COMPLETED, Order.CANCELLED) else now - timedelta(minutes=rng.randrange(1, 30))
+        session_id = rng.choice(current_session_ids) \
+            if is_delivery and status not in (Order.SEARCHING_FOR_RIDER, Order.CANCELLED) else None
+        yield is_delivery, status, created, rng.choice(restaurant_ids), rng.choice(client_ids), session_id
+
+    days = list(session_starts_by_day)
+    for i in range(num_historical_orders):
+        is_delivery = i % 3 != 0
+        status = Order.CANCELLED if rng.random() < HISTORICAL_CANCELLATION_RATE else Order.COMPLETED
+        session_id, start = rng.choice(session_starts_by_day[rng.choice(days)])
+        created = start + timedelta(minutes=rng.randrange(0, 180))
+        session_id = session_id if is_delivery and status == Order.COMPLETED else None
+        yield is_delivery, status, created, rng.choice(restaurant_ids), rng.choice(client_ids), session_id
+
+
+@transaction.atomic
+def seed_dataset(num_restaurants=1000, num_clients=200, num_riders=100, num_orders=2000, num_historical_orders=0,
+                 num_menus=1, num_categories=2, num_items=4, num_reviews=3000, num_holidays=0, num_pauses=0,
+                 history_days=1, bounding_box=DEFAULT_BOUNDING_BOX, random_seed=0, batch_size=500,
+                 chunk_size=10000):
+    '''
+    Seeds restaurants with menus, holidays and pauses, clients, riders with sessions, current orders in every
+    status, historical orders and reviews. Every rider has a session on each of the past `history_days` days,
+    and most riders are currently in a session at a random location. Returns the number of rows created per
+    model.
+    '''
+    rng = random.Random(random_seed)
+    seeder = Seeder(rng, batch_size)
+    # Usernames are unique across runs, so that a database can be seeded more than once
+    run = uuid.uuid4().hex[:8]
+    now = timezone.now()
+    min_latitude, min_longitude, max_latitude, max_longitude = bounding_box
+
+    restaurant_ids = []
+    items_by_restaurant = {}
+    for indices in chunked(range(num_restaurants), chunk_size):
+        restaurants = []
+        for i in indices:
+            latitude = round(rng.uniform(min_latitude, max_latitude), 7)
+            longitude = round(rng.uniform(min_longitude, max_longitude), 7)
+            restaurants.append(Restaurant(
+                name=f'Restaurant {i}',
+                address=f'{i} Seed Street',
+                latitude=latitude,
+                longitude=longitude,
+                geohash=encode_geohash(latitude, longitude),
+            ))
+        restaurants = seeder.create(Restaurant, restaurants)
+        seeder.create(Merchant, [
+            Merchant(user_id=user.id, restaurant_id=restaurant.id)
+            for user, restaurant in zip(seeder.create_users('merchant', indices, run), restaurants)
+        ])
+        items_by_restaurant.update(seeder.seed_menus(restaurants, indices, num_menus, num_categories, num_items))
+        restaurant_ids += [restaurant.id for restaurant in restaurants]
+
+    holidays = []
+    for restaurant_id in rng.sample(restaurant_ids, num_holidays):
+        start = now + timedelta(days=rng.randint(1, 30))
+        holidays.append(Holiday(restaurant_id=restaurant_id, start_datetime=start,
+                                end_datetime=start + timedelta(days=rng.randint(1, 3))))
+    seeder.create(Holiday, holidays)
+    seeder.create(PauseHours, [
+        PauseHours(restaurant_id=restaurant_id, start_datetime=now - timedelta(minutes=30),
+                   end_datetime=now + timedelta(minutes=rng.randint(30, 120)), reason='Seeded pause')
+        for restaurant_id in rng.sample(restaurant_ids, num_pauses)
+    ])
+
+    client_ids = []
+    for indices in chunked(range(num_clients), chunk_size):
+        client_ids += [client.id for client in seeder.create(Client, [
+            Client(user_id=user.id) for user in seeder.create_users('client', indices, run)
+        ])]
+    rider_ids = []
+    for indices in chunked(range(num_riders), chunk_size):
+        rider_ids += [rider.id for rider in seeder.create(Rider, [
+            Rider(user_id=user.id) for user in seeder.create_users('rider', indices, run)
+        ])]
+
+    session_starts_by_day = {}
+    past_sessions = (
+        (day, Session(rider_id=rider_id, start_datetime=now - timedelta(days=day) - SESSION_LENGTH,
+                      end_datetime=now - timedelta(days=day)))
+        for day in range(1, history_days + 1)
+        for rider_id in rider_ids
+    )
+    for chunk in chunked(past_sessions, chunk_size):
+        days, sessions = zip(*chunk)
+        for day, session in zip(days, seeder.create(Session, list(sessions))):
+            session_starts_by_day.setdefault(day, []).append((session.id, session.start_datetime))
+    current_sessions = []
+    for rider_id in rider_ids[:max(1, num_riders * 4 // 5)]:
+        latitude = round(rng.uniform(min_latitude, max_latitude), 7)
+        longitude = round(rng.uniform(min_longitude, max_longitude), 7)
+        current_sessions.append(Session(
+            rider_id=rider_id,
+            start_datetime=now - timedelta(hours=1),
+            end_datetime=now + timedelta(hours=3),
+            latitude=latitude,
+            longitude=longitude,
+            geohash=encode_geohash(latitude, longitude),
+            location_updated=now,
+        ))
+    current_session_ids = [session.id for session in seeder.create(Session, current_sessions)]
+
+    order_specs = get_order_specs(rng, num_orders, num_historical_orders, restaurant_ids, client_ids,
+                                  current_session_ids, session_starts_by_day, now)
+    for chunk in chunked(order_specs, chunk_size):
+        seeder.seed_orders(chunk, items_by_restaurant)
+
+    reviews = (
+        Review(client_id=rng.choice(client_ids), restaurant_id=rng.choice(restaurant_ids),
+               rating=rng.randint(1, 5), text='Seeded review')
+        for _ in range(num_reviews)
+    )
+    for chunk in chunked(reviews, chunk_size):
+        seeder.create(Review, chunk)
+    Restaurant.objects.rebuild_ratings()
+
+    return seeder.counts
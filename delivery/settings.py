@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'phonenumber_field',
     'channels',
+    'rest_framework.authtoken',
     'delivery',
     'client', 
     'merchant', 
@@ -84,6 +86,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Tests run concurrent requests, which an in-memory database fails with "database table is locked"
+        # instead of waiting for
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -134,14 +141,45 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Use a shared backend (e.g. Redis or Memcached) when running several processes, so that cache 
+# invalidations reach all of them. See `delivery.cache.LayeredCache`.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Django REST framework
+# Tokens are issued by `delivery.views.Login`. Sessions are kept for the browsable API.
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'delivery.authentication.CachedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+}
+
 # Channel layers
+# Redis reaches the consumers of every process. The in-memory layer needs no Redis, but only reaches the consumers
+# of its own process: set CHANNEL_LAYER=memory for single-process deployments. See `delivery.layers`.
+CHANNEL_LAYER = os.environ.get('CHANNEL_LAYER', 'redis')
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            'hosts': [('localhost', 6379)],
+        'redis': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [('localhost', 6379)],
+            },
         },
-    }
+        'memory': {
+            'BACKEND': 'delivery.layers.BoundedInMemoryChannelLayer',
+            'CONFIG': {
+                # Messages queued per consumer, beyond which group sends skip the consumer
+                'capacity': 100,
+            },
+        },
+    }[CHANNEL_LAYER],
 }
 
 
@@ -0,0 +1,30 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from client.models import Client
+from delivery.authentication import invalidate_principal, invalidate_token
+from delivery.models import User
+from merchant.models import Merchant
+from rider.models import Rider
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token_for_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_principal_for_user(sender, instance, **kwargs):
+    invalidate_principal(instance.id)
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+@receiver(post_save, sender=Merchant)
+@receiver(post_delete, sender=Merchant)
+@receiver(post_save, sender=Rider)
+@receiver(post_delete, sender=Rider)
+def invalidate_principal_for_role(sender, instance, **kwargs):
+    invalidate_principal(instance.user_id)
@@ -0,0 +1,104 @@
+from datetime import time, timedelta
+from itertools import count
+
+from django.core.cache import cache as shared_cache
+from django.utils import timezone
+
+from client.models import Client
+from delivery.cache import LayeredCache
+from delivery.models import User
+from merchant.models import Delivery, Menu, MenuCategory, MenuHours, MenuItem, MenuItemOption, \
+    MenuItemOptionGroup, Merchant, Order, OrderItem, OrderItemOption, OrderItemOptionGroup, Restaurant, SelfPickup
+from rider.models import Rider, Session
+
+
+_usernames = count()
+
+
+def create_user():
+    return User.objects.create(
+        username=f'user{next(_usernames)}@example.com',
+        first_name='First',
+        last_name='Last',
+        phone_number='+6591234567',
+    )
+
+
+def create_client():
+    return Client.objects.create(user=create_user())
+
+
+def create_session():
+    rider = Rider.objects.create(user=create_user())
+    return Session.objects.create(rider=rider, end_datetime=timezone.now() + timedelta(hours=3))
+
+
+def create_restaurant(num_categories=1, num_items=1, num_option_groups=1, num_options=1,
+                      latitude=1.3, longitude=103.8):
+    '''
+    Creates a restaurant and its merchant, with a menu that is open all week
+    '''
+    restaurant = Restaurant.objects.create(name='Restaurant', address='Address',
+                                           latitude=latitude, longitude=longitude)
+    Merchant.objects.create(user=create_user(), restaurant=restaurant)
+    menu = Menu.objects.create(name='Menu', restaurant=restaurant)
+    for day in range(7):
+        MenuHours.objects.create(menu=menu, day_of_the_week=day, start_time=time(0), end_time=time(23, 59, 59))
+    for category_index in range(num_categories):
+        category = MenuCategory.objects.create(name=f'Category {category_index}', menu=menu)
+        for item_index in range(num_items):
+            menu_item = MenuItem.objects.create(name=f'Item {item_index}', price='5.50', menu_category=category)
+            for option_group_index in range(num_option_groups):
+                option_group = MenuItemOptionGroup.objects.create(
+                    name=f'Group {option_group_index}',
+                    menu_item=menu_item,
+                    type=MenuItemOptionGroup.OPTIONAL_MULTIPLE,
+                )
+                for option_index in range(num_options):
+                    MenuItemOption.objects.create(name=f'Option {option_index}', option_group=option_group,
+                                                  price='0.50')
+    return restaurant
+
+
+def create_order(restaurant, client, delivery=True, num_items=1):
+    '''
+    Creates an order of the restaurant's first `num_items` menu items, with all of their options
+    '''
+    order = Order.objects.create(
+        client=client,
+        restaurant=restaurant,
+        status=Order.SEARCHING_FOR_RIDER if delivery else Order.IN_KITCHEN,
+    )
+    menu_items = MenuItem.objects.filter(menu_category__menu__restaurant=restaurant) \
+        .prefetch_related('option_groups__options')[:num_items]
+    for menu_item in menu_items:
+        unit_price = menu_item.price + sum(
+            option.price for option_group in menu_item.option_groups.all() for option in option_group.options.all()
+        )
+        order_item = OrderItem.objects.create(menu_item=menu_item, order=order, unit_price=unit_price,
+                                              price=unit_price)
+        order.price += unit_price
+        for option_group in menu_item.option_groups.all():
+            order_item_option_group = OrderItemOptionGroup.objects.create(
+                menu_item_option_group=option_group,
+                order_item=order_item,
+            )
+            for option in option_group.options.all():
+                OrderItemOption.objects.create(menu_item_option=option,
+                                               order_item_option_group=order_item_option_group,
+                                               price=option.price)
+    order.save(update_fields=['price'])
+    if delivery:
+        Delivery.objects.create(order=order, delivery_cost=3, estimated_delivery_datetime=timezone.now())
+    else:
+        SelfPickup.objects.create(order=order, estimated_pickup_datetime=timezone.now())
+    return order
+
+
+def clear_caches():
+    '''
+    Clears the shared cache and every layered cache's local entries, which outlive test transactions
+    '''
+    shared_cache.clear()
+    for layered_cache in list(LayeredCache.instances):
+        layered_cache.clear_local()
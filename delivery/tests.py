@@ -0,0 +1,554 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from importlib import import_module
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from client.models import Review
+from delivery.authentication import CachedTokenAuthentication, TokenAuthMiddleware
+from delivery.cache import LayeredCache
+from delivery.layers import BoundedInMemoryChannelLayer
+from delivery.models import User
+from delivery.routing import websocket_urlpatterns
+from delivery.seed import seed_dataset
+from delivery.testing import clear_caches, create_client, create_restaurant
+from merchant.models import Delivery, Holiday, Menu, MenuCategory, MenuItem, Order, Restaurant
+from rider.dispatch import dispatch_deliveries
+from rider.models import Rider
+
+
+BUDGETS_PATH = Path(__file__).with_name('budgets.json')
+
+# `user_id` is None for anonymous requests. `data` is the query string of GET requests and the JSON body of
+# the others.
+Endpoint = namedtuple('Endpoint', ['url_name', 'method', 'path', 'user_id', 'data'])
+
+
+def get_budget_key(endpoint):
+    return f'{endpoint.url_name} {endpoint.method}'
+
+
+class EndpointBudgetTests(TestCase):
+    '''
+    Requests every URL of the client, merchant and rider APIs against a seeded dataset, and checks that each
+    endpoint succeeds, and its status, query count, wall time and response size against `budgets.json`.
+
+    GET requests are measured after a warm-up request, and other requests are rolled back after they are
+    measured, so that every endpoint sees the same data. Set ENDPOINT_BUDGET_REPORT to a path to write the
+    measurements as JSON, and UPDATE_ENDPOINT_BUDGETS=1 to rewrite the budgets from them.
+    '''
+    # Budgets leave headroom for noise in wall time and for response sizes that depend on ids and dates
+    TIME_HEADROOM = 10
+    MIN_TIME_BUDGET_MS = 250
+    BYTES_HEADROOM = 1.25
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(num_restaurants=2000, num_clients=300, num_riders=150, num_orders=3000,
+                     num_historical_orders=2000, num_categories=1, num_items=3, num_reviews=4000, history_days=7)
+        now = timezone.now()
+
+        # Every 5th seeded restaurant only opens for lunch and dinner, so the first one is always open
+        cls.restaurant = Restaurant.objects.order_by('id').first()
+        cls.menu_item = MenuItem.objects.filter(menu_category__menu__restaurant=cls.restaurant) \
+            .prefetch_related('option_groups__options').order_by('id').first()
+
+        def get_order(status, is_delivery=True):
+            return Order.objects.filter(status=status, delivery__isnull=not is_delivery) \
+                .select_related('client', 'restaurant__merchant', 'delivery__session__rider').order_by('id').first()
+
+        cls.searching_order = get_order(Order.SEARCHING_FOR_RIDER)
+        cls.kitchen_order = get_order(Order.IN_KITCHEN)
+        cls.ready_order = get_order(Order.READY_TO_PICKUP_AT_RESTAURANT)
+        cls.ready_self_pickup_order = get_order(Order.READY_TO_PICKUP_AT_RESTAURANT, is_delivery=False)
+        cls.in_transit_order = get_order(Order.DELIVERY_IN_TRANSIT)
+        # Orders can be reviewed within 5 days, once per restaurant
+        reviewed = Review.objects.filter(client=OuterRef('client'), restaurant=OuterRef('restaurant'))
+        cls.completed_order = Order.objects.filter(status=Order.COMPLETED, created__gte=now - timedelta(days=4)) \
+            .exclude(Exists(reviewed)).select_related('client').order_by('id').first()
+
+        cls.merchant_restaurant = cls.kitchen_order.restaurant
+        cls.menu = cls.merchant_restaurant.menus.get()
+        # Ordered menu items are protected from deletion, so a new menu and item are deleted
+        cls.new_menu_item = MenuItem.objects.create(name='New item', price='4.00',
+                                                    menu_category=cls.menu.categories.first())
+        cls.new_menu = Menu.objects.create(name='New menu', restaurant=cls.merchant_restaurant)
+        MenuItem.objects.create(name='New item', price='4.00',
+                                menu_category=MenuCategory.objects.create(name='New category', menu=cls.new_menu))
+        cls.holiday = Holiday.objects.create(restaurant=cls.merchant_restaurant,
+                                             start_datetime=now + timedelta(days=7),
+                                             end_datetime=now + timedelta(days=8))
+        cls.session = cls.in_transit_order.delivery.session
+        dispatch_deliveries()
+        cls.dispatched_session = Delivery.objects.filter(proposed_session__isnull=False) \
+            .select_related('proposed_session__rider').order_by('id').first().proposed_session
+        cls.idle_rider = Rider.objects.exclude(session__end_datetime__gt=now).order_by('id').first()
+
+    def setUp(self):
+        clear_caches()
+
+    def get_endpoints(self):
+        now = timezone.now()
+        client_user_id = self.searching_order.client.user_id
+        merchant_user_id = self.merchant_restaurant.merchant.user_id
+        rider_user_id = self.session.rider.user_id
+        restaurant_id = self.restaurant.id
+        merchant_restaurant_id = self.merchant_restaurant.id
+        menu_id = self.menu.id
+        menu_item_id = self.menu.categories.first().items.order_by('id').first().id
+        order_id = self.kitchen_order.id
+        order_item_id = self.kitchen_order.items.order_by('id').first().id
+        holiday_id = self.holiday.id
+
+        size, _ = self.menu_item.option_groups.all()
+        order_data = {
+            'client': self.searching_order.client_id,
+            'restaurant': restaurant_id,
+            'items': [{
+                'id': self.menu_item.id,
+                'quantity': 2,
+                'option_groups': [{'id': size.id, 'options': [{'id': size.options.all()[0].id}]}],
+            }],
+        }
+        register_data = {
+            'username': 'budget@example.com',
+            'password': 'password',
+            'first_name': 'First',
+            'last_name': 'Last',
+            'phone_number': '+6591234567',
+        }
+        menu_data = {
+            'name': 'Menu',
+            'restaurant': merchant_restaurant_id,
+            'categories': [{
+                'name': 'Category',
+                'items': [{
+                    'name': 'Item',
+                    'price': '5.00',
+                    'option_groups': [{
+                        'name': 'Group',
+                        'type': 'OPTIONAL_MULTIPLE',
+                        'options': [{'name': 'Option', 'price': '0.50'}],
+                    }],
+                }],
+            }],
+        }
+
+        # Delivery costs grow quickly with distance, so clients order from where the restaurant is
+        location = {
+            'user_latitude': str(self.restaurant.latitude),
+            'user_longitude': str(self.restaurant.longitude),
+        }
+
+        client = '/client'
+        merchant = f'/merchant/restaurants/{merchant_restaurant_id}'
+        return [
+            Endpoint('client:register', 'POST', f'{client}/register/', None, register_data),
+            Endpoint('client:restaurants_list', 'GET', f'{client}/restaurants/', client_user_id, location),
+            Endpoint('client:restaurant_detail', 'GET', f'{client}/restaurants/{restaurant_id}/', client_user_id,
+                     location),
+            Endpoint('client:menu_item_detail', 'GET', f'{client}/restaurants/{restaurant_id}/items/'
+                     f'{self.menu_item.id}/', client_user_id, None),
+            Endpoint('client:restaurant_reviews', 'GET', f'{client}/restaurants/{restaurant_id}/reviews/',
+                     client_user_id, None),
+            Endpoint('client:orders_list_create', 'GET', f'{client}/orders/', client_user_id, None),
+            Endpoint('client:delivery_order_create', 'POST', f'{client}/orders/delivery/', client_user_id,
+                     {**order_data, **location}),
+            Endpoint('client:pickup_order_create', 'POST', f'{client}/orders/self-pickup/', client_user_id,
+                     order_data),
+            Endpoint('client:order_detail', 'GET', f'{client}/orders/{self.searching_order.id}/', client_user_id,
+                     None),
+            Endpoint('client:order_cancel', 'POST', f'{client}/orders/{self.searching_order.id}/cancel/',
+                     client_user_id, {'reason': 'Ordered by mistake'}),
+            Endpoint('client:order_complete', 'POST',
+                     f'{client}/orders/{self.ready_self_pickup_order.id}/confirm-received/',
+                     self.ready_self_pickup_order.client.user_id, None),
+            Endpoint('client:review_create', 'POST', f'{client}/orders/{self.completed_order.id}/review/',
+                     self.completed_order.client.user_id, {'rating': 4, 'text': 'Good food'}),
+
+            Endpoint('merchant:restaurants', 'POST', '/merchant/restaurants/', None, {
+                'name': 'Restaurant',
+                'address': 'Address',
+                'latitude': '1.3000000',
+                'longitude': '103.8000000',
+                'merchant': register_data,
+            }),
+            Endpoint('merchant:restuarants', 'GET', f'{merchant}/menu-hours/', merchant_user_id, None),
+            Endpoint('merchant:restuarants', 'POST', f'{merchant}/menu-hours/', merchant_user_id, [
+                {'day_of_the_week': day, 'start_time': '10:00:00', 'end_time': '22:00:00', 'menu': menu_id}
+                for day in range(7)
+            ]),
+            Endpoint('merchant:status', 'GET', f'{merchant}/status/', merchant_user_id, None),
+            Endpoint('merchant:status', 'POST', f'{merchant}/status/', merchant_user_id, {
+                'status': 'PAUSED',
+                'paused_reason': 'Too busy',
+                'paused_until': (now + timedelta(hours=1)).isoformat(),
+            }),
+            Endpoint('merchant:holidays', 'GET', f'{merchant}/holidays/', merchant_user_id, None),
+            Endpoint('merchant:holidays', 'POST', f'{merchant}/holidays/', merchant_user_id, [{
+                'start_datetime': (now + timedelta(days=14)).isoformat(),
+                'end_datetime': (now + timedelta(days=15)).isoformat(),
+            }]),
+            Endpoint('merchant:holidays_detail', 'GET', f'{merchant}/holidays/{holiday_id}/', merchant_user_id,
+                     None),
+            Endpoint('merchant:holidays_detail', 'PATCH', f'{merchant}/holidays/{holiday_id}/', merchant_user_id,
+                     {'end_datetime': (now + timedelta(days=9)).isoformat()}),
+            Endpoint('merchant:holidays_detail', 'DELETE', f'{merchant}/holidays/{holiday_id}/', merchant_user_id,
+                     None),
+            Endpoint('merchant:menus', 'GET', f'{merchant}/menus/', merchant_user_id, None),
+            Endpoint('merchant:menus', 'POST', f'{merchant}/menus/', merchant_user_id, menu_data),
+            Endpoint('merchant:menu_detail', 'GET', f'{merchant}/menus/{menu_id}/', merchant_user_id, None),
+            Endpoint('merchant:menu_detail', 'DELETE', f'{merchant}/menus/{self.new_menu.id}/', merchant_user_id,
+                     None),
+            Endpoint('merchant:menu_items', 'GET', f'{merchant}/menus/{menu_id}/items/', merchant_user_id, None),
+            Endpoint('merchant:menu_item_detail', 'GET', f'{merchant}/menus/{menu_id}/items/{menu_item_id}/',
+                     merchant_user_id, None),
+            Endpoint('merchant:menu_item_detail', 'DELETE',
+                     f'{merchant}/menus/{menu_id}/items/{self.new_menu_item.id}/',
+                     merchant_user_id, None),
+            Endpoint('merchant:orders_list', 'GET', f'{merchant}/orders/', merchant_user_id, {'open': 'true'}),
+            Endpoint('merchant:order_detail', 'GET', f'{merchant}/orders/{order_id}/', merchant_user_id, None),
+            Endpoint('merchant:order_finish_cooking', 'POST', f'{merchant}/orders/{order_id}/finish-cooking/',
+                     merchant_user_id, None),
+            Endpoint('merchant:order_cancel', 'POST', f'{merchant}/orders/{order_id}/cancel/', merchant_user_id,
+                     {'reason': 'Out of ingredients'}),
+            Endpoint('merchant:order_delay', 'POST', f'{merchant}/orders/{order_id}/delay/', merchant_user_id,
+                     {'delay_by': '00:10:00'}),
+            Endpoint('merchant:order_item_price_adjustment', 'POST',
+                     f'{merchant}/orders/{order_id}/items/{order_item_id}/adjust-price/', merchant_user_id,
+                     {'adjustment': '-1.00', 'reason': 'Missing topping'}),
+
+            Endpoint('rider:register', 'POST', '/rider/register/', None, register_data),
+            Endpoint('rider:sessions', 'GET', '/rider/sessions/', rider_user_id, None),
+            Endpoint('rider:sessions', 'POST', '/rider/sessions/', self.idle_rider.user_id,
+                     {'end_datetime': (now + timedelta(hours=4)).isoformat()}),
+            Endpoint('rider:current_session_end', 'POST', '/rider/sessions/current/end/', rider_user_id, None),
+            Endpoint('rider:current_session_extend', 'POST', '/rider/sessions/current/extend/', rider_user_id,
+                     {'end_datetime': (now + timedelta(hours=5)).isoformat()}),
+            Endpoint('rider:current_session_location', 'POST', '/rider/sessions/current/location/', rider_user_id,
+                     {'latitude': '1.3000000', 'longitude': '103.8000000'}),
+            Endpoint('rider:current_session_orders_list', 'GET', '/rider/sessions/current/orders/', rider_user_id,
+                     None),
+            Endpoint('rider:session_orders_list', 'GET', f'/rider/sessions/{self.session.id}/orders/',
+                     rider_user_id, None),
+            Endpoint('rider:orders', 'GET', '/rider/orders/', self.dispatched_session.rider.user_id, None),
+            Endpoint('rider:order_detail', 'GET', f'/rider/orders/{self.in_transit_order.id}/', rider_user_id,
+                     None),
+            Endpoint('rider:order_accept', 'POST', f'/rider/orders/{self.searching_order.id}/accept/',
+                     rider_user_id, None),
+            Endpoint('rider:order_pickup', 'POST', f'/rider/orders/{self.ready_order.id}/pickup/',
+                     self.ready_order.delivery.session.rider.user_id, None),
+            Endpoint('rider:order_complete', 'POST', f'/rider/orders/{self.in_transit_order.id}/complete/',
+                     rider_user_id, None),
+            Endpoint('rider:order_cancel', 'POST', f'/rider/orders/{self.in_transit_order.id}/cancel/',
+                     rider_user_id, {'reason': 'Accident on the way'}),
+        ]
+
+    def send(self, endpoint):
+        # Authenticates with a fresh user, so that relations cached on the user are not carried between requests
+        api = APIClient(raise_request_exception=False)
+        if endpoint.user_id is not None:
+            api.force_authenticate(User.objects.get(id=endpoint.user_id))
+        if endpoint.method == 'GET':
+            return lambda: api.get(endpoint.path, endpoint.data)
+        return lambda: getattr(api, endpoint.method.lower())(endpoint.path, endpoint.data, format='json')
+
+    def measure(self, endpoint):
+        with transaction.atomic():
+            if endpoint.method == 'GET':
+                self.send(endpoint)()
+            request = self.send(endpoint)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = request()
+                time_ms = (time.perf_counter() - start) * 1000
+            transaction.set_rollback(True)
+        return {
+            'status': response.status_code,
+            'queries': len(queries),
+            'time_ms': round(time_ms, 1),
+            'bytes': len(response.content),
+        }
+
+    def get_budget(self, measurement):
+        return {
+            'status': measurement['status'],
+            'queries': measurement['queries'],
+            'time_ms': max(self.MIN_TIME_BUDGET_MS, math.ceil(measurement['time_ms'] * self.TIME_HEADROOM)),
+            'bytes': math.ceil(measurement['bytes'] * self.BYTES_HEADROOM),
+        }
+
+    def test_every_url_has_an_endpoint(self):
+        url_names = {endpoint.url_name for endpoint in self.get_endpoints()}
+        for namespace in ('client', 'merchant', 'rider'):
+            for pattern in import_module(f'{namespace}.urls').urlpatterns:
+                self.assertIn(f'{namespace}:{pattern.name}', url_names)
+
+    def test_endpoint_budgets(self):
+        # Loads the URL conf and views before the first measurement
+        self.send(Endpoint('rider:orders', 'GET', '/rider/orders/', None, None))()
+
+        measurements = {get_budget_key(endpoint): self.measure(endpoint) for endpoint in self.get_endpoints()}
+
+        if os.environ.get('ENDPOINT_BUDGET_REPORT'):
+            with open(os.environ['ENDPOINT_BUDGET_REPORT'], 'w') as report:
+                json.dump(measurements, report, indent=4)
+        if os.environ.get('UPDATE_ENDPOINT_BUDGETS') == '1':
+            budgets = {key: self.get_budget(measurement) for key, measurement in measurements.items()}
+            BUDGETS_PATH.write_text(json.dumps(budgets, indent=4) + '\n')
+        budgets = json.loads(BUDGETS_PATH.read_text())
+
+        failures = []
+        for key, measurement in measurements.items():
+            budget = budgets.get(key)
+            if budget is None:
+                failures.append(f'{key}: no budget')
+                continue
+            if not 200 <= measurement['status'] < 300:
+                failures.append(f'{key}: status {measurement["status"]} is not a success')
+            if measurement['status'] != budget['status']:
+                failures.append(f'{key}: status {measurement["status"]} != {budget["status"]}')
+            for metric in ('queries', 'time_ms', 'bytes'):
+                if measurement[metric] > budget[metric]:
+                    failures.append(f'{key}: {metric} {measurement[metric]} > {budget[metric]}')
+        if failures:
+            self.fail('Endpoint budgets exceeded:\n' + '\n'.join(failures))
+
+
+class LayeredCacheTests(SimpleTestCase):
+    '''
+    Invalidations reach the shared cache, and values built before an invalidation aren't written back after it
+    '''
+    def setUp(self):
+        clear_caches()
+        self.cache = LayeredCache('tests', timeout=60, local_timeout=60)
+
+    def test_invalidate(self):
+        self.assertEqual(self.cache.get_or_build('key', lambda: 1), 1)
+        self.cache.clear_local()
+        self.assertEqual(self.cache.get('key'), 1)
+        self.cache.invalidate('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.get_or_build('key', lambda: 2), 2)
+        self.cache.clear_local()
+        self.assertEqual(self.cache.get('key'), 2)
+
+    def test_invalidated_while_building(self):
+        def build():
+            # Another process invalidates the key after this one has read the rows
+            self.cache.invalidate('key')
+            return 'stale'
+
+        self.assertEqual(self.cache.get_or_build('key', build), 'stale')
+        # Another process, or this one once the local entry expires
+        self.cache.clear_local()
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.get_or_build('key', lambda: 'fresh'), 'fresh')
+        self.cache.clear_local()
+        self.assertEqual(self.cache.get('key'), 'fresh')
+
+    def test_set_after_invalidate(self):
+        self.cache.set('key', 1)
+        self.cache.invalidate('key')
+        self.cache.set('key', 2)
+        self.cache.clear_local()
+        self.assertEqual(self.cache.get('key'), 2)
+
+    def test_local_timeout(self):
+        cache = LayeredCache('tests', timeout=60, local_timeout=0.01)
+        cache.set('key', 1)
+        self.cache.invalidate('key')
+        self.assertEqual(cache.get('key', 'missing'), 1)
+        time.sleep(0.02)
+        self.assertEqual(cache.get('key', 'missing'), 'missing')
+
+
+class TokenAuthenticationTests(TestCase):
+    '''
+    Tokens issued at login authenticate API requests until logout
+    '''
+    def setUp(self):
+        clear_caches()
+        self.restaurant = create_restaurant()
+        self.user = self.restaurant.merchant.user
+        self.user.set_password('password')
+        self.user.save()
+
+    def login(self):
+        return APIClient().post('/login/', {'username': self.user.username, 'password': 'password'})
+
+    def test_login(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'token': Token.objects.get(user=self.user).key, 'role': 'merchant'})
+
+    def test_unknown_token(self):
+        with self.assertRaises(AuthenticationFailed):
+            CachedTokenAuthentication().authenticate_credentials('unknown')
+
+    def test_inactive_user(self):
+        key = self.login().data['token']
+        self.assertEqual(CachedTokenAuthentication().authenticate_credentials(key)[0], self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            CachedTokenAuthentication().authenticate_credentials(key)
+
+    def test_logout(self):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Token {self.login().data["token"]}')
+        path = f'/merchant/restaurants/{self.restaurant.id}/menus/'
+        self.assertEqual(api.get(path).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(api.post('/logout/').status_code, 200)
+        self.assertEqual(api.get(path).status_code, 401)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'delivery.layers.BoundedInMemoryChannelLayer'}})
+class TokenAuthMiddlewareTests(TransactionTestCase):
+    '''
+    WebSocket connections are authenticated by the token in their header or query string
+    '''
+    def setUp(self):
+        clear_caches()
+        self.restaurant = create_restaurant()
+        self.key = Token.objects.create(user=self.restaurant.merchant.user).key
+
+    def get_user(self, scope):
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        async_to_sync(TokenAuthMiddleware(app))({'type': 'websocket', **scope}, None, None)
+        return scopes[0]['user']
+
+    def test_header_token(self):
+        user = self.get_user({'headers': [(b'authorization', f'Token {self.key}'.encode())]})
+        self.assertEqual(user, self.restaurant.merchant.user)
+        self.assertEqual(user.merchant.restaurant_id, self.restaurant.id)
+
+    def test_query_string_token(self):
+        user = self.get_user({'query_string': f'token={self.key}'.encode()})
+        self.assertEqual(user, self.restaurant.merchant.user)
+
+    def test_unknown_token(self):
+        self.assertFalse(self.get_user({'query_string': b'token=unknown'}).is_authenticated)
+        self.assertFalse(self.get_user({}).is_authenticated)
+
+    def connect(self, restaurant, key):
+        async def connect():
+            communicator = WebsocketCommunicator(
+                TokenAuthMiddleware(URLRouter(websocket_urlpatterns)),
+                f'/merchant/restaurants/{restaurant.id}/orders/?token={key}',
+            )
+            connected, _ = await communicator.connect()
+            await communicator.disconnect()
+            return connected
+
+        return async_to_sync(connect)()
+
+    def test_merchant_socket_of_another_restaurant(self):
+        self.assertTrue(self.connect(self.restaurant, self.key))
+        self.assertFalse(self.connect(create_restaurant(), self.key))
+        self.assertFalse(self.connect(self.restaurant, Token.objects.create(user=create_client().user).key))
+
+
+class BoundedInMemoryChannelLayerTests(SimpleTestCase):
+    '''
+    Channels hold a bounded number of messages, which expire with the groups' memberships
+    '''
+    def receive(self, layer, channel, timeout=0.01):
+        '''
+        Returns the next message on the channel, or None
+        '''
+        async def receive():
+            try:
+                return await asyncio.wait_for(layer.receive(channel), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        return async_to_sync(receive)()
+
+    def test_full_channel(self):
+        layer = BoundedInMemoryChannelLayer(capacity=2)
+        for index in range(2):
+            async_to_sync(layer.send)('channel', {'type': 'test', 'index': index})
+        with self.assertRaises(ChannelFull):
+            async_to_sync(layer.send)('channel', {'type': 'test', 'index': 2})
+
+        self.assertEqual(self.receive(layer, 'channel')['index'], 0)
+        async_to_sync(layer.send)('channel', {'type': 'test', 'index': 3})
+        self.assertEqual(self.receive(layer, 'channel')['index'], 1)
+        self.assertEqual(self.receive(layer, 'channel')['index'], 3)
+        self.assertEqual(layer.metrics_snapshot()['full'], 1)
+
+    def test_group_send_skips_full_channels(self):
+        layer = BoundedInMemoryChannelLayer(capacity=1)
+        for channel in ('slow', 'fast'):
+            async_to_sync(layer.group_add)('group', channel)
+        async_to_sync(layer.send)('slow', {'type': 'test', 'index': 0})
+
+        async_to_sync(layer.group_send)('group', {'type': 'test', 'index': 1})
+
+        self.assertEqual(self.receive(layer, 'fast')['index'], 1)
+        self.assertEqual(self.receive(layer, 'slow')['index'], 0)
+        self.assertIsNone(self.receive(layer, 'slow'))
+        self.assertEqual(layer.metrics_snapshot()['full'], 1)
+
+    def test_expired_messages_leave_groups(self):
+        layer = BoundedInMemoryChannelLayer(expiry=0.05)
+        async_to_sync(layer.group_add)('group', 'channel')
+        async_to_sync(layer.group_send)('group', {'type': 'test'})
+        time.sleep(0.1)
+
+        # Nothing received from the channel within the expiry, so its consumer is gone
+        self.assertIsNone(self.receive(layer, 'channel'))
+        async_to_sync(layer.group_send)('group', {'type': 'test'})
+        self.assertIsNone(self.receive(layer, 'channel'))
+        self.assertEqual(layer.metrics_snapshot()['expired'], 1)
+
+    def test_expired_group_membership(self):
+        layer = BoundedInMemoryChannelLayer(group_expiry=0.05)
+        async_to_sync(layer.group_add)('group', 'channel')
+        time.sleep(0.1)
+
+        async_to_sync(layer.group_send)('group', {'type': 'test'})
+
+        self.assertIsNone(self.receive(layer, 'channel'))
+        self.assertEqual(layer.metrics_snapshot()['groups'], 0)
+
+    def test_send_from_another_thread(self):
+        layer = BoundedInMemoryChannelLayer()
+
+        async def receive():
+            receiving = asyncio.ensure_future(layer.receive('channel'))
+            # Waiting for a message before it is sent
+            await asyncio.sleep(0.01)
+            thread = threading.Thread(target=async_to_sync(layer.send), args=('channel', {'type': 'test'}))
+            thread.start()
+            try:
+                return await asyncio.wait_for(receiving, 1)
+            finally:
+                thread.join()
+
+        self.assertEqual(async_to_sync(receive)(), {'type': 'test'})
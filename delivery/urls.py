@@ -16,8 +16,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from delivery.views import Login, Logout
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('login/', Login.as_view(), name='login'),
+    path('logout/', Logout.as_view(), name='logout'),
     path('client/', include('client.urls', namespace='client')),
     path('merchant/', include('merchant.urls', namespace='merchant')),
     path('rider/', include('rider.urls', namespace='rider')),
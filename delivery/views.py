@@ -1,7 +1,38 @@
 
 from django.contrib.auth import get_user_model
-from rest_framework import generics
+from rest_framework import generics, status, views
+from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from delivery.authentication import get_role, get_user_for_token
+
 
 class BaseRegister(generics.CreateAPIView):
     permission_classes = []
     queryset = get_user_model()._default_manager.all()
+
+
+class Login(ObtainAuthToken):
+    '''
+    Exchanges a username and password for the user's token, which authenticates both API requests and
+    WebSocket connections. See `delivery.authentication`.
+    '''
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token, _ = Token.objects.get_or_create(user=serializer.validated_data['user'])
+        return Response({'token': token.key, 'role': get_role(get_user_for_token(token.key))})
+
+
+class Logout(views.APIView):
+    '''
+    Revokes the user's token
+    '''
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        Token.objects.filter(user=request.user).delete()
+        return Response(status=status.HTTP_200_OK)
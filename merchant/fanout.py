@@ -0,0 +1,452 @@
+'''
+Fans out order changes to the WebSocket connections of merchants (`merchant.consumers.OrderConsumer`), of
+clients tracking their orders (`client.consumers.OrderConsumer`) and of riders (`rider.consumers.OrderConsumer`).
+
+Writes on an order and on its delivery, self-pickup, cancellation, items and price adjustments are sent as
+events of the order (see `merchant.signals`). New orders are sent as their `OrderDetailSerializer` document,
+and other changes as a delta of the changed fields, built from the saved instance without queries.
+
+Changes aren't sent from the signal that reports them. They are buffered, and sent `FLUSH_INTERVAL` seconds
+after the first change in the buffer, so that:
+- A burst of writes on the same order within the interval is merged into one event.
+- New orders are serialized once, with the other new orders in a constant number of queries, however many
+  connections they are sent to.
+- The changes for each group are batched into one channel layer message, which each connection in the group
+  sends as one frame. The message carries the batch in each of the formats of `merchant.wire`, encoded once.
+
+The events of an order are sent to the groups of its restaurant, of the order itself, and of the rider session
+delivering it. New delivery orders, and orders that stop searching for a rider, are also sent to the groups of
+the riders near their restaurant, by geohash cell.
+'''
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import connection, transaction
+
+from client.serializers import OrderDetailSerializer
+from delivery.prefetch import apply_prefetch_plan
+from merchant.models import Delivery, Order, OrderCancellation, OrderItem, OrderItemPriceAdjustment, Restaurant, \
+    SelfPickup
+from merchant.utils import calc_geohash_cells_covering
+from merchant.wire import encode_deliveries, encode_orders
+
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.1  # seconds
+# Metrics are logged at most this often, when there are changes to send
+METRICS_INTERVAL = 60  # seconds
+# Riders are sent the new delivery orders from restaurants within about this many meters
+NEARBY_RADIUS = 5000
+
+
+# Field name -> key in the order's delta, of the fields that are sent to merchants
+ORDER_FIELDS = {
+    Order: {'status': 'status', 'price': 'price', 'delay_count': 'delay_count'},
+    Delivery: {
+        'session': 'rider_session',
+        'estimated_delivery_datetime': 'estimated_completion_datetime',
+        'rider_pickup_datetime': 'rider_pickup_datetime',
+    },
+    SelfPickup: {'estimated_pickup_datetime': 'estimated_completion_datetime'},
+    OrderCancellation: {'reason': 'cancellation_reason'},
+}
+# Order items are identified by `instance_id` in the deltas, as in `OrderItemListSerializer`
+ORDER_ITEM_FIELDS = {'price': 'price'}
+
+CREATED = 'created'
+DELETED = 'deleted'
+# The value of a field of the order that is read when the change is flushed
+REFRESH = 'refresh'
+
+
+def get_restaurant_group(restaurant_id):
+    return f'merchant.restaurant.{restaurant_id}'
+
+
+def get_order_group(order_id):
+    return f'client.order.{order_id}'
+
+
+def get_session_group(session_id):
+    return f'rider.session.{session_id}'
+
+
+def get_nearby_groups(latitude, longitude):
+    '''
+    Returns the groups of the geohash cells that cover `NEARBY_RADIUS` around the point
+    '''
+    return [f'rider.nearby.{cell}' for cell in calc_geohash_cells_covering(latitude, longitude, NEARBY_RADIUS)]
+
+
+def get_cell_group(latitude, longitude, geohash):
+    '''
+    Returns the group of the geohash cell that contains the point, at the precision of `get_nearby_groups` 
+    '''
+    precision = len(calc_geohash_cells_covering(latitude, longitude, NEARBY_RADIUS)[0])
+    return f'rider.nearby.{geohash[:precision]}'
+
+
+def to_value(value):
+    # Sent as strings, like `OrderDetailSerializer` does, so that the channel layer can encode them
+    if isinstance(value, (Decimal, datetime)):
+        return str(value)
+    return value
+
+
+def get_changes(instance, fields, update_fields):
+    '''
+    Returns the delta of the `fields` (field name -> key) of `instance` that the save wrote
+    '''
+    return {
+        key: to_value(getattr(instance, instance._meta.get_field(name).attname))
+        for name, key in fields.items()
+        if update_fields is None or name in update_fields
+    }
+
+
+class PendingOrder:
+    '''
+    The changes to an order since the last flush, merged
+    '''
+
+    def __init__(self):
+        self.restaurant_id = None
+        # The group of the restaurant's geohash cell, if the order was deleted while open to riders
+        self.cell_group = None
+        self.created = False
+        self.deleted = False
+        self.changes = {}
+        self.refresh = set()  # Fields of the order to read at flush
+        self.items = {}  # Order item id -> delta
+
+    def merge(self, restaurant_id, changes, cell_group=None):
+        if restaurant_id is not None:
+            self.restaurant_id = restaurant_id
+        if cell_group is not None:
+            self.cell_group = cell_group
+        if changes == CREATED:
+            self.created = True
+        elif changes == DELETED:
+            self.deleted = True
+        elif not self.created:
+            # A new order's document includes its later changes
+            for key, value in changes.items():
+                if key == 'items':
+                    for item in value:
+                        self.items.setdefault(item['instance_id'], {}).update(item)
+                elif value == REFRESH:
+                    self.refresh.add(key)
+                    self.changes.pop(key, None)
+                else:
+                    self.refresh.discard(key)
+                    self.changes[key] = value
+
+    def get_event(self, order_id, documents, row):
+        if self.deleted:
+            return {'id': order_id, 'deleted': True}
+        if self.created:
+            return documents.get(order_id)
+        event = {'id': order_id, **self.changes}
+        for key in self.refresh:
+            event[key] = to_value(row[key])
+        if self.items:
+            event['items'] = list(self.items.values())
+        return event
+
+
+class FanoutMetrics:
+    '''
+    Counters of the fan-out since the last `snapshot`
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        self.started = now
+        self.changes = 0
+        self.orders = 0
+        self.messages = 0
+        self.flushes = 0
+        self.serialization_time = 0.0
+
+    def record_change(self):
+        with self._lock:
+            self.changes += 1
+
+    def record_flush(self, num_orders, num_messages, serialization_time):
+        with self._lock:
+            self.flushes += 1
+            self.orders += num_orders
+            self.messages += num_messages
+            self.serialization_time += serialization_time
+
+    def snapshot(self):
+        '''
+        Returns the rates and serialization time since the last snapshot, and starts counting again
+        '''
+        now = time.monotonic()
+        with self._lock:
+            elapsed = max(now - self.started, 1e-9)
+            snapshot = {
+                'seconds': elapsed,
+                'changes_per_second': self.changes / elapsed,
+                'orders_per_second': self.orders / elapsed,
+                'messages_per_second': self.messages / elapsed,
+                'serialization_ms_per_flush':
+                    self.serialization_time * 1000 / self.flushes if self.flushes else 0.0,
+                'serialization_ms_per_order':
+                    self.serialization_time * 1000 / self.orders if self.orders else 0.0,
+            }
+            self._reset(now)
+        return snapshot
+
+
+class OrderFanout:
+    '''
+    Buffers the changes to orders, and sends them to the restaurants' groups in batches
+    '''
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.metrics = FanoutMetrics()
+        self._pending = {}  # Order id -> `PendingOrder`, in the order of the first change
+        self._lock = threading.Lock()
+        self._timer = None
+        self._metrics_logged = time.monotonic()
+
+    def order_changed(self, order_id, restaurant_id, changes, cell_group=None):
+        '''
+        Buffers a committed change of the order, scheduling a flush if the buffer was empty. `changes` is
+        `CREATED`, `DELETED` or a delta of the order. `restaurant_id` may be None if it isn't known.
+        `cell_group` is the group of the restaurant's cell, for deleted orders that riders were searching.
+        '''
+        self.metrics.record_change()
+        with self._lock:
+            pending = self._pending.get(order_id)
+            if pending is None:
+                pending = self._pending[order_id] = PendingOrder()
+            pending.merge(restaurant_id, changes, cell_group)
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to fan out order changes')
+        finally:
+            # The timer's thread is done with its connection
+            connection.close()
+
+    def flush(self):
+        '''
+        Sends the buffered changes now
+        '''
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                # No-op when called from the timer. Otherwise the timer would flush the next changes early.
+                self._timer.cancel()
+            self._timer = None
+        if not pending:
+            return
+
+        rows = read_orders(pending)
+
+        start = time.perf_counter()
+        created = [order_id for order_id, order in pending.items() if order.created and not order.deleted]
+        documents = serialize_orders(created) if created else {}
+        serialization_time = time.perf_counter() - start
+
+        order_batches = defaultdict(list)  # Group -> order events
+        delivery_batches = defaultdict(list)  # Group -> open delivery events
+        for order_id, order in pending.items():
+            row = rows.get(order_id)
+            if row is None and not order.deleted:
+                # The order has been deleted since
+                continue
+            event = order.get_event(order_id, documents, row)
+            if event is None:
+                continue
+            for group in get_order_groups(order_id, order, row):
+                order_batches[group].append(event)
+            delivery_event = get_open_delivery_event(order_id, order, row)
+            if delivery_event is not None:
+                if row is None:
+                    group = order.cell_group
+                else:
+                    group = get_cell_group(float(row['restaurant__latitude']),
+                                           float(row['restaurant__longitude']), row['restaurant__geohash'])
+                delivery_batches[group].append(delivery_event)
+
+        messages = []
+        for group, batch in order_batches.items():
+            packed, names = encode_orders(batch)
+            messages.append((group, {'type': 'order.batch', 'orders': batch, 'packed': packed, 'names': names}))
+        for group, batch in delivery_batches.items():
+            messages.append((group, {'type': 'delivery.batch', 'deliveries': batch,
+                                     'packed': encode_deliveries(batch)}))
+        # In one call, as each call from a thread without an event loop runs one in another thread
+        async_to_sync(send_messages)(messages)
+
+        self.metrics.record_flush(len(pending), len(order_batches) + len(delivery_batches), serialization_time)
+        self.log_metrics()
+
+    def log_metrics(self):
+        now = time.monotonic()
+        if now - self._metrics_logged < METRICS_INTERVAL:
+            return
+        self._metrics_logged = now
+        logger.info(
+            'Order fan-out: %(changes_per_second).1f changes/s, %(orders_per_second).1f orders/s, '
+            '%(messages_per_second).1f messages/s, %(serialization_ms_per_flush).1f ms serialization per flush, '
+            '%(serialization_ms_per_order).2f ms per order',
+            self.metrics.snapshot(),
+        )
+
+
+async def send_messages(messages):
+    channel_layer = get_channel_layer()
+    for group, message in messages:
+        await channel_layer.group_send(group, message)
+
+
+def read_orders(pending):
+    '''
+    Returns a dict of order id -> the values that route the order's events, and the fields to refresh, of the
+    pending orders that still exist. Changes to the objects of an order don't load the order, so these are read
+    once per flush rather than in the signals.
+    '''
+    order_ids = [order_id for order_id, order in pending.items() if not order.deleted]
+    if not order_ids:
+        return {}
+    fields = set().union(*(pending[order_id].refresh for order_id in order_ids))
+    rows = Order.objects.filter(id__in=order_ids).values(
+        'id', 'restaurant_id', 'status', 'delivery__id', 'delivery__session_id', 'delivery__delivery_cost',
+        'restaurant__latitude', 'restaurant__longitude', 'restaurant__geohash', *fields,
+    )
+    return {row['id']: row for row in rows}
+
+
+def get_order_groups(order_id, order, row):
+    yield get_restaurant_group(order.restaurant_id or row['restaurant_id'])
+    yield get_order_group(order_id)
+    if row is not None and row['delivery__session_id'] is not None:
+        yield get_session_group(row['delivery__session_id'])
+
+
+def get_open_delivery_event(order_id, order, row):
+    '''
+    Returns the event for nearby riders if the order has started or stopped searching for a rider, or None
+    '''
+    if order.deleted:
+        # The restaurant may have been deleted too, so its cell is carried in the change
+        return {'id': order_id, 'open': False} if order.cell_group is not None else None
+    if row is None or row['delivery__id'] is None:
+        return None
+    if order.created:
+        if row['status'] != Order.SEARCHING_FOR_RIDER or row['delivery__session_id'] is not None:
+            return None
+        return {
+            'id': order_id,
+            'open': True,
+            'restaurant': row['restaurant_id'],
+            'latitude': float(row['restaurant__latitude']),
+            'longitude': float(row['restaurant__longitude']),
+            'estimated_payout': to_value(row['delivery__delivery_cost']),
+        }
+    # Later saves of the delivery also write its session, but the order has left the kitchen by then, or
+    # is delayed, which is rare enough to send again
+    accepted = order.changes.get('rider_session') is not None \
+        and row['status'] in (Order.IN_KITCHEN, Order.READY_TO_PICKUP_AT_RESTAURANT)
+    cancelled = order.changes.get('status') == Order.CANCELLED and row['delivery__session_id'] is None
+    if accepted or cancelled:
+        return {'id': order_id, 'open': False}
+    return None
+
+
+def serialize_orders(order_ids):
+    '''
+    Returns a dict of order id -> `OrderDetailSerializer` data of the orders that still exist
+    '''
+    serializer = OrderDetailSerializer(many=True)
+    orders = apply_prefetch_plan(Order.objects.filter(id__in=list(order_ids)).with_type(), serializer)
+    return {order['id']: order for order in OrderDetailSerializer(orders, many=True).data}
+
+
+order_fanout = OrderFanout()
+
+
+def order_changed(order_id, restaurant_id, changes, cell_group=None):
+    '''
+    Fans out the change to the order once the current transaction commits
+    '''
+    transaction.on_commit(lambda: order_fanout.order_changed(order_id, restaurant_id, changes, cell_group))
+
+
+def get_order_restaurant_id(instance):
+    # Only if the order is loaded, so that signals don't query the database
+    if type(instance).order.is_cached(instance):
+        return instance.order.restaurant_id
+    return None
+
+
+def order_saved(instance, created, update_fields):
+    '''
+    Fans out the delta of a saved order, or of a saved object of an order
+    '''
+    if isinstance(instance, Order):
+        changes = CREATED if created else get_changes(instance, ORDER_FIELDS[Order], update_fields)
+        order_id, restaurant_id = instance.id, instance.restaurant_id
+    elif isinstance(instance, OrderItem):
+        item_changes = get_changes(instance, ORDER_ITEM_FIELDS, update_fields)
+        if 'price' in item_changes:
+            # A float, like `OrderItemListSerializer`
+            item_changes['price'] = float(instance.price)
+        changes = {'items': [{'instance_id': instance.id, **item_changes}]} if item_changes else {}
+        order_id, restaurant_id = instance.order_id, get_order_restaurant_id(instance)
+    elif isinstance(instance, OrderItemPriceAdjustment):
+        if not OrderItemPriceAdjustment.order_item.is_cached(instance):
+            logger.warning('Price adjustment %s saved without its order item is not fanned out', instance.id)
+            return
+        order_item = instance.order_item
+        changes = {
+            # Written with an F() expression by `OrderItem.adjust_price`, so the value isn't known here
+            'price': REFRESH,
+            'items': [{
+                'instance_id': order_item.id,
+                'price_adjustment': {'adjustment': to_value(instance.adjustment), 'reason': instance.reason},
+            }],
+        }
+        order_id, restaurant_id = order_item.order_id, get_order_restaurant_id(order_item)
+    else:
+        changes = get_changes(instance, ORDER_FIELDS[type(instance)], update_fields)
+        order_id, restaurant_id = instance.order_id, get_order_restaurant_id(instance)
+
+    if changes:
+        order_changed(order_id, restaurant_id, changes)
+
+
+def order_deleted(order):
+    cell_group = None
+    if order.status == Order.SEARCHING_FOR_RIDER:
+        # Riders near the restaurant were sent the order. Deletions are rare, so the restaurant may be read.
+        if Order.restaurant.is_cached(order):
+            location = order.restaurant.latitude, order.restaurant.longitude, order.restaurant.geohash
+        else:
+            location = Restaurant.objects.filter(id=order.restaurant_id) \
+                .values_list('latitude', 'longitude', 'geohash').first()
+        if location is not None:
+            latitude, longitude, geohash = location
+            cell_group = get_cell_group(float(latitude), float(longitude), geohash)
+    order_changed(order.id, order.restaurant_id, DELETED, cell_group)
@@ -0,0 +1,65 @@
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from merchant.models import Restaurant
+from merchant.utils import calc_delivery_quotes, calc_distance_from_coords
+
+
+class Command(BaseCommand):
+    help = 'Compares per-restaurant distance/cost/ETA calculation against the batched `calc_delivery_quotes`'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        query_params = {'user_latitude': '1.3521', 'user_longitude': '103.8198'}
+
+        for size in options['sizes']:
+            # Unsaved restaurants, so that only the calculation is measured
+            restaurants = [
+                Restaurant(id=i, latitude=round(1.3521 + rng.uniform(-0.2, 0.2), 7), 
+                           longitude=round(103.8198 + rng.uniform(-0.2, 0.2), 7))
+                for i in range(size)
+            ]
+            for restaurant in restaurants:
+                restaurant.num_orders_in_progress = rng.randint(0, 5)
+
+            per_object = min(self.time(self.calc_per_object, restaurants, query_params) 
+                             for _ in range(options['repeat']))
+            batched = min(self.time(self.calc_batched, restaurants, query_params) 
+                          for _ in range(options['repeat']))
+            self.stdout.write(
+                f'{size:>7} restaurants: per-object {per_object * 1000:9.1f} ms, '
+                f'batched {batched * 1000:9.1f} ms, speedup {per_object / batched:4.1f}x'
+            )
+
+    def time(self, func, *args):
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
+
+    def calc_per_object(self, restaurants, query_params):
+        # Mirrors the previous `RestaurantListSerializer`: every field re-parses the query string and 
+        # recalculates the distance.
+        def calc_distance(restaurant):
+            user_latitude = float(query_params.get('user_latitude'))
+            user_longitude = float(query_params.get('user_longitude'))
+            return round(calc_distance_from_coords(user_latitude, user_longitude, 
+                                                   float(restaurant.latitude), float(restaurant.longitude)))
+        
+        for restaurant in restaurants:
+            calc_distance(restaurant)
+            round(calc_distance(restaurant) * settings.DELIVERY_COST_PER_METER, 1)
+            timedelta(minutes=20 + calc_distance(restaurant) * settings.ADDITIONAL_DELIVERY_TIME_PER_METER) \
+                + restaurant.order_fulfillment_time
+
+    def calc_batched(self, restaurants, query_params):
+        calc_delivery_quotes(restaurants, float(query_params['user_latitude']), 
+                             float(query_params['user_longitude']))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from merchant.models import Restaurant
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the denormalized rating aggregates of every restaurant from its reviews'
+
+    def handle(self, *args, **options):
+        num_updated = Restaurant.objects.rebuild_ratings()
+        self.stdout.write(f'Rebuilt ratings of {num_updated} restaurants')
@@ -0,0 +1,74 @@
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+
+from delivery.cache import LayeredCache
+
+
+menu_graph_cache = LayeredCache('merchant.menu_graph', timeout=60 * 60, local_timeout=5)
+
+# `options` maps option ids to prices. `max_options` is None if any number of options can be picked.
+MenuGraphOptionGroup = namedtuple('MenuGraphOptionGroup', ['min_options', 'max_options', 'options'])
+# `option_groups` maps option group ids to `MenuGraphOptionGroup`s
+MenuGraphItem = namedtuple('MenuGraphItem', ['price', 'option_groups'])
+
+
+class MenuGraph:
+    '''
+    A menu's items, option groups and options, compiled so that carts can be validated and priced without
+    DB queries.
+
+    `items` are (id, price) tuples, `option_groups` are (id, menu_item_id, min_options, max_options) tuples
+    and `options` are (id, option_group_id, price) tuples.
+    '''
+    def __init__(self, items, option_groups, options):
+        self.items = {menu_item_id: MenuGraphItem(price, {}) for menu_item_id, price in items}
+        option_groups_by_id = {}
+        for option_group_id, menu_item_id, min_options, max_options in option_groups:
+            option_group = MenuGraphOptionGroup(min_options, max_options, {})
+            self.items[menu_item_id].option_groups[option_group_id] = option_group
+            option_groups_by_id[option_group_id] = option_group
+        for option_id, option_group_id, price in options:
+            option_groups_by_id[option_group_id].options[option_id] = price
+
+    def price_item(self, menu_item_id, selections):
+        '''
+        Validates the options picked for a menu item against its option groups, and returns the price of
+        the menu item and the prices of the picked options. `selections` are (option_group_id, option_ids)
+        tuples.
+        '''
+        menu_item = self.items.get(menu_item_id)
+        if menu_item is None:
+            raise ValidationError(f'Menu item {menu_item_id} is not in the current menu')
+
+        picked = {}
+        for option_group_id, option_ids in selections:
+            option_group = menu_item.option_groups.get(option_group_id)
+            if option_group is None:
+                raise ValidationError(f'Option group {option_group_id} does not belong to menu item {menu_item_id}')
+            if option_group_id in picked:
+                raise ValidationError(f'Option group {option_group_id} is picked more than once')
+            if len(set(option_ids)) != len(option_ids):
+                raise ValidationError(f'An option of option group {option_group_id} is picked more than once')
+            for option_id in option_ids:
+                if option_id not in option_group.options:
+                    raise ValidationError(f'Option {option_id} does not belong to option group {option_group_id}')
+            picked[option_group_id] = option_ids
+
+        for option_group_id, option_group in menu_item.option_groups.items():
+            num_options = len(picked.get(option_group_id, ()))
+            if num_options < option_group.min_options:
+                raise ValidationError(
+                    f'At least {option_group.min_options} option(s) of option group {option_group_id} must be picked'
+                )
+            if option_group.max_options is not None and num_options > option_group.max_options:
+                raise ValidationError(
+                    f'At most {option_group.max_options} option(s) of option group {option_group_id} can be picked'
+                )
+
+        option_prices = {
+            option_id: menu_item.option_groups[option_group_id].options[option_id]
+            for option_group_id, option_ids in picked.items()
+            for option_id in option_ids
+        }
+        return menu_item.price, option_prices
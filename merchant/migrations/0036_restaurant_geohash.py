@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+from merchant.utils import encode_geohash
+
+
+def populate_geohash(apps, schema_editor):
+    Restaurant = apps.get_model('merchant', 'Restaurant')
+    restaurants = list(Restaurant.objects.only('id', 'latitude', 'longitude'))
+    for restaurant in restaurants:
+        restaurant.geohash = encode_geohash(float(restaurant.latitude), float(restaurant.longitude))
+    Restaurant.objects.bulk_update(restaurants, ['geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0035_merchant_delete_restaurantstaff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=12),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
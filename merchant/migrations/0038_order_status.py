@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def populate_status(apps, schema_editor):
+    Order = apps.get_model('merchant', 'Order')
+    # In increasing order of precedence, following the previously computed `Order.status`
+    Order.objects.filter(kitchen_completed__isnull=False).update(status='READY_TO_PICKUP_AT_RESTAURANT')
+    Order.objects.filter(delivery__isnull=False, delivery__rider_pickup_datetime__isnull=False) \
+        .update(status='DELIVERY_IN_TRANSIT')
+    Order.objects.filter(delivery__isnull=False, delivery__session__isnull=True).update(status='SEARCHING_FOR_RIDER')
+    Order.objects.filter(completed__isnull=False).update(status='COMPLETED')
+    Order.objects.filter(cancellation__isnull=False).update(status='CANCELLED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0037_restaurant_rating_sum_restaurant_rating_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('IN_KITCHEN', 'In kitchen'), ('READY_TO_PICKUP_AT_RESTAURANT', 'Ready to pick up at restaurant'), ('SEARCHING_FOR_RIDER', 'Searching for rider'), ('DELIVERY_IN_TRANSIT', 'Delivery in transit'), ('CANCELLED', 'Cancelled'), ('COMPLETED', 'Completed')], db_index=True, default='IN_KITCHEN', max_length=29),
+        ),
+        migrations.RunPython(populate_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['restaurant', 'status'], name='order_restaurant_status_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_prices(apps, schema_editor):
+    Order = apps.get_model('merchant', 'Order')
+    OrderItem = apps.get_model('merchant', 'OrderItem')
+    OrderItemOption = apps.get_model('merchant', 'OrderItemOption')
+    OrderItemPriceAdjustment = apps.get_model('merchant', 'OrderItemPriceAdjustment')
+    MenuItem = apps.get_model('merchant', 'MenuItem')
+    MenuItemOption = apps.get_model('merchant', 'MenuItemOption')
+    zero = Value(Decimal(0))
+
+    OrderItemOption.objects.update(price=Subquery(
+        MenuItemOption.objects.filter(id=OuterRef('menu_item_option_id')).values('price')
+    ))
+    options_price = OrderItemOption.objects.filter(order_item_option_group__order_item=OuterRef('pk')).order_by() \
+        .values('order_item_option_group__order_item').annotate(total=Sum('price')).values('total')
+    OrderItem.objects.update(unit_price=Subquery(
+        MenuItem.objects.filter(id=OuterRef('menu_item_id')).values('price')
+    ) + Coalesce(Subquery(options_price), zero))
+    adjustment = OrderItemPriceAdjustment.objects.filter(order_item=OuterRef('pk')).values('adjustment')
+    OrderItem.objects.update(price=F('unit_price') * F('quantity') + Coalesce(Subquery(adjustment), zero))
+    items_price = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order') \
+        .annotate(total=Sum('price')).values('total')
+    Order.objects.update(price=Coalesce(Subquery(items_price), zero))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0038_order_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='orderitemoption',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=6),
+        ),
+        migrations.RunPython(populate_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0039_order_item_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='version',
+            field=models.UUIDField(default=uuid.uuid4),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.0.10 on 2026-10-18 04:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rider', '0006_session_location'),
+        ('merchant', '0040_menu_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='proposal_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='proposed_session',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='proposed_deliveries', to='rider.session'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from delivery.models import User
+from delivery.request_cache import memoize
+from merchant.models import Merchant, Order, OrderItem
+
+
+def get_merchant(request):
+    '''
+    Returns the user's merchant with its restaurant, looking it up once per request, so that permissions and 
+    views share it
+    '''
+    def load():
+        if User.merchant.related.is_cached(request.user):
+            return request.user.merchant
+        return Merchant.objects.select_related('restaurant').get(user=request.user)
+    return memoize(request, 'merchant', load)
+
+
+def get_order(request, order_id):
+    return memoize(request, ('order', order_id), lambda: Order.objects.get(id=order_id))
+
+
+def get_order_item(request, order_item_id):
+    return memoize(request, ('order_item', order_item_id), lambda: OrderItem.objects.get(id=order_item_id))
+
+
+class MerchantObjectsMixin:
+    '''
+    Provides the `get_restaurant`, `get_order` and `get_order_item` methods, which return the objects that 
+    the permissions have already loaded
+    '''
+
+    def get_restaurant(self):
+        return get_merchant(self.request).restaurant
+
+    def get_order(self):
+        return get_order(self.request, self.kwargs['order_id'])
+
+    def get_order_item(self):
+        return get_order_item(self.request, self.kwargs['order_item_id'])
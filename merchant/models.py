@@ -1,11 +1,29 @@
-from datetime import timedelta
+import threading
+import uuid
+from contextlib import contextmanager
 from django.utils import timezone
-from functools import cached_property
 from django.db import models
 from django.db import transaction
 from django.core.exceptions import ValidationError
+from django.db.models import Case, CharField, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
 
 from client.models import Review
+from delivery.cache import LayeredCache
+from merchant.menu_graph import MenuGraph, menu_graph_cache
+from merchant.timetable import HORIZON, Timetable, timetable_cache
+from merchant.utils import calc_bounding_box, calc_distance_from_coords, calc_geohash_cells_covering, \
+    calc_geohash_prefix_end, calc_order_fulfillment_time, encode_geohash
+
+
+def send_post_save(instance, update_fields):
+    '''
+    Sends `post_save` for fields written with `QuerySet.update`, so that observers such as 
+    `merchant.fanout` see the change
+    '''
+    post_save.send(sender=type(instance), instance=instance, created=False, update_fields=frozenset(update_fields), 
+                   raw=False, using=instance._state.db)
     
 
 class MenuHours(models.Model):
@@ -75,7 +93,7 @@ class Holiday(models.Model):
             restaurant=self.restaurant, 
             start_datetime__lt=self.end_datetime, 
             end_datetime__gt=self.start_datetime
-        )
+        ).exclude(id=self.id)
         if overlapping_holiday_hours.exists():
             raise ValidationError('Cannot save overlapping holiday hours')
 
@@ -104,82 +122,195 @@ class PauseHours(models.Model):
             raise ValidationError('Cannot save overlapping pause hours')
 
 
+class RestaurantQuerySet(models.QuerySet):
+
+    def with_num_orders_in_progress(self):
+        '''
+        Annotates `num_orders_in_progress`, which `Restaurant.order_fulfillment_time` uses instead of a query
+        '''
+        # A subquery rather than a join, so that it is only run for the rows that are loaded with it
+        orders = Order.objects.filter(restaurant=OuterRef('pk'), status__in=Order.OPEN_STATUSES) \
+            .order_by().values('restaurant')
+        return self.annotate(num_orders_in_progress=Coalesce(
+            Subquery(orders.annotate(count=Count('id')).values('count')), 0
+        ))
+
+    def add_rating(self, rating):
+        return self.update(rating_sum=F('rating_sum') + rating, rating_count=F('rating_count') + 1)
+
+    def remove_rating(self, rating):
+        return self.filter(rating_count__gt=0).update(rating_sum=F('rating_sum') - rating, 
+                                                      rating_count=F('rating_count') - 1)
+
+    def rebuild_ratings(self):
+        '''
+        Recalculates `rating_sum` and `rating_count` from the reviews, in a single UPDATE
+        '''
+        reviews = Review.objects.filter(restaurant=OuterRef('pk')).order_by().values('restaurant')
+        return self.update(
+            rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0),
+            rating_count=Coalesce(Subquery(reviews.annotate(count=Count('id')).values('count')), 0),
+        )
+
+    def within_radius(self, latitude, longitude, radius):
+        '''
+        Restaurants that may be within `radius` meters of the given point. Uses the geohash index
+        and a bounding box, so results are a superset: exact distances must be checked by the caller.
+        '''
+        geohash_query = Q()
+        for cell in calc_geohash_cells_covering(latitude, longitude, radius):
+            # An index range scan. Bounded by geohash characters rather than by `startswith`, which SQLite doesn't
+            # run on the index, or by a character beyond them, whose order depends on the collation.
+            end = calc_geohash_prefix_end(cell)
+            geohash_query |= Q(geohash__gte=cell, geohash__lt=end) if end is not None else Q(geohash__gte=cell)
+        queryset = self.filter(geohash_query)
+
+        min_lat, max_lat, min_lon, max_lon = calc_bounding_box(latitude, longitude, radius)
+        queryset = queryset.filter(latitude__gte=min_lat, latitude__lte=max_lat)
+        if min_lon >= -180 and max_lon <= 180:
+            # Skip when the box wraps around the antimeridian; the geohash cells still apply
+            queryset = queryset.filter(longitude__gte=min_lon, longitude__lte=max_lon)
+        return queryset
+
+    def nearest(self, latitude, longitude, radius, limit):
+        '''
+        Returns up to `limit` open restaurants within `radius` meters of the given point, closest first.
+        Each restaurant is annotated with its `distance` in meters.
+
+        Candidates are ordered by distance from their coordinates alone, and only the nearest ones are loaded and
+        checked for being open, in batches starting at `limit`, so that restaurants beyond the nearest open ones
+        are neither loaded nor checked.
+        '''
+        candidates = []
+        rows = self.within_radius(latitude, longitude, radius).values_list('id', 'latitude', 'longitude')
+        for restaurant_id, restaurant_latitude, restaurant_longitude in rows:
+            distance = calc_distance_from_coords(latitude, longitude, 
+                                                 float(restaurant_latitude), float(restaurant_longitude))
+            if distance <= radius:
+                candidates.append((distance, restaurant_id))
+        candidates.sort()
+
+        result = []
+        batch_start, batch_size = 0, limit
+        while batch_start < len(candidates):
+            batch = candidates[batch_start:batch_start + batch_size]
+            restaurants = self.in_bulk([restaurant_id for _, restaurant_id in batch])
+            for distance, restaurant_id in batch:
+                restaurant = restaurants.get(restaurant_id)
+                if restaurant is not None and restaurant.is_open:
+                    restaurant.distance = distance
+                    result.append(restaurant)
+                    if len(result) >= limit:
+                        return result
+            # Doubled, so that areas where most restaurants are closed take few queries
+            batch_start, batch_size = batch_start + batch_size, batch_size * 2
+        return result
+
+
 class Restaurant(models.Model):
     name = models.CharField(max_length=100) 
     address = models.CharField(max_length=300)
     is_live = models.BooleanField(default=False)
 
-    # TODO: Use PostGIS, which allows fast querying of restaurants within a certain radius of any point
     latitude = models.DecimalField(decimal_places=7, max_digits=9)  # Range = [-90, 90]
     longitude = models.DecimalField(decimal_places=7, max_digits=10)  # Range = [-180, 180]
+    # Derived from `latitude` and `longitude` on save, for indexed radius queries. See `RestaurantQuerySet`.
+    geohash = models.CharField(max_length=12, db_index=True, editable=False)
+
+    # Maintained by `client.signals` as reviews are written, so that `rating` needs no queries.
+    # Rebuild with `manage.py rebuild_restaurant_ratings`.
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    # Only written by the UPDATEs of `RestaurantQuerySet`, so that saving an instance loaded before a review was
+    # written doesn't overwrite the review's rating
+    RATING_FIELDS = {'rating_sum', 'rating_count'}
+
+    objects = RestaurantQuerySet.as_manager()
     
+    def save(self, *args, **kwargs):
+        self.geohash = encode_geohash(float(self.latitude), float(self.longitude))
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'geohash'}
+        elif not self._state.adding and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in Restaurant.RATING_FIELDS]
+        return super().save(*args, **kwargs)
+
     # TODO: def get_operation_hours(self, date)
     
-    @cached_property
+    @property
     def rating(self):
-        reviews = Review.objects.filter(restaurant=self)
-        return sum([review.rating for review in reviews]) / reviews.count()
-
-    def refresh_from_db(self, *args, **kwargs):
-        super(Restaurant, self).refresh_from_db(*args, **kwargs)
-        try:
-            # Refresh cached property
-            del self.__dict__['rating']
-        except AttributeError:
-            # Property has not been cached
-            pass
+        if self.rating_count == 0:
+            return None
+        return self.rating_sum / self.rating_count
     
     @property
     def coordinates(self):
         return (self.latitude, self.longitude)
     
+    @property
+    def timetable(self):
+        timetable = timetable_cache.get_or_build(self.id, self.compile_timetable)
+        if timetable.valid_until <= timezone.now():
+            timetable = self.compile_timetable()
+            timetable_cache.set(self.id, timetable)
+        return timetable
+
+    def compile_timetable(self):
+        now = timezone.now()
+        menu_hours = MenuHours.objects.filter(menu__restaurant=self).values_list(
+            'day_of_the_week', 'start_time', 'end_time', 'menu_id', 'menu__name'
+        )
+        holidays = Holiday.objects.filter(
+            restaurant=self, 
+            start_datetime__lt=now + HORIZON, 
+            end_datetime__gt=now
+        ).values_list('start_datetime', 'end_datetime')
+        pauses = PauseHours.objects.filter(
+            restaurant=self, 
+            start_datetime__lt=now + HORIZON, 
+            end_datetime__gt=now
+        ).values_list('start_datetime', 'end_datetime')
+        return Timetable(list(menu_hours), list(holidays), list(pauses), compiled_at=now)
+    
     @property
     def is_open_according_to_regular_menu_hours(self):
-        return self.current_menu is not None
+        return self.timetable.current_menu_hours(timezone.now()) is not None
     
     @property
     def is_on_holiday(self):
-        return Holiday.objects.filter(
-            restaurant=self, 
-            start_datetime__lte=timezone.now(), 
-            end_datetime__gte=timezone.now()
-        ).exists()
+        return self.timetable.is_on_holiday(timezone.now())
     
     @property
     def is_paused(self):
-        return PauseHours.objects.filter(
-            restaurant=self, 
-            start_datetime__lte=timezone.now(), 
-            end_datetime__gte=timezone.now()
-        ).exists()
+        return self.timetable.is_paused(timezone.now())
     
     @property
     def is_open(self):
-        return self.is_open_according_to_regular_menu_hours and not self.is_on_holiday and not self.is_paused
+        return self.timetable.is_open(timezone.now())
 
-    # TODO: @property next_opening_datetime 
+    @property
+    def next_opening_datetime(self):
+        return self.timetable.next_opening_datetime(timezone.now())
     
     @property
     def current_menu(self):
-        try:
-            current_time = timezone.now()
-            menu_hours = MenuHours.objects.get(
-                menu__restaurant=self,
-                start_time__lte=current_time, 
-                end_time__gt=current_time, 
-                day_of_the_week=current_time.weekday()
-            )
-            return menu_hours.menu
-        except MenuHours.DoesNotExist:
+        menu_hours = self.timetable.current_menu_hours(timezone.now())
+        if menu_hours is None:
             return None
+        _, _, menu_id, menu_name = menu_hours
+        version = menu_version_cache.get_or_build(
+            menu_id, lambda: Menu.objects.filter(id=menu_id).values_list('version', flat=True).first()
+        )
+        return Menu.from_db(self._state.db, ['id', 'name', 'restaurant_id', 'version'],
+                            [menu_id, menu_name, self.id, version])
 
     @property
     def order_fulfillment_time(self):
-        num_orders_in_progress = self.orders.filter(
-            cancellation__isnull=True, 
-            completed__isnull=True
-        ).count()
-        return timedelta(minutes=10) + (num_orders_in_progress * timedelta(minutes=3))
+        num_orders_in_progress = getattr(self, 'num_orders_in_progress', None)
+        if num_orders_in_progress is None:
+            num_orders_in_progress = self.orders.open().count()
+        return calc_order_fulfillment_time(num_orders_in_progress)
     
     def __str__(self):
         return self.name
@@ -193,16 +324,104 @@ class Merchant(models.Model):
         return f'{str(self.restaurant)} staff: {str(self.user)}'
 
 
-class Menu(models.Model):
+# Menu id -> the menu's version, so that `Restaurant.current_menu` doesn't query it
+menu_version_cache = LayeredCache('merchant.menu_version', timeout=60 * 60, local_timeout=5)
+
+
+class MenuQuerySet(models.QuerySet):
+
+    def bump_version(self):
+        return self.update(version=uuid.uuid4())
+
+
+class MenuDeletions(threading.local):
+    '''
+    The menu objects of the thread's current `MenuObject.delete`, including the objects deleted in cascade, which
+    `merchant.signals` adds on `pre_delete` so that objects deleted with their parent leave the menu's
+    invalidation to the parent. The objects are only tracked within `delete`, and are dropped when it returns or
+    raises, so that a failed deletion can't leave them behind. Other deletions, such as those of querysets,
+    invalidate the menu for every object.
+    '''
+
+    def __init__(self):
+        self.objects = None  # (model, id), while a deletion is in progress
+
+    @contextmanager
+    def track(self):
+        if self.objects is not None:
+            # A deletion within the current one
+            yield
+            return
+        self.objects = set()
+        try:
+            yield
+        finally:
+            self.objects = None
+
+    def add(self, model, instance):
+        if self.objects is not None:
+            self.objects.add((model, instance.pk))
+
+    def __contains__(self, key):
+        return self.objects is not None and key in self.objects
+
+
+menu_deletions = MenuDeletions()
+
+
+class MenuObject(models.Model):
+    '''
+    A menu or one of its categories, items, option groups and options
+    '''
+
+    class Meta:
+        abstract = True
+
+    def delete(self, *args, **kwargs):
+        with menu_deletions.track():
+            return super().delete(*args, **kwargs)
+
+
+class Menu(MenuObject):
     name = models.CharField(max_length=100)
     restaurant = models.ForeignKey('Restaurant', on_delete=models.CASCADE, 
                                    related_name='menus')
+    # Changes on every write to the menu or its categories, items, option groups and options. Random rather 
+    # than incrementing, so that saving a stale instance cannot bring back a previous version.
+    version = models.UUIDField(default=uuid.uuid4)
+
+    objects = MenuQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        self.version = uuid.uuid4()
+        if 'update_fields' in kwargs and kwargs['update_fields'] is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'version'}
+        return super().save(*args, **kwargs)
+
+    @property
+    def graph(self):
+        return menu_graph_cache.get_or_build(self.id, self.compile_graph)
+
+    def compile_graph(self):
+        items = MenuItem.objects.filter(menu_category__menu=self).values_list('id', 'price')
+        option_groups = MenuItemOptionGroup.objects.filter(menu_item__menu_category__menu=self) \
+            .values_list('id', 'menu_item_id', 'type')
+        options = MenuItemOption.objects.filter(option_group__menu_item__menu_category__menu=self) \
+            .values_list('id', 'option_group_id', 'price')
+        return MenuGraph(
+            list(items), 
+            [
+                (option_group_id, menu_item_id, *MenuItemOptionGroup.OPTION_LIMITS[type]) 
+                for option_group_id, menu_item_id, type in option_groups
+            ], 
+            list(options),
+        )
     
     def __str__(self):
         return f'Menu: {self.name}'
 
 
-class MenuCategory(models.Model):
+class MenuCategory(MenuObject):
     name = models.CharField(max_length=30)
     menu = models.ForeignKey('Menu', on_delete=models.CASCADE, 
                              related_name='categories')
@@ -211,7 +430,7 @@ class MenuCategory(models.Model):
         return f'Menu Category: {self.name}'
 
 
-class MenuItem(models.Model):
+class MenuItem(MenuObject):
     name = models.CharField(max_length=30)
     price = models.DecimalField(decimal_places=2, max_digits=6)
     menu_category = models.ForeignKey('MenuCategory', on_delete=models.CASCADE, 
@@ -221,7 +440,7 @@ class MenuItem(models.Model):
         return f'Menu Item: {self.name}'
 
 
-class MenuItemOptionGroup(models.Model):
+class MenuItemOptionGroup(MenuObject):
     name = models.CharField(max_length=30)
     menu_item = models.ForeignKey('MenuItem', on_delete=models.CASCADE, 
                                   related_name='option_groups')
@@ -238,11 +457,19 @@ class MenuItemOptionGroup(models.Model):
     ]
     type = models.CharField(choices=OPTION_GROUP_TYPES, max_length=20)
 
+    # (min, max) number of options that can be picked. None means no maximum.
+    OPTION_LIMITS = {
+        MANDATORY_ONE_ONLY: (1, 1),
+        MANDATORY_MULTIPLE: (1, None),
+        OPTIONAL_ONE_ONLY: (0, 1),
+        OPTIONAL_MULTIPLE: (0, None),
+    }
+
     def __str__(self):
         return f'Menu Item Option Group: {self.name}'
 
 
-class MenuItemOption(models.Model):
+class MenuItemOption(MenuObject):
     name = models.CharField(max_length=30)
     option_group = models.ForeignKey('MenuItemOptionGroup', on_delete=models.CASCADE, 
                                      related_name='options')
@@ -266,10 +493,58 @@ class Delivery(models.Model):
     delivery_cost = models.DecimalField(decimal_places=2, max_digits=4)
     estimated_delivery_datetime = models.DateTimeField()
     rider_pickup_datetime = models.DateTimeField(blank=True, null=True)
+
+    # The session that `rider.dispatch` proposes to deliver the order, until the proposal expires
+    proposed_session = models.ForeignKey('rider.Session', on_delete=models.SET_NULL, 
+                                         related_name='proposed_deliveries', blank=True, null=True)
+    proposal_expires = models.DateTimeField(blank=True, null=True)
+
+    class AlreadyAccepted(ValidationError):
+        pass
+
+    @transaction.atomic
+    def accept(self, session):
+        '''
+        Assigns the delivery to `session`. The order's status and the delivery's session are changed with
+        conditional UPDATEs rather than read and then saved, so that when several riders accept an order at
+        once, exactly one succeeds and the others get `AlreadyAccepted`. The other writers of the order's status
+        are conditional too (see `Order.transition_to`), so they don't undo an accept that they haven't loaded.
+        Start no transaction before calling this: on SQLite, a transaction that reads before it writes can fail
+        instead of waiting for other writers.
+        '''
+        # Back to the kitchen, or ready to pick up if the kitchen finished while the order searched for a rider
+        num_updated = Order.objects.filter(id=self.order_id).transition_to(
+            Order.DELIVERY, Order.IN_KITCHEN,
+            cases=[(Q(kitchen_completed__isnull=False), Order.READY_TO_PICKUP_AT_RESTAURANT)],
+        )
+        if not num_updated:
+            self.order.refresh_from_db(fields=['status'])
+            if self.order.status == Order.CANCELLED:
+                raise ValidationError('Cannot accept order that has been cancelled')
+            raise Delivery.AlreadyAccepted('Order has already been accepted by another rider')
+
+        self.estimated_delivery_datetime = timezone.now()
+        num_updated = Delivery.objects.filter(id=self.id, session__isnull=True).update(
+            session=session, 
+            proposed_session=None, 
+            proposal_expires=None, 
+            estimated_delivery_datetime=self.estimated_delivery_datetime,
+        )
+        if not num_updated:
+            raise Delivery.AlreadyAccepted('Order has already been accepted by another rider')
+        self.session = session
+        self.proposed_session = None
+        self.proposal_expires = None
+
+        send_post_save(self, ['session', 'proposed_session', 'proposal_expires', 'estimated_delivery_datetime'])
+        self.order.refresh_from_db(fields=['status'])
+        send_post_save(self.order, ['status'])
     
+    @transaction.atomic
     def pick_up(self):
+        self.order.transition_to(Order.DELIVERY_IN_TRANSIT)
         self.rider_pickup_datetime = timezone.now()
-        self.save()
+        self.save(update_fields=['rider_pickup_datetime'])
 
 
 class SelfPickup(models.Model):
@@ -277,6 +552,41 @@ class SelfPickup(models.Model):
     estimated_pickup_datetime = models.DateTimeField() 
 
 
+class OrderQuerySet(models.QuerySet):
+
+    def with_type(self):
+        '''
+        Annotates the type of each order in SQL, so that `Order.type` doesn't query the order's 
+        delivery and self-pickup.
+        '''
+        return self.annotate(
+            annotated_type=Case(
+                When(delivery__isnull=False, then=Value(Order.DELIVERY)),
+                When(self_pickup__isnull=False, then=Value(Order.SELF_PICKUP)),
+                default=None,
+                output_field=CharField(),
+            ),
+        )
+
+    def open(self):
+        return self.filter(status__in=Order.OPEN_STATUSES)
+
+    def transition_to(self, order_type, status, cases=(), **fields):
+        '''
+        Sets the status of the orders, which are of `order_type`, in a conditional UPDATE: to the status of the
+        first of the `(condition, status)` `cases` that the order matches, or else to `status`. Only orders whose
+        status `Order.STATUS_TRANSITIONS` allows to change to all of these statuses are updated, so that
+        concurrent transitions can't both succeed. `fields` are written by the same UPDATE. Returns the number of
+        orders updated.
+        '''
+        statuses = {status} | {case_status for _, case_status in cases}
+        sources = [source for source, targets in Order.STATUS_TRANSITIONS[order_type].items() if statuses <= targets]
+        if cases:
+            status = Case(*[When(condition, then=Value(case_status)) for condition, case_status in cases],
+                          default=Value(status))
+        return self.filter(status__in=sources).update(status=status, **fields)
+
+
 class Order(models.Model):
     client = models.ForeignKey('client.Client', on_delete=models.CASCADE, 
                                related_name='orders')
@@ -291,10 +601,16 @@ class Order(models.Model):
     # to simplify queries for completed/in-progress orders.
     completed = models.DateTimeField(blank=True, null=True)
 
+    objects = OrderQuerySet.as_manager()
+
     DELIVERY = 'DELIVERY'
     SELF_PICKUP = 'SELF_PICKUP'
     @property
     def type(self):
+        annotated_type = getattr(self, 'annotated_type', None)
+        if annotated_type is not None:
+            return annotated_type
+
         if hasattr(self, 'delivery'):
             return Order.DELIVERY
         elif hasattr(self, 'self_pickup'):
@@ -307,37 +623,62 @@ class Order(models.Model):
     DELIVERY_IN_TRANSIT = 'DELIVERY_IN_TRANSIT'
     CANCELLED = 'CANCELLED'
     COMPLETED = 'COMPLETED'
-    @property
-    def status(self):   
+    STATUSES = [
+        (IN_KITCHEN, 'In kitchen'),
+        (READY_TO_PICKUP_AT_RESTAURANT, 'Ready to pick up at restaurant'),
+        (SEARCHING_FOR_RIDER, 'Searching for rider'),
+        (DELIVERY_IN_TRANSIT, 'Delivery in transit'),
+        (CANCELLED, 'Cancelled'),
+        (COMPLETED, 'Completed'),
+    ]
+    OPEN_STATUSES = [IN_KITCHEN, READY_TO_PICKUP_AT_RESTAURANT, SEARCHING_FOR_RIDER, DELIVERY_IN_TRANSIT]
+
+    # Delivery order: SEARCHING_FOR_RIDER -> IN_KITCHEN -> READY_TO_PICKUP_AT_RESTAURANT -> DELIVERY_IN_TRANSIT -> COMPLETED
+    # (if the kitchen finishes before a rider accepts, it skips from SEARCHING_FOR_RIDER to READY_TO_PICKUP_AT_RESTAURANT)
+    # Self-pickup order: IN_KITCHEN -> READY_TO_PICKUP_AT_RESTAURANT -> COMPLETED
+    STATUS_TRANSITIONS = {
+        DELIVERY: {
+            SEARCHING_FOR_RIDER: {IN_KITCHEN, READY_TO_PICKUP_AT_RESTAURANT, CANCELLED},
+            IN_KITCHEN: {READY_TO_PICKUP_AT_RESTAURANT, CANCELLED},
+            READY_TO_PICKUP_AT_RESTAURANT: {DELIVERY_IN_TRANSIT},
+            DELIVERY_IN_TRANSIT: {COMPLETED, CANCELLED},
+            CANCELLED: set(),
+            COMPLETED: set(),
+        },
+        SELF_PICKUP: {
+            IN_KITCHEN: {READY_TO_PICKUP_AT_RESTAURANT, CANCELLED},
+            READY_TO_PICKUP_AT_RESTAURANT: {COMPLETED},
+            CANCELLED: set(),
+            COMPLETED: set(),
+        },
+    }
+    # Written only through `transition_to`
+    status = models.CharField(choices=STATUSES, max_length=29, default=IN_KITCHEN, db_index=True)
+
+    # Sum of the items' prices, fixed when the order is created and changed only by price adjustments.
+    # Excludes the delivery cost, which is stored in `Delivery`.
+    price = models.DecimalField(decimal_places=2, max_digits=10, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['restaurant', 'status'], name='order_restaurant_status_idx'),
+        ]
+
+    def transition_to(self, status, **fields):
         '''
-        Delivery order: IN_KITCHEN -> READY_TO_PICKUP_AT_RESTAURANT -> DELIVERY_IN_TRANSIT -> COMPLETED
-        Self-pickup order: IN_KITCHEN -> READY_TO_PICKUP_AT_RESTAURANT -> COMPLETED
+        Changes the status, and writes `fields`, in a conditional UPDATE if `STATUS_TRANSITIONS` allows the change
+        from the status in the database. `self.status` may be stale if the order was loaded before a concurrent
+        transition, which then isn't overwritten.
         '''
-        if hasattr(self, 'cancellation'): 
-            return Order.CANCELLED
-        
-        if self.completed:
-            return Order.COMPLETED
-        
-        if self.type == Order.DELIVERY:
-            if not self.delivery.session:
-                return Order.SEARCHING_FOR_RIDER
-            if self.delivery.rider_pickup_datetime:
-                return Order.DELIVERY_IN_TRANSIT
-            elif self.kitchen_completed:
-                return Order.READY_TO_PICKUP_AT_RESTAURANT
-            else:
-                return Order.IN_KITCHEN
-        else:
-            if self.kitchen_completed:
-                return Order.READY_TO_PICKUP_AT_RESTAURANT
-            else:
-                return Order.IN_KITCHEN
+        if not Order.objects.filter(id=self.id).transition_to(self.type, status, **fields):
+            self.refresh_from_db(fields=['status'])
+            raise ValidationError(f'Order cannot change from {self.status} to {status}')
+        self.status = status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        send_post_save(self, ['status', *fields])
 
-    @property
-    def price(self):
-        return sum(item.price for item in self.items.all())
-    
+    @transaction.atomic
     def cancel(self, reason):
         if self.status == Order.CANCELLED:
             raise ValidationError('Cannot cancel order that has already been cancelled')
@@ -345,32 +686,49 @@ class Order(models.Model):
             raise ValidationError('Cannot cancel order that is ready to be picked up')
         elif self.status == Order.COMPLETED:
             raise ValidationError('Cannot cancel order that has already been completed')
+        self.transition_to(Order.CANCELLED)
         OrderCancellation.objects.create(order=self, reason=reason)
 
     def finish_cooking(self):
         if self.status == Order.CANCELLED:
-            raise ValidationError('Cannot cancel order that has already been cancelled')
-        elif self.status == Order.READY_TO_PICKUP_AT_RESTAURANT:
-            raise ValidationError('Cannot cancel order that is ready to be picked up')
+            raise ValidationError('Cannot finish cooking order that has already been cancelled')
         elif self.status == Order.COMPLETED:
-            raise ValidationError('Cannot cancel order that has already been completed')      
-        self.kitchen_completed = timezone.now()
-        self.save()
+            raise ValidationError('Cannot finish cooking order that has already been completed')      
+        elif self.kitchen_completed:
+            raise ValidationError('Order has already finished cooking')
+
+        # A delivery order only becomes ready to pick up once a rider has accepted it, which `Delivery.accept`
+        # checks in its own UPDATE. The status and `kitchen_completed` are written in one conditional UPDATE, so
+        # that whichever of the two runs first, the order ends up ready to pick up.
+        sources = [source for source, targets in Order.STATUS_TRANSITIONS[self.type].items()
+                   if Order.READY_TO_PICKUP_AT_RESTAURANT in targets]
+        kitchen_completed = timezone.now()
+        num_updated = Order.objects.filter(id=self.id, status__in=sources, kitchen_completed__isnull=True).update(
+            status=Case(When(status=Order.SEARCHING_FOR_RIDER, then=F('status')),
+                        default=Value(Order.READY_TO_PICKUP_AT_RESTAURANT)),
+            kitchen_completed=kitchen_completed,
+        )
+        self.refresh_from_db(fields=['status', 'kitchen_completed'])
+        if not num_updated:
+            raise ValidationError(f'Cannot finish cooking order that is {self.status}')
+        send_post_save(self, ['status', 'kitchen_completed'])
 
     @transaction.atomic
     def delay(self, delay_by):
         if self.delay_count > 2:
             raise ValidationError('Order has already been delayed twice, and cannot be delayed further')
             
+        # Only the fields that change, so that the order's status and price, and the delivery's session, which
+        # other requests write, aren't overwritten
         self.delay_count += 1
-        self.save()
+        self.save(update_fields=['delay_count'])
         
         if self.type == Order.DELIVERY:
             self.delivery.estimated_delivery_datetime += delay_by
-            self.delivery.save()
+            self.delivery.save(update_fields=['estimated_delivery_datetime'])
         else:
             self.self_pickup.estimated_pickup_datetime += delay_by
-            self.self_pickup.save()
+            self.self_pickup.save(update_fields=['estimated_pickup_datetime'])
     
     def complete(self):
         if self.status == Order.CANCELLED:
@@ -383,8 +741,7 @@ class Order(models.Model):
         elif self.type == Order.SELF_PICKUP and self.status != Order.READY_TO_PICKUP_AT_RESTAURANT:
             raise ValidationError('Invalid order state to complete self-pickup order')
             
-        self.completed = timezone.now()
-        self.save()
+        self.transition_to(Order.COMPLETED, completed=timezone.now())
         
     def __str__(self):
         return f'Order for {str(self.client)} by {str(self.restaurant)}'
@@ -403,18 +760,26 @@ class OrderItem(models.Model):
     order = models.ForeignKey('Order', on_delete=models.CASCADE, related_name='items')
     quantity = models.IntegerField(default=1)
 
-    @property
-    def price(self):
-        '''
-        Price inclusive of options and price adjustments
-        '''
-        result = self.menu_item.price
-        for option_group in self.option_groups.all():
-            for option in option_group.options.all():
-                result += option.menu_item_option.price
-        if hasattr(self, 'price_adjustment'):
-            result += self.price_adjustment.adjustment
-        return result
+    # Prices are fixed when the order is created, so that menu price changes don't affect existing orders.
+    # Price of one item inclusive of options
+    unit_price = models.DecimalField(decimal_places=2, max_digits=8, default=0)
+    # Price inclusive of options, quantity and price adjustments
+    price = models.DecimalField(decimal_places=2, max_digits=10, default=0)
+
+    @transaction.atomic
+    def adjust_price(self, adjustment, reason):
+        price_adjustment = OrderItemPriceAdjustment.objects.create(
+            order_item=self, 
+            adjustment=adjustment, 
+            reason=reason
+        )
+        OrderItem.objects.filter(id=self.id).update(price=F('price') + adjustment)
+        Order.objects.filter(id=self.order_id).update(price=F('price') + adjustment)
+
+        # An item is adjusted at most once, so its new price is known. See `merchant.fanout` for the order's.
+        self.price += adjustment
+        send_post_save(self, ['price'])
+        return price_adjustment
     
     def __str__(self):
         return f'Order Item: {str(self.menu_item)}'
@@ -438,6 +803,8 @@ class OrderItemOption(models.Model):
     order_item_option_group = models.ForeignKey('OrderItemOptionGroup', 
                                                 on_delete=models.CASCADE, 
                                                 related_name='options')
+    # Fixed when the order is created
+    price = models.DecimalField(decimal_places=2, max_digits=6, default=0)
     
     def __str__(self):
         return f'Order Item Option: {str(self.menu_item_option)}'
@@ -1,7 +1,7 @@
 from rest_framework import permissions
 from django.core.exceptions import ObjectDoesNotExist
 
-from merchant.models import Order, OrderItem, Restaurant
+from merchant.mixins import get_merchant, get_order, get_order_item
 
 
 class IsMerchant(permissions.BasePermission):
@@ -10,7 +10,7 @@ class IsMerchant(permissions.BasePermission):
     '''
     def has_permission(self, request, view):
         try: 
-            return request.user.merchant.restaurant.id == view.kwargs['restaurant_id']
+            return get_merchant(request).restaurant_id == view.kwargs['restaurant_id']
         except ObjectDoesNotExist:
             return False
 
@@ -21,9 +21,7 @@ class OrderIsForRestaurant(permissions.BasePermission):
     '''
     def has_permission(self, request, view):
         try: 
-            order_from_kwarg = Order.objects.get(id=view.kwargs['order_id'])
-            restaurant_from_kwarg = Restaurant.objects.get(id=view.kwargs['restaurant_id'])
-            return order_from_kwarg.restaurant == restaurant_from_kwarg
+            return get_order(request, view.kwargs['order_id']).restaurant_id == view.kwargs['restaurant_id']
         except ObjectDoesNotExist:
             return False
 
@@ -31,8 +29,6 @@ class OrderIsForRestaurant(permissions.BasePermission):
 class OrderItemIsInOrder(permissions.BasePermission):
     def has_permission(self, request, view):
         try:
-            order_from_kwarg = Order.objects.get(id=view.kwargs['order_id'])
-            order_item_from_kwarg = OrderItem.objects.get(id=view.kwargs['order_item_id'])
-            return order_item_from_kwarg.order == order_from_kwarg
+            return get_order_item(request, view.kwargs['order_item_id']).order_id == view.kwargs['order_id']
         except ObjectDoesNotExist:
-            return False 
\ No newline at end of file
+            return False
@@ -8,7 +8,7 @@ from django.db import IntegrityError, transaction
 from delivery.models import User
 from delivery.serializers import RegisterSerializer
 
-from merchant.models import Holiday, Menu, MenuCategory, MenuHours, MenuItem, MenuItemOption, MenuItemOptionGroup, Order, OrderCancellation, OrderItemPriceAdjustment, PauseHours, Restaurant, Merchant
+from merchant.models import Holiday, Menu, MenuCategory, MenuHours, MenuItem, MenuItemOption, MenuItemOptionGroup, Order, OrderCancellation, OrderItem, OrderItemPriceAdjustment, PauseHours, Restaurant, Merchant
 
 
 class MerchantRegisterSerializer(RegisterSerializer):
@@ -87,25 +87,12 @@ class MenuCategorySerializer(serializers.ModelSerializer):
 
 class MenuDetailSerializer(serializers.ModelSerializer):
     categories = MenuCategorySerializer(many=True)
-    hours = MenuHoursSerializer()
+    # Designated with the menu hours endpoint
+    menu_hours = MenuHoursSerializer(many=True, read_only=True)
 
     class Meta:
         model = Menu
-        fields = ['id', 'name', 'restaurant', 'categories', 'hours']
-    
-    def get_hours(self, obj):
-        result = {
-            MenuHours.MONDAY: [], 
-            MenuHours.TUESDAY: [], 
-            MenuHours.WEDNESDAY: [], 
-            MenuHours.THURSDAY: [], 
-            MenuHours.FRIDAY: [], 
-            MenuHours.SATURDAY: [], 
-            MenuHours.SUNDAY: [], 
-        }
-        
-        for menu_hours in MenuHours.objects.filter(menu=obj):
-            result[menu_hours.day_of_the_week] = (menu_hours.start_time, menu_hours.end_time)
+        fields = ['id', 'name', 'restaurant', 'categories', 'menu_hours']
 
     @transaction.atomic
     def create(self, validated_data):
@@ -227,11 +214,8 @@ class PriceAdjustmentSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         try:
-            return OrderItemPriceAdjustment.objects.create(
-                adjustment=validated_data['adjustment'], 
-                reason=validated_data['reason'], 
-                order_item_id=self.context['view'].kwargs['order_item_id']
-            )
+            order_item = self.context['view'].get_order_item()
+            return order_item.adjust_price(validated_data['adjustment'], validated_data['reason'])
         except IntegrityError:
             raise ValidationError('The price of an item can only be adjusted once')
 
@@ -0,0 +1,128 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from merchant import fanout
+from merchant.menu_graph import menu_graph_cache
+from merchant.models import Delivery, Holiday, Menu, MenuCategory, MenuHours, MenuItem, MenuItemOption, \
+    MenuItemOptionGroup, Order, OrderCancellation, OrderItem, OrderItemPriceAdjustment, PauseHours, SelfPickup, \
+    menu_deletions, menu_version_cache
+from merchant.timetable import timetable_cache
+
+
+def invalidate_timetable(restaurant_id):
+    # After commit, so that the timetable cannot be recompiled from the old rows in the meantime
+    transaction.on_commit(lambda: timetable_cache.invalidate(restaurant_id))
+
+
+@receiver(post_save, sender=MenuHours)
+@receiver(post_delete, sender=MenuHours)
+def invalidate_timetable_for_menu_hours(sender, instance, **kwargs):
+    invalidate_timetable(instance.menu.restaurant_id)
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+@receiver(post_save, sender=PauseHours)
+@receiver(post_delete, sender=PauseHours)
+def invalidate_timetable_for_restaurant(sender, instance, **kwargs):
+    invalidate_timetable(instance.restaurant_id)
+
+
+def invalidate_menu(menu_id):
+    # The menu's own writes are versioned in `Menu.save`
+    Menu.objects.filter(id=menu_id).bump_version()
+    transaction.on_commit(lambda: invalidate_menu_caches(menu_id))
+
+
+def invalidate_menu_caches(menu_id):
+    menu_graph_cache.invalidate(menu_id)
+    menu_version_cache.invalidate(menu_id)
+
+
+# Model of a menu object -> the model and the foreign key attribute of its parent
+MENU_PARENTS = {
+    MenuCategory: (Menu, 'menu_id'),
+    MenuItem: (MenuCategory, 'menu_category_id'),
+    MenuItemOptionGroup: (MenuItem, 'menu_item_id'),
+    MenuItemOption: (MenuItemOptionGroup, 'option_group_id'),
+}
+
+
+@receiver(pre_delete, sender=Menu)
+@receiver(pre_delete, sender=MenuCategory)
+@receiver(pre_delete, sender=MenuItem)
+@receiver(pre_delete, sender=MenuItemOptionGroup)
+@receiver(pre_delete, sender=MenuItemOption)
+def add_menu_deletion(sender, instance, **kwargs):
+    menu_deletions.add(sender, instance)
+
+
+def is_invalidated_by_parent(sender, instance, signal):
+    '''
+    Whether the object is deleted in cascade with its parent, which invalidates the menu once for the deletion
+    rather than once per option, without looking up the menu of each option
+    '''
+    if signal is not post_delete:
+        return False
+    parent_model, parent_attname = MENU_PARENTS[sender]
+    return (parent_model, getattr(instance, parent_attname)) in menu_deletions
+
+
+@receiver(post_save, sender=Menu)
+def invalidate_menu_version_for_menu(sender, instance, **kwargs):
+    # `Menu.save` changes the version
+    transaction.on_commit(lambda: menu_version_cache.invalidate(instance.id))
+
+
+@receiver(post_delete, sender=Menu)
+def invalidate_menu_caches_for_menu(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_menu_caches(instance.id))
+
+
+# NOTE: Menus are usually edited through nested serializers, which set the parent instances, so 
+# following the relations below doesn't query the DB.
+@receiver(post_save, sender=MenuCategory)
+@receiver(post_delete, sender=MenuCategory)
+def invalidate_menu_for_menu_category(sender, instance, signal, **kwargs):
+    if not is_invalidated_by_parent(sender, instance, signal):
+        invalidate_menu(instance.menu_id)
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def invalidate_menu_for_menu_item(sender, instance, signal, **kwargs):
+    if not is_invalidated_by_parent(sender, instance, signal):
+        invalidate_menu(instance.menu_category.menu_id)
+
+
+@receiver(post_save, sender=MenuItemOptionGroup)
+@receiver(post_delete, sender=MenuItemOptionGroup)
+def invalidate_menu_for_menu_item_option_group(sender, instance, signal, **kwargs):
+    if not is_invalidated_by_parent(sender, instance, signal):
+        invalidate_menu(instance.menu_item.menu_category.menu_id)
+
+
+@receiver(post_save, sender=MenuItemOption)
+@receiver(post_delete, sender=MenuItemOption)
+def invalidate_menu_for_menu_item_option(sender, instance, signal, **kwargs):
+    if not is_invalidated_by_parent(sender, instance, signal):
+        invalidate_menu(instance.option_group.menu_item.menu_category.menu_id)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=Delivery)
+@receiver(post_save, sender=SelfPickup)
+@receiver(post_save, sender=OrderCancellation)
+@receiver(post_save, sender=OrderItem)
+@receiver(post_save, sender=OrderItemPriceAdjustment)
+def fan_out_order_change(sender, instance, created, update_fields, **kwargs):
+    # NOTE: this is called on every write of an order *DO NOT make DB QUERIES HERE*
+    fanout.order_saved(instance, created, update_fields)
+
+
+@receiver(post_delete, sender=Order)
+def fan_out_order_deletion(sender, instance, **kwargs):
+    fanout.order_deleted(instance)
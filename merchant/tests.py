@@ -1,3 +1,792 @@
-from django.test import TestCase
+import asyncio
+import math
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.db.models.signals import pre_delete
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from delivery.models import User
+from delivery.testing import clear_caches, create_client, create_order, create_restaurant, create_session
+from merchant import fanout
+from merchant.fanout import OrderFanout, get_cell_group, get_restaurant_group, get_session_group
+from merchant.menu_graph import MenuGraph
+from merchant.models import Holiday, Menu, MenuHours, MenuItem, MenuItemOption, MenuItemOptionGroup, Order, \
+    OrderCancellation, OrderItem, Restaurant
+from merchant.timetable import Timetable
+from merchant.utils import GEOHASH_PRECISION, METERS_PER_DEGREE, GeohashIndex, calc_distance_from_coords, \
+    calc_geohash_cells_covering, calc_geohash_prefix_end, encode_geohash
+from merchant.wire import DICTIONARY, JSON, MENU_ITEM, MSGPACK_V1, OPTION, OPTION_GROUP, ORDER_ACTIVITY, \
+    ORDER_TAGS, STATUS_CODES, WireFormatMixin, decode, encode_orders, packb, select_subprotocol
+
+
+class PrefetchPlanTests(TestCase):
+    '''
+    Endpoints with nested serializers take the same number of queries regardless of the payload size
+    '''
+    def get_api(self, restaurant):
+        api = APIClient()
+        api.force_authenticate(restaurant.merchant.user)
+        return api
+
+    def test_menu_list(self):
+        for num_menus in (1, 5):
+            restaurant = create_restaurant()
+            for _ in range(num_menus - 1):
+                restaurant.menus.create(name='Menu')
+            api = self.get_api(restaurant)
+            with self.assertNumQueries(2):
+                response = api.get(f'/merchant/restaurants/{restaurant.id}/menus/')
+            self.assertEqual(len(response.data), num_menus)
+
+    def test_menu_detail(self):
+        for num_categories in (1, 3):
+            restaurant = create_restaurant(num_categories=num_categories, num_items=3, num_option_groups=2,
+                                           num_options=2)
+            menu = restaurant.menus.get()
+            api = self.get_api(restaurant)
+            with self.assertNumQueries(6):
+                response = api.get(f'/merchant/restaurants/{restaurant.id}/menus/{menu.id}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['categories']), num_categories)
+            self.assertEqual(len(response.data['menu_hours']), 7)
+
+    def test_menu_item_list(self):
+        for num_items in (1, 10):
+            restaurant = create_restaurant(num_items=num_items)
+            menu = restaurant.menus.get()
+            api = self.get_api(restaurant)
+            with self.assertNumQueries(1):
+                response = api.get(f'/merchant/restaurants/{restaurant.id}/menus/{menu.id}/items/')
+            self.assertEqual(len(response.data), num_items)
+
+    def test_menu_item_detail(self):
+        for num_option_groups in (1, 5):
+            restaurant = create_restaurant(num_option_groups=num_option_groups, num_options=3)
+            menu = restaurant.menus.get()
+            menu_item = menu.categories.get().items.get()
+            api = self.get_api(restaurant)
+            with self.assertNumQueries(3):
+                response = api.get(f'/merchant/restaurants/{restaurant.id}/menus/{menu.id}/items/{menu_item.id}/')
+            self.assertEqual(len(response.data['option_groups']), num_option_groups)
+
+    def test_order_detail(self):
+        client = create_client()
+        restaurant = create_restaurant(num_items=10, num_option_groups=3, num_options=3)
+        for num_items in (1, 10):
+            order = create_order(restaurant, client, num_items=num_items)
+            api = self.get_api(restaurant)
+            with self.assertNumQueries(4):
+                response = api.get(f'/merchant/restaurants/{restaurant.id}/orders/{order.id}/')
+            self.assertEqual(len(response.data['items']), num_items)
+
+
+class HolidayTests(TestCase):
+    '''
+    A restaurant's holidays don't overlap
+    '''
+    def setUp(self):
+        self.restaurant = create_restaurant()
+        now = timezone.now()
+        self.holiday = Holiday.objects.create(restaurant=self.restaurant, start_datetime=now + timedelta(days=7),
+                                              end_datetime=now + timedelta(days=8))
+
+    def test_update(self):
+        self.holiday.end_datetime += timedelta(days=1)
+        self.holiday.save()
+        self.holiday.refresh_from_db()
+        self.assertEqual(self.holiday.end_datetime - self.holiday.start_datetime, timedelta(days=2))
+
+    def test_overlapping_holiday(self):
+        with self.assertRaises(ValidationError):
+            Holiday.objects.create(restaurant=self.restaurant,
+                                   start_datetime=self.holiday.end_datetime - timedelta(hours=1),
+                                   end_datetime=self.holiday.end_datetime + timedelta(days=1))
+        # Another restaurant's holidays don't overlap
+        Holiday.objects.create(restaurant=create_restaurant(), start_datetime=self.holiday.start_datetime,
+                               end_datetime=self.holiday.end_datetime)
+
+
+class GeohashTests(SimpleTestCase):
+    '''
+    The geohash cells covering a circle contain every point of it, and each cell is one range of geohashes
+    '''
+    def offset(self, latitude, longitude, distance, bearing):
+        '''
+        The point about `distance` meters from the given one in the `bearing` direction (radians from north)
+        '''
+        latitude += distance * math.cos(bearing) / METERS_PER_DEGREE
+        longitude += distance * math.sin(bearing) / (METERS_PER_DEGREE * math.cos(math.radians(latitude)))
+        return latitude, (longitude + 180) % 360 - 180
+
+    def test_prefix_end(self):
+        self.assertEqual(calc_geohash_prefix_end('w21w'), 'w21x')
+        self.assertEqual(calc_geohash_prefix_end('w21z'), 'w22')
+        # 'a' isn't a geohash character
+        self.assertEqual(calc_geohash_prefix_end('w219'), 'w21b')
+        self.assertEqual(calc_geohash_prefix_end('zz'), None)
+
+    def test_prefix_range(self):
+        for latitude, longitude in [(1.3, 103.8), (0, 0), (-33.9, 151.2), (89.9, 179.9), (-89.9, -180)]:
+            geohash = encode_geohash(latitude, longitude)
+            for precision in range(1, GEOHASH_PRECISION):
+                prefix = geohash[:precision]
+                end = calc_geohash_prefix_end(prefix)
+                with self.subTest(geohash=geohash, prefix=prefix):
+                    self.assertGreaterEqual(geohash, prefix)
+                    if end is not None:
+                        self.assertLess(geohash, end)
+                        self.assertFalse(end.startswith(prefix))
+
+    def test_cells_cover_the_circle(self):
+        points = [
+            (1.3, 103.8),
+            # On cell edges at every precision
+            (0, 0),
+            (45, -90),
+            # Just inside the corner of a cell
+            (1.318359375 - 1e-7, 103.7109375 + 1e-7),
+            # Across the antimeridian
+            (10, 179.999),
+            (-10, -179.999),
+            (65, 180 - 1e-7),
+            # Near the poles
+            (89.99, 20),
+            (-89.99, -20),
+        ]
+        for latitude, longitude in points:
+            for radius in (10, 500, 5000, 50000):
+                cells = calc_geohash_cells_covering(latitude, longitude, radius)
+                precision = len(cells[0])
+                for bearing in range(16):
+                    for fraction in (0.5, 0.99):
+                        point = self.offset(latitude, longitude, radius * fraction, bearing * math.pi / 8)
+                        if calc_distance_from_coords(latitude, longitude, *point) > radius:
+                            continue
+                        with self.subTest(center=(latitude, longitude), radius=radius, point=point):
+                            self.assertIn(encode_geohash(*point, precision), cells)
+
+    def test_index_near(self):
+        Item = namedtuple('Item', ['latitude', 'longitude', 'geohash'])
+        items = [Item(latitude, longitude, encode_geohash(latitude, longitude))
+                 for latitude, longitude in [(10, 179.999), (10, -179.999), (10, 179.9), (10.1, 179.999)]]
+        near = GeohashIndex(items).near(10, -179.9995, 1000)
+        self.assertCountEqual(near, items[:2])
+
+
+class NearestRestaurantsTests(TestCase):
+    '''
+    The nearest open restaurants are found without loading or checking the others
+    '''
+    def setUp(self):
+        clear_caches()
+
+    def create_restaurants(self, *longitudes, latitude=1.3):
+        return [create_restaurant(latitude=latitude, longitude=longitude) for longitude in longitudes]
+
+    def close(self, restaurant):
+        now = timezone.now()
+        Holiday.objects.create(restaurant=restaurant, start_datetime=now - timedelta(hours=1),
+                               end_datetime=now + timedelta(hours=1))
+
+    def nearest(self, latitude=1.3, longitude=103.8, radius=5000, limit=20):
+        return Restaurant.objects.with_num_orders_in_progress().nearest(latitude, longitude, radius, limit)
+
+    def test_nearest_open_first(self):
+        far, closed, near, out_of_range = self.create_restaurants('103.82', '103.801', '103.802', '103.9')
+        self.close(closed)
+        restaurants = self.nearest()
+        self.assertEqual(restaurants, [near, far])
+        self.assertEqual([round(restaurant.distance) for restaurant in restaurants], [222, 2223])
+        self.assertEqual(restaurants[0].num_orders_in_progress, 0)
+        self.assertEqual(self.nearest(limit=1), [near])
+        self.assertEqual(self.nearest(radius=1000), [near])
+
+    def test_restaurants_beyond_the_limit_are_not_loaded(self):
+        self.create_restaurants(*(f'103.8{index:02}' for index in range(1, 31)))
+        self.nearest()
+        with self.assertNumQueries(2):
+            restaurants = self.nearest(limit=2)
+        self.assertEqual([restaurant.longitude for restaurant in restaurants], [Decimal('103.801'), Decimal('103.802')])
+
+    def test_batches(self):
+        restaurants = self.create_restaurants(*(f'103.8{index:02}' for index in range(1, 8)))
+        for restaurant in restaurants[:5]:
+            self.close(restaurant)
+        self.nearest()
+        # The candidates, then batches of 2, 4 and 1 restaurants
+        with self.assertNumQueries(4):
+            self.assertEqual(self.nearest(limit=2), restaurants[5:])
+
+    def test_antimeridian(self):
+        west, east = self.create_restaurants('-179.9990000', '179.9990000', latitude=10)
+        self.assertEqual(self.nearest(latitude=10, longitude=179.9995, radius=1000), [east, west])
+        self.assertEqual(self.nearest(latitude=10, longitude=-179.9999, radius=1000), [west, east])
+
+
+class TimetableTests(SimpleTestCase):
+    '''
+    Compiled timetables answer opening hours queries with half-open [start, end) intervals
+    '''
+    # A Monday
+    monday = datetime(2022, 8, 1, tzinfo=dt_timezone.utc)
+
+    def at(self, days=0, hours=0, minutes=0, seconds=0, microseconds=0):
+        return self.monday + timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds,
+                                       microseconds=microseconds)
+
+    def timetable(self, menu_hours, holidays=(), pauses=()):
+        return Timetable(menu_hours, list(holidays), list(pauses), compiled_at=self.monday)
+
+    def test_boundary_times(self):
+        timetable = self.timetable([(MenuHours.MONDAY, time(9), time(17), 1, 'Lunch')])
+        self.assertFalse(timetable.is_open(self.at(hours=9, microseconds=-1)))
+        self.assertTrue(timetable.is_open(self.at(hours=9)))
+        self.assertEqual(timetable.current_menu_hours(self.at(hours=17, microseconds=-1))[2:], (1, 'Lunch'))
+        self.assertFalse(timetable.is_open(self.at(hours=17)))
+        self.assertIsNone(timetable.current_menu_hours(self.at(hours=17)))
+        # Not on other days
+        self.assertFalse(timetable.is_open(self.at(days=1, hours=10)))
+        self.assertEqual(timetable.next_opening_datetime(self.at(hours=17)), self.at(days=7, hours=9))
+
+    def test_overnight_hours(self):
+        # Sunday night into Monday morning, which wraps around the week
+        timetable = self.timetable([
+            (MenuHours.SUNDAY, time(22), time(23, 59, 59), 1, 'Supper'),
+            (MenuHours.MONDAY, time(0), time(2), 1, 'Supper'),
+        ])
+        self.assertTrue(timetable.is_open(self.at(days=6, hours=23)))
+        self.assertTrue(timetable.is_open(self.at(days=7, hours=1)))
+        self.assertTrue(timetable.is_open(self.at(hours=1)))
+        self.assertFalse(timetable.is_open(self.at(hours=2)))
+        self.assertEqual(timetable.next_regular_opening(self.at(days=6, hours=23, minutes=59, seconds=59)),
+                         (self.at(days=7), self.at(days=7, hours=2)))
+        self.assertEqual(timetable.next_opening_datetime(self.at(hours=2)), self.at(days=6, hours=22))
+
+    def test_holidays_and_pauses(self):
+        timetable = self.timetable(
+            [(MenuHours.MONDAY, time(9), time(17), 1, 'Lunch')],
+            holidays=[(self.at(hours=10), self.at(hours=12))],
+            pauses=[(self.at(hours=12), self.at(hours=13)), (self.at(hours=15), self.at(hours=16))],
+        )
+        self.assertFalse(timetable.is_on_holiday(self.at(hours=10, microseconds=-1)))
+        self.assertTrue(timetable.is_on_holiday(self.at(hours=10)))
+        self.assertFalse(timetable.is_on_holiday(self.at(hours=12)))
+        self.assertTrue(timetable.is_paused(self.at(hours=12)))
+        self.assertFalse(timetable.is_paused(self.at(hours=13)))
+        self.assertFalse(timetable.is_open(self.at(hours=12, minutes=59)))
+        self.assertTrue(timetable.is_open(self.at(hours=13)))
+        # Adjacent closures are merged
+        self.assertEqual(timetable.next_opening_datetime(self.at(hours=10)), self.at(hours=13))
+        self.assertEqual(timetable.next_opening_datetime(self.at(hours=15, minutes=30)), self.at(hours=16))
+        # The regular hours still apply during closures
+        self.assertIsNotNone(timetable.current_menu_hours(self.at(hours=11)))
+
+    def test_closed_until_the_horizon(self):
+        timetable = self.timetable(
+            [(MenuHours.MONDAY, time(9), time(17), 1, 'Lunch')],
+            holidays=[(self.at(hours=9), self.at(days=1))],
+        )
+        self.assertEqual(timetable.next_opening_datetime(self.at(hours=9)), self.at(days=7, hours=9))
+        # The Monday after is beyond the horizon
+        timetable = self.timetable(
+            [(MenuHours.MONDAY, time(9), time(17), 1, 'Lunch')],
+            holidays=[(self.at(hours=9), self.at(days=7, hours=17))],
+        )
+        self.assertIsNone(timetable.next_opening_datetime(self.at(hours=9)))
+        self.assertIsNone(self.timetable([]).next_opening_datetime(self.at()))
+
+
+class MenuGraphTests(SimpleTestCase):
+    '''
+    Carts are validated against the option limits of each option group type
+    '''
+    def setUp(self):
+        # A menu item per option group type, each with one option group of 3 options
+        self.types = list(MenuItemOptionGroup.OPTION_LIMITS)
+        items, option_groups, options = [], [], []
+        for menu_item_id, type in enumerate(self.types, start=1):
+            items.append((menu_item_id, Decimal('5.00')))
+            option_groups.append((menu_item_id * 10, menu_item_id, *MenuItemOptionGroup.OPTION_LIMITS[type]))
+            options += [(menu_item_id * 100 + index, menu_item_id * 10, Decimal(index)) for index in range(3)]
+        self.graph = MenuGraph(items, option_groups, options)
+
+    def test_option_limits(self):
+        for menu_item_id, type in enumerate(self.types, start=1):
+            min_options, max_options = MenuItemOptionGroup.OPTION_LIMITS[type]
+            for num_options in range(4):
+                with self.subTest(type=type, num_options=num_options):
+                    option_ids = [menu_item_id * 100 + index for index in range(num_options)]
+                    selections = [(menu_item_id * 10, option_ids)] if num_options else []
+                    if num_options < min_options or (max_options is not None and num_options > max_options):
+                        with self.assertRaises(ValidationError):
+                            self.graph.price_item(menu_item_id, selections)
+                    else:
+                        price, option_prices = self.graph.price_item(menu_item_id, selections)
+                        self.assertEqual(price, Decimal('5.00'))
+                        self.assertEqual(option_prices, {option_id: Decimal(option_id % 100)
+                                                         for option_id in option_ids})
+
+    def test_option_of_another_menu_item(self):
+        # An option group and an option of another menu item
+        with self.assertRaises(ValidationError):
+            self.graph.price_item(4, [(30, [300])])
+        with self.assertRaises(ValidationError):
+            self.graph.price_item(4, [(40, [300])])
+
+    def test_picked_more_than_once(self):
+        with self.assertRaises(ValidationError):
+            self.graph.price_item(4, [(40, [400, 400])])
+        with self.assertRaises(ValidationError):
+            self.graph.price_item(4, [(40, [400]), (40, [401])])
+
+    def test_unknown_menu_item(self):
+        with self.assertRaises(ValidationError):
+            self.graph.price_item(5, [])
+
+
+class CurrentMenuTests(TestCase):
+    '''
+    A restaurant's current menu is read from cached timetables and versions, without queries
+    '''
+    def setUp(self):
+        clear_caches()
+        self.restaurant = create_restaurant()
+        self.menu = self.restaurant.menus.get()
+
+    def current_menu(self):
+        restaurant = Restaurant.objects.get(id=self.restaurant.id)
+        with self.assertNumQueries(0):
+            menu = restaurant.current_menu
+            return menu.id, menu.name, menu.version
+
+    def test_current_menu(self):
+        self.restaurant.current_menu
+        self.assertEqual(self.current_menu(), (self.menu.id, self.menu.name, self.menu.version))
+
+    def test_version_changes(self):
+        self.restaurant.current_menu
+        menu_item = MenuItem.objects.get(menu_category__menu=self.menu)
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item.price += 1
+            menu_item.save()
+        self.restaurant.current_menu
+        self.menu.refresh_from_db()
+        self.assertEqual(self.current_menu()[2], self.menu.version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.menu.name = 'Renamed'
+            self.menu.save()
+        self.restaurant.current_menu
+        self.assertEqual(self.current_menu(), (self.menu.id, 'Renamed', self.menu.version))
+
+
+class MenuDeleteTests(TestCase):
+    '''
+    Menus are deleted unless some of their items have been ordered
+    '''
+    def delete(self, restaurant):
+        api = APIClient()
+        api.force_authenticate(restaurant.merchant.user)
+        return api.delete(f'/merchant/restaurants/{restaurant.id}/menus/{restaurant.menus.get().id}/')
+
+    def test_delete(self):
+        restaurant = create_restaurant()
+        self.assertEqual(self.delete(restaurant).status_code, 204)
+        self.assertFalse(Menu.objects.filter(restaurant=restaurant).exists())
+
+    def test_menu_with_ordered_items(self):
+        restaurant = create_restaurant()
+        create_order(restaurant, create_client())
+        self.assertEqual(self.delete(restaurant).status_code, 400)
+        self.assertTrue(Menu.objects.filter(restaurant=restaurant).exists())
+
+
+class OrderStatusTests(TestCase):
+    '''
+    Order statuses change as `Order.STATUS_TRANSITIONS` allows, from the status in the database rather than the
+    status of instances loaded before another request changed it
+    '''
+    def setUp(self):
+        self.restaurant = create_restaurant()
+        self.client_ = create_client()
+
+    def test_transition_table(self):
+        statuses = [status for status, _ in Order.STATUSES]
+        for delivery, order_type in ((True, Order.DELIVERY), (False, Order.SELF_PICKUP)):
+            order = create_order(self.restaurant, self.client_, delivery=delivery)
+            for source in Order.STATUS_TRANSITIONS[order_type]:
+                for target in statuses:
+                    with self.subTest(order_type=order_type, source=source, target=target):
+                        Order.objects.filter(id=order.id).update(status=source)
+                        instance = Order.objects.get(id=order.id)
+                        allowed = target in Order.STATUS_TRANSITIONS[order_type][source]
+                        if allowed:
+                            instance.transition_to(target)
+                        else:
+                            with self.assertRaises(ValidationError):
+                                instance.transition_to(target)
+                        instance.refresh_from_db()
+                        self.assertEqual(instance.status, target if allowed else source)
+
+    def test_finish_cooking(self):
+        order = create_order(self.restaurant, self.client_, delivery=False)
+        order.finish_cooking()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.READY_TO_PICKUP_AT_RESTAURANT)
+        self.assertIsNotNone(order.kitchen_completed)
+        with self.assertRaises(ValidationError):
+            order.finish_cooking()
+
+    def test_finish_cooking_a_cancelled_order(self):
+        order = create_order(self.restaurant, self.client_)
+        Order.objects.get(id=order.id).cancel('Reason')
+
+        with self.assertRaises(ValidationError):
+            order.finish_cooking()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.CANCELLED)
+        self.assertIsNone(order.kitchen_completed)
+
+    def test_cancel_an_order_ready_to_pick_up(self):
+        order = create_order(self.restaurant, self.client_, delivery=False)
+        Order.objects.get(id=order.id).finish_cooking()
+
+        with self.assertRaises(ValidationError):
+            order.cancel('Reason')
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.READY_TO_PICKUP_AT_RESTAURANT)
+        self.assertFalse(OrderCancellation.objects.filter(order=order).exists())
+
+    def test_delay_keeps_adjusted_price(self):
+        order = create_order(self.restaurant, self.client_)
+        order_item = OrderItem.objects.get(order=order)
+        order_item.adjust_price(Decimal('-1.00'), 'Out of stock')
+
+        order.delay(timedelta(minutes=10))
+        order.refresh_from_db()
+        self.assertEqual(order.price, order_item.price)
+        self.assertEqual(order.delay_count, 1)
+
+    def test_complete_a_cancelled_order(self):
+        order = create_order(self.restaurant, self.client_)
+        Order.objects.filter(id=order.id).update(status=Order.DELIVERY_IN_TRANSIT)
+        order.refresh_from_db()
+        Order.objects.get(id=order.id).cancel('Reason')
+
+        with self.assertRaises(ValidationError):
+            order.complete()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.CANCELLED)
+        self.assertIsNone(order.completed)
+
+
+class RequestObjectsTests(TestCase):
+    '''
+    Permissions and views load each object in the url once per request
+    '''
+    def test_order_item_price_adjustment(self):
+        restaurant = create_restaurant()
+        order = create_order(restaurant, create_client())
+        order_item = order.items.get()
+        api = APIClient()
+        # A user without its merchant loaded, as authentication returns it
+        api.force_authenticate(User.objects.get(id=restaurant.merchant.user_id))
+        # The merchant with its restaurant, the order and the order item, then the adjustment and the prices
+        # within a savepoint
+        with self.assertNumQueries(8):
+            response = api.post(
+                f'/merchant/restaurants/{restaurant.id}/orders/{order.id}/items/{order_item.id}/adjust-price/',
+                {'adjustment': '-1.00', 'reason': 'Out of stock'},
+            )
+        self.assertEqual(response.status_code, 201)
+        order.refresh_from_db()
+        self.assertEqual(order.price, order_item.price - 1)
+
+    def test_order_item_of_another_order(self):
+        restaurant = create_restaurant()
+        client = create_client()
+        order = create_order(restaurant, client)
+        other_order_item = create_order(restaurant, client).items.get()
+        api = APIClient()
+        api.force_authenticate(User.objects.get(id=restaurant.merchant.user_id))
+        response = api.post(
+            f'/merchant/restaurants/{restaurant.id}/orders/{order.id}/items/{other_order_item.id}/adjust-price/',
+            {'adjustment': '-1.00', 'reason': 'Out of stock'},
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class MenuInvalidationTests(TestCase):
+    '''
+    Deleting a menu object invalidates its menu once, regardless of the objects deleted in cascade
+    '''
+    def delete(self, instance):
+        with CaptureQueriesContext(connection) as context:
+            instance.delete()
+        bumps = [query for query in context.captured_queries
+                 if query['sql'].startswith(f'UPDATE "{Menu._meta.db_table}"')]
+        return len(context.captured_queries), len(bumps)
+
+    def test_menu_item_delete(self):
+        results = []
+        for num_option_groups in (1, 3):
+            restaurant = create_restaurant(num_option_groups=num_option_groups, num_options=3)
+            menu = restaurant.menus.get()
+            version = menu.version
+            results.append(self.delete(MenuItem.objects.get(menu_category__menu=menu)))
+            menu.refresh_from_db()
+            self.assertNotEqual(menu.version, version)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][1], 1)
+
+    def test_menu_delete(self):
+        restaurant = create_restaurant(num_categories=2, num_items=2, num_option_groups=2, num_options=2)
+        _, bumps = self.delete(restaurant.menus.get())
+        self.assertEqual(bumps, 0)
+
+    def test_failed_delete(self):
+        menu = create_restaurant().menus.get()
+        menu_item = MenuItem.objects.get(menu_category__menu=menu)
+
+        def fail(**kwargs):
+            raise DatabaseError
+
+        pre_delete.connect(fail, sender=MenuItem)
+        try:
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                menu_item.delete()
+        finally:
+            pre_delete.disconnect(fail, sender=MenuItem)
+
+        # The option group isn't deleted with the menu item of the failed deletion
+        _, bumps = self.delete(MenuItemOptionGroup.objects.get(menu_item=menu_item))
+        self.assertEqual(bumps, 1)
+
+    def test_queryset_delete(self):
+        menu = create_restaurant(num_options=3).menus.get()
+        version = menu.version
+        MenuItemOption.objects.filter(option_group__menu_item__menu_category__menu=menu).delete()
+        menu.refresh_from_db()
+        self.assertNotEqual(menu.version, version)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'delivery.layers.BoundedInMemoryChannelLayer'}})
+class OrderFanoutTests(TestCase):
+    '''
+    Committed changes of orders are sent to their groups when the fan-out flushes
+    '''
+    def setUp(self):
+        # Flushed by the tests rather than by its timer, which runs without the test's transaction
+        self.fanout = OrderFanout(flush_interval=60)
+        patcher = mock.patch.object(fanout, 'order_fanout', self.fanout)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.layer = get_channel_layer()
+        self.restaurant = create_restaurant()
+        self.order = create_order(self.restaurant, create_client())
+
+    def subscribe(self, group):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(group, channel)
+        return channel
+
+    def receive(self, channel):
+        '''
+        Returns the messages sent to the channel
+        '''
+        async def receive():
+            messages = []
+            while True:
+                try:
+                    messages.append(await asyncio.wait_for(self.layer.receive(channel), 0.01))
+                except asyncio.TimeoutError:
+                    return messages
+
+        return async_to_sync(receive)()
+
+    def commit(self, write):
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.fanout.flush()
+
+    def test_burst_is_merged(self):
+        channel = self.subscribe(get_restaurant_group(self.restaurant.id))
+
+        def delay_twice():
+            self.order.delay(timedelta(minutes=5))
+            self.order.delay(timedelta(minutes=5))
+
+        self.commit(delay_twice)
+
+        [message] = self.receive(channel)
+        [event] = message['orders']
+        self.assertEqual(event['id'], self.order.id)
+        self.assertEqual(event['delay_count'], 2)
+        self.assertEqual(event['estimated_completion_datetime'],
+                         str(self.order.delivery.estimated_delivery_datetime))
+
+    def test_new_orders_are_batched(self):
+        channel = self.subscribe(get_restaurant_group(self.restaurant.id))
+        orders = []
+        self.commit(lambda: orders.extend(create_order(self.restaurant, self.order.client) for _ in range(2)))
+
+        [message] = self.receive(channel)
+        self.assertEqual([event['id'] for event in message['orders']], [order.id for order in orders])
+        self.assertEqual(len(message['orders'][0]['items']), 1)
+
+    def test_signal_path_makes_no_queries(self):
+        channel = self.subscribe(get_restaurant_group(self.restaurant.id))
+        order_item = OrderItem.objects.select_related('order').get(order=self.order)
+        order_item.price += 1
+        with self.captureOnCommitCallbacks(execute=True):
+            # The UPDATE
+            with self.assertNumQueries(1):
+                order_item.save(update_fields=['price'])
+        self.assertEqual(self.fanout._pending[self.order.id].restaurant_id, self.restaurant.id)
+        self.fanout.flush()
+
+        [message] = self.receive(channel)
+        self.assertEqual(message['orders'], [
+            {'id': self.order.id, 'items': [{'instance_id': order_item.id, 'price': float(order_item.price)}]},
+        ])
+
+    def test_refreshed_fields_are_read_at_flush(self):
+        channel = self.subscribe(get_restaurant_group(self.restaurant.id))
+        order_item = OrderItem.objects.select_related('order').get(order=self.order)
+
+        def adjust_price():
+            order_item.adjust_price(Decimal('-1.00'), 'Out of stock')
+            # Without signals, as `adjust_price` writes the order's price
+            Order.objects.filter(id=self.order.id).update(price=F('price') - 2)
+
+        self.commit(adjust_price)
+
+        [message] = self.receive(channel)
+        self.order.refresh_from_db()
+        self.assertEqual(message['orders'], [{
+            'id': self.order.id,
+            'price': str(self.order.price),
+            'items': [{
+                'instance_id': order_item.id,
+                'price': float(order_item.price),
+                'price_adjustment': {'adjustment': '-1.00', 'reason': 'Out of stock'},
+            }],
+        }])
+
+    def subscribe_nearby(self):
+        return self.subscribe(get_cell_group(float(self.restaurant.latitude), float(self.restaurant.longitude),
+                                             self.restaurant.geohash))
+
+    def test_accepted_delivery(self):
+        session = create_session()
+        restaurant_channel = self.subscribe(get_restaurant_group(self.restaurant.id))
+        session_channel = self.subscribe(get_session_group(session.id))
+        nearby_channel = self.subscribe_nearby()
+
+        self.commit(lambda: self.order.delivery.accept(session))
+
+        [message] = self.receive(restaurant_channel)
+        [event] = message['orders']
+        self.assertEqual(event['rider_session'], session.id)
+        self.assertEqual(event['status'], Order.IN_KITCHEN)
+        self.assertEqual(self.receive(session_channel)[0]['orders'], [event])
+        [message] = self.receive(nearby_channel)
+        self.assertEqual(message['deliveries'], [{'id': self.order.id, 'open': False}])
+
+    def test_deleted_order(self):
+        restaurant_channel = self.subscribe(get_restaurant_group(self.restaurant.id))
+        nearby_channel = self.subscribe_nearby()
+
+        # Without its restaurant loaded
+        self.commit(Order.objects.get(id=self.order.id).delete)
+
+        [message] = self.receive(restaurant_channel)
+        self.assertEqual(message['orders'], [{'id': self.order.id, 'deleted': True}])
+        [message] = self.receive(nearby_channel)
+        self.assertEqual(message['deliveries'], [{'id': self.order.id, 'open': False}])
+
+
+class WireFormatTests(SimpleTestCase):
+    '''
+    Order events are encoded in the msgpack format of `merchant.wire`, and decoded back
+    '''
+    def get_document(self, item_name='Item'):
+        return {
+            'id': 1,
+            'status': Order.SEARCHING_FOR_RIDER,
+            'price': '6.50',
+            'created': '2022-07-23T08:29:53.467042Z',
+            'items': [{
+                'id': 2,
+                'instance_id': 3,
+                'name': item_name,
+                'price': 6.5,
+                'quantity': 1,
+                'option_groups': [{'id': 4, 'name': 'Group', 'options': [{'id': 5, 'name': 'Option'}]}],
+                'price_adjustment': None,
+            }],
+        }
+
+    def test_encode_orders(self):
+        frame, names = encode_orders([self.get_document()])
+
+        self.assertEqual(names, [[MENU_ITEM, 2, 'Item'], [OPTION_GROUP, 4, 'Group'], [OPTION, 5, 'Option']])
+        frame_type, [order] = decode(frame)
+        self.assertEqual(frame_type, ORDER_ACTIVITY)
+        self.assertEqual(order[ORDER_TAGS['id']], 1)
+        self.assertEqual(order[ORDER_TAGS['status']], STATUS_CODES[Order.SEARCHING_FOR_RIDER])
+        self.assertEqual(order[ORDER_TAGS['price']], Decimal('6.50'))
+        self.assertEqual(order[ORDER_TAGS['created']].isoformat(), '2022-07-23T08:29:53.467042+00:00')
+        [item] = order[ORDER_TAGS['items']]
+        self.assertEqual(item, {0: 2, 1: 3, 2: Decimal('6.5'), 3: 1, 4: [{0: 4, 1: [{0: 5}]}], 5: None})
+
+    def test_decimals(self):
+        # Within the `max_digits` of the models' decimal fields
+        for value in (Decimal('0'), Decimal('-1.00'), Decimal('99999999.99')):
+            self.assertEqual(decode(packb(value)), value)
+            self.assertEqual(str(decode(packb(value))), str(value))
+
+    def test_select_subprotocol(self):
+        self.assertEqual(select_subprotocol([JSON, MSGPACK_V1]), MSGPACK_V1)
+        self.assertEqual(select_subprotocol([JSON]), JSON)
+        self.assertIsNone(select_subprotocol(['other']))
+        self.assertIsNone(select_subprotocol([]))
+
+    def test_names_are_sent_again_when_renamed(self):
+        class Consumer(WireFormatMixin):
+            def __init__(self):
+                self.frames = []
+
+            async def accept(self, subprotocol):
+                pass
+
+            async def send(self, bytes_data):
+                self.frames.append(decode(bytes_data))
+
+        consumer = Consumer()
+        consumer.scope = {'subprotocols': [MSGPACK_V1]}
+        async_to_sync(consumer.connect)()
+
+        def send(item_name):
+            frame, names = encode_orders([self.get_document(item_name)])
+            consumer.frames = []
+            async_to_sync(consumer.send_order_activity)({'orders': [], 'packed': frame, 'names': names})
+            return [frame for frame in consumer.frames if frame[0] == DICTIONARY]
+
+        self.assertEqual(send('Item'), [
+            [DICTIONARY, [[MENU_ITEM, 2, 'Item'], [OPTION_GROUP, 4, 'Group'], [OPTION, 5, 'Option']]],
+        ])
+        self.assertEqual(send('Item'), [])
+        self.assertEqual(send('Renamed'), [[DICTIONARY, [[MENU_ITEM, 2, 'Renamed']]]])
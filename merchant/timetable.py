@@ -0,0 +1,122 @@
+from bisect import bisect_right
+from datetime import timedelta
+
+from delivery.cache import LayeredCache
+
+
+WEEK = timedelta(days=7)
+
+# Holidays and pauses are compiled if they overlap [compiled_at, compiled_at + HORIZON).
+# Cached timetables expire long before the horizon is reached.
+HORIZON = timedelta(days=14)
+
+timetable_cache = LayeredCache('merchant.timetable', timeout=60 * 60, local_timeout=5)
+
+
+def time_of_day(t):
+    return timedelta(hours=t.hour, minutes=t.minute, seconds=t.second, microseconds=t.microsecond)
+
+
+def time_of_week(dt):
+    '''
+    Offset of `dt` from the start of its week (Monday 00:00)
+    '''
+    return timedelta(days=dt.weekday()) + time_of_day(dt)
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def find_interval(intervals, starts, at):
+    '''
+    Returns the interval in sorted, non-overlapping `intervals` that contains `at`, or None
+    '''
+    index = bisect_right(starts, at) - 1
+    if index >= 0 and at < intervals[index][1]:
+        return intervals[index]
+    return None
+
+
+class Timetable:
+    '''
+    A restaurant's opening hours, compiled from its `MenuHours`, `Holiday`s and `PauseHours` so that they 
+    can be queried with binary searches instead of DB queries. All intervals are half-open: [start, end).
+
+    `menu_hours` are (day_of_the_week, start_time, end_time, menu_id, menu_name) tuples, and `holidays` and 
+    `pauses` are (start_datetime, end_datetime) tuples.
+    '''
+    def __init__(self, menu_hours, holidays, pauses, compiled_at):
+        self.weekly_hours = sorted(
+            (timedelta(days=day) + time_of_day(start), timedelta(days=day) + time_of_day(end), menu_id, menu_name)
+            for day, start, end, menu_id, menu_name in menu_hours
+        )
+        self.weekly_hours_starts = [hours[0] for hours in self.weekly_hours]
+        self.holidays = merge_intervals(holidays)
+        self.holidays_starts = [start for start, _ in self.holidays]
+        self.pauses = merge_intervals(pauses)
+        self.pauses_starts = [start for start, _ in self.pauses]
+        self.closures = merge_intervals(self.holidays + self.pauses)
+        self.closures_starts = [start for start, _ in self.closures]
+        self.valid_until = compiled_at + HORIZON
+
+    def current_menu_hours(self, at):
+        '''
+        Returns the (start, end, menu_id, menu_name) weekly hours that `at` falls in, or None
+        '''
+        offset = time_of_week(at)
+        index = bisect_right(self.weekly_hours_starts, offset) - 1
+        if index >= 0 and offset < self.weekly_hours[index][1]:
+            return self.weekly_hours[index]
+        return None
+
+    def is_on_holiday(self, at):
+        return find_interval(self.holidays, self.holidays_starts, at) is not None
+
+    def is_paused(self, at):
+        return find_interval(self.pauses, self.pauses_starts, at) is not None
+
+    def is_open(self, at):
+        return self.current_menu_hours(at) is not None \
+            and find_interval(self.closures, self.closures_starts, at) is None
+
+    def next_regular_opening(self, at):
+        '''
+        Returns the (start, end) datetimes of the regular opening hours containing `at`, or else the next ones
+        '''
+        if not self.weekly_hours:
+            return None
+        offset = time_of_week(at)
+        week_start = at - offset
+        index = bisect_right(self.weekly_hours_starts, offset) - 1
+        if index >= 0 and offset < self.weekly_hours[index][1]:
+            start, end, _, _ = self.weekly_hours[index]
+        elif index + 1 < len(self.weekly_hours):
+            start, end, _, _ = self.weekly_hours[index + 1]
+        else:
+            start, end, _, _ = self.weekly_hours[0]
+            week_start += WEEK
+        return week_start + start, week_start + end
+
+    def next_opening_datetime(self, at):
+        '''
+        Returns the earliest datetime from `at` onwards at which the restaurant is open, 
+        or None if it stays closed until the end of the compiled horizon.
+        '''
+        candidate = at
+        while candidate < self.valid_until:
+            regular_opening = self.next_regular_opening(candidate)
+            if regular_opening is None:
+                return None
+            candidate = max(candidate, regular_opening[0])
+            closure = find_interval(self.closures, self.closures_starts, candidate)
+            if closure is None:
+                return candidate if candidate < self.valid_until else None
+            candidate = closure[1]
+        return None
@@ -1,8 +1,18 @@
+from collections import namedtuple
 from datetime import timedelta
+from itertools import product
 import math
 
+from django.conf import settings
+
+EARTH_RADIUS = 6371e3  # meters
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180  # Along a meridian
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # ~5m x 5m cells
+
+
 def calc_distance_from_coords(lat_1, lon_1, lat_2, lon_2):
-    EARTH_RADIUS = 6371e3  # meters
     phi_1 = lat_1 * math.pi / 180  # radians
     phi_2 = lat_2 * math.pi / 180   # radians
     delta_phi = (lat_2 - lat_1) * math.pi / 180  
@@ -13,6 +23,175 @@ def calc_distance_from_coords(lat_1, lon_1, lat_2, lon_2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return EARTH_RADIUS * c  # meters
 
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    '''
+    Encodes a coordinate as a geohash. Points in the same cell share a common prefix,
+    so a cell and all of its sub-cells form one contiguous range in a B-tree index.
+    '''
+    lat_interval = [-90.0, 90.0]
+    lon_interval = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    is_lon_bit = True
+    while len(geohash) < precision:
+        interval, value = (lon_interval, longitude) if is_lon_bit else (lat_interval, latitude)
+        mid = (interval[0] + interval[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            interval[0] = mid
+        else:
+            bits = bits * 2
+            interval[1] = mid
+        is_lon_bit = not is_lon_bit
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def calc_geohash_cell_size(precision):
+    '''
+    Returns the (latitude, longitude) dimensions of a geohash cell in degrees
+    '''
+    num_bits = precision * 5
+    num_lon_bits = math.ceil(num_bits / 2)
+    num_lat_bits = num_bits // 2
+    return 180 / 2 ** num_lat_bits, 360 / 2 ** num_lon_bits
+
+
+def calc_geohash_prefix_end(prefix):
+    '''
+    Returns the first geohash after all the geohashes starting with `prefix`, or None if there isn't one
+    '''
+    prefix = prefix.rstrip(GEOHASH_BASE32[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + GEOHASH_BASE32[GEOHASH_BASE32.index(prefix[-1]) + 1]
+
+
+def calc_bounding_box(latitude, longitude, radius):
+    '''
+    Returns (min_latitude, max_latitude, min_longitude, max_longitude) of the box enclosing
+    the circle of `radius` meters around the given point.
+    '''
+    lat_delta = radius / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(latitude) + lat_delta, 90)))
+    lon_delta = 180 if cos_lat < 1e-9 else min(radius / (METERS_PER_DEGREE * cos_lat), 180)
+    return latitude - lat_delta, latitude + lat_delta, longitude - lon_delta, longitude + lon_delta
+
+
+def calc_geohash_cells_covering(latitude, longitude, radius):
+    '''
+    Returns the geohash cells that together cover the circle of `radius` meters around the given point: the
+    cells that intersect the circle's bounding box, at the finest precision whose cells are at least as large as
+    half the box in each dimension, which are at most 3 x 3 cells. Near the poles the box spans every longitude,
+    and so do the cells.
+    '''
+    min_lat, max_lat, min_lon, max_lon = calc_bounding_box(latitude, longitude, radius)
+    lat_delta, lon_delta = max_lat - latitude, max_lon - longitude
+
+    precision = 1
+    for candidate_precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat, cell_lon = calc_geohash_cell_size(candidate_precision)
+        if cell_lat >= lat_delta and cell_lon >= lon_delta:
+            precision = candidate_precision
+            break
+
+    # Points no further apart than a cell, so that every cell that intersects the box contains one of them
+    cell_lat, cell_lon = calc_geohash_cell_size(precision)
+    min_lat, max_lat = max(min_lat, -90), min(max_lat, 90)
+    if max_lon - min_lon >= 360:
+        min_lon, max_lon = -180, 180
+    lats = [min_lat + step * cell_lat for step in range(math.ceil((max_lat - min_lat) / cell_lat))] + [max_lat]
+    lons = [min_lon + step * cell_lon for step in range(math.ceil((max_lon - min_lon) / cell_lon))] + [max_lon]
+    cells = set()
+    for point_lat, point_lon in product(lats, lons):
+        cells.add(encode_geohash(point_lat, (point_lon + 180) % 360 - 180, precision))
+    return sorted(cells)
+
+
+class GeohashIndex:
+    '''
+    Items with `latitude`, `longitude` (floats) and `geohash` attributes, bucketed by geohash prefix, so that
+    the items near a point are found without scanning every item
+    '''
+    def __init__(self, items):
+        self.items = items
+        self._buckets_by_precision = {}
+
+    def near(self, latitude, longitude, radius):
+        '''
+        Yields the items that may be within `radius` meters of the given point. Like
+        `RestaurantQuerySet.within_radius`, the geohash cells are narrowed down by a bounding box, so exact
+        distances must be checked by the caller.
+        '''
+        cells = calc_geohash_cells_covering(latitude, longitude, radius)
+        precision = len(cells[0])
+        buckets = self._buckets_by_precision.get(precision)
+        if buckets is None:
+            buckets = {}
+            for item in self.items:
+                buckets.setdefault(item.geohash[:precision], []).append(item)
+            self._buckets_by_precision[precision] = buckets
+        min_lat, max_lat, min_lon, max_lon = calc_bounding_box(latitude, longitude, radius)
+        # Skip the longitude check when the box wraps around the antimeridian
+        check_lon = min_lon >= -180 and max_lon <= 180
+        for cell in cells:
+            for item in buckets.get(cell, ()):
+                if min_lat <= item.latitude <= max_lat \
+                        and (not check_lon or min_lon <= item.longitude <= max_lon):
+                    yield item
+
+
+DeliveryQuote = namedtuple('DeliveryQuote', ['distance', 'delivery_cost', 'delivery_time'])
+
+
+def calc_delivery_quotes(restaurants, user_latitude, user_longitude):
+    '''
+    Calculates the distance (meters, rounded), delivery cost and delivery time from every restaurant 
+    to the user in a single pass, computing the user's trigonometry only once.
+    Returns a dict of restaurant id -> `DeliveryQuote`.
+    '''
+    user_phi = math.radians(user_latitude)
+    cos_user_phi = math.cos(user_phi)
+    user_lambda = math.radians(user_longitude)
+    cost_per_meter = settings.DELIVERY_COST_PER_METER
+    minutes_per_meter = settings.ADDITIONAL_DELIVERY_TIME_PER_METER
+    
+    quotes = {}
+    for restaurant in restaurants:
+        phi = math.radians(float(restaurant.latitude))
+        lambda_ = math.radians(float(restaurant.longitude))
+        a = math.sin((phi - user_phi) / 2) ** 2 \
+            + cos_user_phi * math.cos(phi) * math.sin((lambda_ - user_lambda) / 2) ** 2
+        distance = round(2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1))))
+
+        num_orders_in_progress = getattr(restaurant, 'num_orders_in_progress', None)
+        if num_orders_in_progress is None:
+            fulfillment_minutes = restaurant.order_fulfillment_time / timedelta(minutes=1)
+        else:
+            fulfillment_minutes = calc_order_fulfillment_minutes(num_orders_in_progress)
+
+        quotes[restaurant.id] = DeliveryQuote(
+            distance=distance, 
+            delivery_cost=round(distance * cost_per_meter, 1), 
+            delivery_time=timedelta(minutes=20 + distance * minutes_per_meter + fulfillment_minutes)
+        )
+    return quotes
+
+
+def calc_order_fulfillment_minutes(num_orders_in_progress):
+    return 10 + num_orders_in_progress * 3
+
+
+def calc_order_fulfillment_time(num_orders_in_progress):
+    return timedelta(minutes=calc_order_fulfillment_minutes(num_orders_in_progress))
+
+
 def round_to_base(x, base=5):
     return base * round(x/base)
     
@@ -27,4 +206,4 @@ def calc_delivery_time(restaurant, user_latitude, user_longitude):
     transit_time = timedelta(minutes=round_to_base(20 + dist * 60 / 20, 5))
     return transit_time + restaurant.order_fulfillment_time
     
-    
\ No newline at end of file
+    
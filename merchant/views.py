@@ -6,9 +6,12 @@ from rest_framework import status
 from rest_framework import views
 from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import ProtectedError
 from client.serializers import OrderDetailSerializer
+from delivery.mixins import PrefetchPlanMixin
 
 from merchant.models import Holiday, MenuHours, MenuItem, Order, PauseHours, Restaurant, Menu
+from merchant.mixins import MerchantObjectsMixin
 from merchant.permissions import IsMerchant, OrderIsForRestaurant, OrderItemIsInOrder
 from merchant.serializers import HolidaySerializer, MenuDetailSerializer, MenuHoursSerializer, \
     MenuListSerializer, MenuItemListSerializer, MenuItemDetailSerializer, OrderCancelSerializer, \
@@ -21,11 +24,11 @@ class RestaurantCreate(generics.CreateAPIView):
     serializer_class = RestaurantSerializer
     
 
-class MenuListCreate(generics.ListCreateAPIView):
+class MenuListCreate(PrefetchPlanMixin, generics.ListCreateAPIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant]
 
     def get_queryset(self):
-        restaurant = self.request.user.merchant.restaurant
+        restaurant = self.get_restaurant()
         return Menu.objects.filter(restaurant=restaurant)
     
     def get_serializer_class(self):
@@ -35,28 +38,34 @@ class MenuListCreate(generics.ListCreateAPIView):
             return MenuDetailSerializer
 
 
-class MenuDetail(generics.RetrieveUpdateDestroyAPIView):
+class MenuDetail(PrefetchPlanMixin, generics.RetrieveUpdateDestroyAPIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant]
     serializer_class = MenuDetailSerializer
     lookup_url_kwarg = 'menu_id'
 
     def get_queryset(self):
-        restaurant = self.request.user.merchant.restaurant
+        restaurant = self.get_restaurant()
         return Menu.objects.filter(restaurant=restaurant)
     
     def post(self, request, *args, **kwargs):
-        user_restaurant = self.request.user.merchant.restaurant
+        user_restaurant = self.get_restaurant()
         request_restaurant = Restaurant.objects.get(id=request.data['restaurant'])
         if user_restaurant != request_restaurant:
             return Response(code=404)
         return super().post(request, *args, **kwargs)
 
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except ProtectedError:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'Cannot delete a menu with ordered items'})
+
 
-class MenuItemsListCreate(generics.ListCreateAPIView):
+class MenuItemsListCreate(PrefetchPlanMixin, generics.ListCreateAPIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant]
 
     def get_queryset(self):
-        restaurant = self.request.user.merchant.restaurant
+        restaurant = self.get_restaurant()
         menu = self.kwargs['menu_id']
         return MenuItem.objects.filter(menu_category__menu_id=menu, 
                                        menu_category__menu__restaurant=restaurant)
@@ -68,24 +77,24 @@ class MenuItemsListCreate(generics.ListCreateAPIView):
             return MenuItemDetailSerializer
 
 
-class MenuItemDetail(generics.RetrieveUpdateDestroyAPIView):
+class MenuItemDetail(PrefetchPlanMixin, generics.RetrieveUpdateDestroyAPIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant]
     serializer_class = MenuItemDetailSerializer
     lookup_url_kwarg = 'item_id'
 
     def get_queryset(self):
-        restaurant = self.request.user.merchant.restaurant
+        restaurant = self.get_restaurant()
         menu = self.kwargs['menu_id']
         return MenuItem.objects.filter(menu_category__menu_id=menu, 
                                        menu_category__menu__restaurant=restaurant)
 
 
-class MenuHoursListCreate(generics.ListCreateAPIView):
+class MenuHoursListCreate(generics.ListCreateAPIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant]
     serializer_class = MenuHoursSerializer
 
     def get_queryset(self):
-        restaurant = self.request.user.merchant.restaurant
+        restaurant = self.get_restaurant()
         return MenuHours.objects.filter(menu__restaurant=restaurant)
     
     def create(self, request, *args, **kwargs):
@@ -105,27 +114,29 @@ class MenuHoursListCreate(generics.ListCreateAPIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
  
-class OrderList(generics.ListAPIView):
+class OrderList(generics.ListAPIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant]
     serializer_class = OrderListSerializer
 
     def get_queryset(self):
-        # TODO: Query param open=true -> Filter by unfulfilled orders
-        restaurant = self.request.user.merchant.restaurant
-        return Order.objects.filter(restaurant=restaurant)
+        restaurant = self.get_restaurant()
+        orders = Order.objects.filter(restaurant=restaurant).with_type()
+        if self.request.query_params.get('open') == 'true':
+            orders = orders.open()
+        return orders
 
 
-class OrderDetail(generics.RetrieveAPIView):
+class OrderDetail(PrefetchPlanMixin, generics.RetrieveAPIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant]
     serializer_class = OrderDetailSerializer
     lookup_url_kwarg = 'order_id'
 
     def get_queryset(self):
-        restaurant = self.request.user.merchant.restaurant
-        return Order.objects.filter(restaurant=restaurant) 
+        restaurant = self.get_restaurant()
+        return Order.objects.filter(restaurant=restaurant).with_type()
 
 
-class Status(views.APIView):
+class Status(views.APIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant]
     serializer_class = StatusSerializer
 
@@ -135,7 +146,7 @@ class Status(views.APIView):
         }
 
     def get(self, request, *args, **kwargs):
-        restaurant = Restaurant.objects.get(id=self.kwargs['restaurant_id'])
+        restaurant = self.get_restaurant()
         current_datetime = timezone.now()
         
         if not restaurant.is_open_according_to_regular_menu_hours:
@@ -183,7 +194,7 @@ class Status(views.APIView):
 
         elif serializer.validated_data['status'] == StatusSerializer.ONLINE:
             try:
-                restaurant = Restaurant.objects.get(id=self.kwargs['restaurant_id'])
+                restaurant = self.get_restaurant()
                 current_pause_hours = PauseHours.objects.get(
                     start_datetime__lte=timezone.now(), 
                     end_datetime__gt=timezone.now(), 
@@ -224,15 +235,12 @@ class HolidayDetail(generics.RetrieveUpdateDestroyAPIView):
                                       end_datetime__gte=timezone.now())
 
 
-class OrderFinishCooking(views.APIView):
+class OrderFinishCooking(views.APIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant, OrderIsForRestaurant]
     
     def post(self, request, *args, **kwargs):
-        # Order must exist, because OrderIsForRestaurant
-        order = Order.objects.get(
-            id=self.kwargs['order_id'], 
-            restaurant=self.request.user.merchant.restaurant
-        )
+        # Loaded by OrderIsForRestaurant
+        order = self.get_order()
         try:
             order.finish_cooking()
         except ValidationError as e:
@@ -240,7 +248,7 @@ class OrderFinishCooking(views.APIView):
         return Response(status=status.HTTP_200_OK)
         
 
-class OrderCancel(views.APIView):
+class OrderCancel(views.APIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant, OrderIsForRestaurant]
     serializer_class = OrderCancelSerializer
 
@@ -248,11 +256,8 @@ class OrderCancel(views.APIView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # Order must exist, because OrderIsForRestaurant
-        order = Order.objects.get(
-            id=self.kwargs['order_id'], 
-            restaurant=self.request.user.merchant.restaurant
-        )
+        # Loaded by OrderIsForRestaurant
+        order = self.get_order()
         try:
             order.cancel(reason=serializer.validated_data['reason'])
         except ValidationError as e:
@@ -260,7 +265,7 @@ class OrderCancel(views.APIView):
         return Response(status=status.HTTP_200_OK)
 
 
-class OrderDelay(views.APIView):
+class OrderDelay(views.APIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant, OrderIsForRestaurant]
     serializer_class = OrderDelaySerializer
 
@@ -268,11 +273,8 @@ class OrderDelay(views.APIView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # Order must exist, because OrderIsForRestaurant
-        order = Order.objects.get(
-            id=self.kwargs['order_id'], 
-            restaurant=self.request.user.merchant.restaurant
-        )
+        # Loaded by OrderIsForRestaurant
+        order = self.get_order()
         try:
             order.delay(serializer.validated_data['delay_by'])
         except ValidationError as e:
@@ -280,7 +282,7 @@ class OrderDelay(views.APIView):
         return Response(status=status.HTTP_200_OK)
 
 
-class PriceAdjustment(generics.CreateAPIView):
+class PriceAdjustment(generics.CreateAPIView, MerchantObjectsMixin):
     permission_classes = [IsAuthenticated, IsMerchant, 
                           OrderIsForRestaurant, OrderItemIsInOrder]
     serializer_class = PriceAdjustmentSerializer
@@ -0,0 +1,244 @@
+'''
+The compact wire format of the events that `merchant.fanout` sends to WebSockets, which clients can choose
+instead of JSON by the WebSocket subprotocol.
+
+`delivery.msgpack.v1` events are sent as binary msgpack frames of `[frame type, payload]`:
+- `DICTIONARY`: `[[kind, id, name], ...]`, the names of the menu items, option groups and options in the frames
+  that follow, each sent once per connection, and again if it is renamed. The events refer to them by id, and
+  don't include their names.
+- `ORDER_ACTIVITY`: the orders of an `order_activity` event, as maps of the integer tags below.
+- `NEARBY_DELIVERIES`: the deliveries of a `nearby_deliveries` event, as maps of the integer tags below.
+
+Keys without a tag are sent as strings. Statuses and order types are sent as the integer codes below. Decimals
+are sent as the extension type `DECIMAL_EXT`, of the msgpack array `[unscaled integer, exponent]`, and datetimes
+as the msgpack timestamp extension type.
+
+The tags and codes of a version are never reassigned; new ones may be added. Replies to actions are sent as JSON
+text frames whatever the subprotocol.
+'''
+from datetime import datetime
+from decimal import Decimal
+
+import msgpack
+from django.utils.dateparse import parse_datetime
+
+from merchant.models import Order
+
+
+JSON = 'delivery.json'
+MSGPACK_V1 = 'delivery.msgpack.v1'
+# In order of preference
+SUBPROTOCOLS = [MSGPACK_V1, JSON]
+
+# Frame types
+DICTIONARY = 0
+ORDER_ACTIVITY = 1
+NEARBY_DELIVERIES = 2
+
+# Name kinds
+MENU_ITEM = 0
+OPTION_GROUP = 1
+OPTION = 2
+
+DECIMAL_EXT = 1
+
+ORDER_TAGS = {
+    'id': 0,
+    'restaurant': 1,
+    'type': 2,
+    'items': 3,
+    'created': 4,
+    'status': 5,
+    'price': 6,
+    'estimated_completion_datetime': 7,
+    'delay_count': 8,
+    'rider_session': 9,
+    'rider_pickup_datetime': 10,
+    'cancellation_reason': 11,
+    'deleted': 12,
+}
+ITEM_TAGS = {
+    'id': 0,
+    'instance_id': 1,
+    'price': 2,
+    'quantity': 3,
+    'option_groups': 4,
+    'price_adjustment': 5,
+}
+OPTION_GROUP_TAGS = {'id': 0, 'options': 1}
+OPTION_TAGS = {'id': 0}
+PRICE_ADJUSTMENT_TAGS = {'adjustment': 0, 'reason': 1}
+DELIVERY_TAGS = {
+    'id': 0,
+    'open': 1,
+    'restaurant': 2,
+    'latitude': 3,
+    'longitude': 4,
+    'estimated_payout': 5,
+}
+
+STATUS_CODES = {
+    Order.IN_KITCHEN: 0,
+    Order.READY_TO_PICKUP_AT_RESTAURANT: 1,
+    Order.SEARCHING_FOR_RIDER: 2,
+    Order.DELIVERY_IN_TRANSIT: 3,
+    Order.CANCELLED: 4,
+    Order.COMPLETED: 5,
+}
+TYPE_CODES = {Order.DELIVERY: 0, Order.SELF_PICKUP: 1}
+
+# Keys whose values the events send as strings or floats
+DECIMAL_KEYS = {'price', 'adjustment', 'estimated_payout'}
+DATETIME_KEYS = {'created', 'estimated_completion_datetime', 'rider_pickup_datetime'}
+
+
+def select_subprotocol(subprotocols):
+    '''
+    Returns the preferred of the subprotocols that the client offered, or None to use JSON without a subprotocol
+    '''
+    return next((subprotocol for subprotocol in SUBPROTOCOLS if subprotocol in subprotocols), None)
+
+
+def encode_default(value):
+    if isinstance(value, Decimal):
+        sign, digits, exponent = value.as_tuple()
+        unscaled = int(''.join(map(str, digits))) * (-1 if sign else 1)
+        return msgpack.ExtType(DECIMAL_EXT, msgpack.packb([unscaled, exponent]))
+    raise TypeError(f'Cannot encode {type(value).__name__}')
+
+
+def packb(value):
+    # Aware datetimes are packed as timestamps
+    return msgpack.packb(value, default=encode_default, datetime=True)
+
+
+def to_wire_value(key, value):
+    if isinstance(value, str):
+        if key in DECIMAL_KEYS:
+            return Decimal(value)
+        if key in DATETIME_KEYS:
+            # `OrderDetailSerializer` sends a missing datetime as 'None', which isn't parsed
+            return parse_datetime(value)
+        if key == 'status':
+            return STATUS_CODES.get(value, value)
+        if key == 'type':
+            return TYPE_CODES.get(value, value)
+    elif isinstance(value, float) and key in DECIMAL_KEYS:
+        # Prices of items, which `OrderItemListSerializer` sends as floats
+        return Decimal(repr(value))
+    return value
+
+
+def tag(data, tags, names=None, kind=None):
+    '''
+    Returns the map of the tags of `data`, dropping its name, which is added to `names`
+    '''
+    if names is not None and 'name' in data:
+        names.append([kind, data['id'], data['name']])
+    return {
+        tags.get(key, key): to_wire_value(key, value)
+        for key, value in data.items()
+        if key != 'name' or names is None
+    }
+
+
+def tag_item(item, names):
+    tagged = tag(item, ITEM_TAGS, names, MENU_ITEM)
+    if item.get('option_groups') is not None:
+        tagged[ITEM_TAGS['option_groups']] = [
+            {
+                **tag(group, OPTION_GROUP_TAGS, names, OPTION_GROUP),
+                OPTION_GROUP_TAGS['options']: [tag(option, OPTION_TAGS, names, OPTION)
+                                               for option in group['options']],
+            }
+            for group in item['option_groups']
+        ]
+    if item.get('price_adjustment') is not None:
+        tagged[ITEM_TAGS['price_adjustment']] = tag(item['price_adjustment'], PRICE_ADJUSTMENT_TAGS)
+    return tagged
+
+
+def tag_order(order, names):
+    tagged = tag(order, ORDER_TAGS)
+    if order.get('items') is not None:
+        tagged[ORDER_TAGS['items']] = [tag_item(item, names) for item in order['items']]
+    return tagged
+
+
+def encode_orders(orders):
+    '''
+    Returns the `ORDER_ACTIVITY` frame of the order events, and the `[kind, id, name]` of the names they refer to
+    '''
+    names = []
+    frame = packb([ORDER_ACTIVITY, [tag_order(order, names) for order in orders]])
+    return frame, names
+
+
+def encode_deliveries(deliveries):
+    '''
+    Returns each of the delivery events encoded, to be joined by `join_deliveries`
+    '''
+    return [packb(tag(delivery, DELIVERY_TAGS)) for delivery in deliveries]
+
+
+def join_deliveries(encoded_deliveries):
+    '''
+    Returns the `NEARBY_DELIVERIES` frame of some of the deliveries encoded by `encode_deliveries`
+    '''
+    packer = msgpack.Packer()
+    return packer.pack_array_header(2) + packer.pack(NEARBY_DELIVERIES) \
+        + packer.pack_array_header(len(encoded_deliveries)) + b''.join(encoded_deliveries)
+
+
+def encode_dictionary(names):
+    return packb([DICTIONARY, names])
+
+
+def decode_default(code, data):
+    if code == DECIMAL_EXT:
+        unscaled, exponent = msgpack.unpackb(data)
+        return Decimal(unscaled).scaleb(exponent)
+    return msgpack.ExtType(code, data)
+
+
+def decode(frame):
+    '''
+    Decodes a frame, with tags left as integers. For tests and benchmarks.
+    '''
+    return msgpack.unpackb(frame, ext_hook=decode_default, timestamp=3, strict_map_key=False)
+
+
+class WireFormatMixin:
+    '''
+    Mixin for the consumers of `merchant.fanout` events, which accepts the connection with the subprotocol chosen
+    by `select_subprotocol`, and sends the events in its format
+    '''
+
+    async def connect(self):
+        self.subprotocol = select_subprotocol(self.scope.get('subprotocols', []))
+        # (kind, id) -> name, of the dictionary sent on this connection
+        self.sent_names = {}
+        await self.accept(self.subprotocol)
+
+    async def send_order_activity(self, event):
+        # `event` is a `merchant.fanout` batch, with the orders encoded once for all connections
+        if self.subprotocol != MSGPACK_V1:
+            await self.send_json({'type': 'order_activity', 'orders': event['orders']})
+            return
+
+        names = []
+        for kind, name_id, name in event['names']:
+            if self.sent_names.get((kind, name_id)) != name:
+                self.sent_names[(kind, name_id)] = name
+                names.append([kind, name_id, name])
+        if names:
+            await self.send(bytes_data=encode_dictionary(names))
+        await self.send(bytes_data=event['packed'])
+
+    async def send_nearby_deliveries(self, event, indexes):
+        # `indexes` of the deliveries of the `merchant.fanout` batch to send
+        if self.subprotocol != MSGPACK_V1:
+            deliveries = [event['deliveries'][index] for index in indexes]
+            await self.send_json({'type': 'nearby_deliveries', 'deliveries': deliveries})
+        else:
+            await self.send(bytes_data=join_deliveries([event['packed'][index] for index in indexes]))
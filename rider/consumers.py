@@ -0,0 +1,69 @@
+from channels.db import database_sync_to_async
+from djangochannelsrestframework.permissions import IsAuthenticated
+from djangochannelsrestframework.generics import GenericAsyncAPIConsumer
+from djangochannelsrestframework.decorators import action
+from rest_framework.exceptions import ValidationError
+from merchant.fanout import NEARBY_RADIUS, get_nearby_groups, get_session_group
+from merchant.utils import calc_distance_from_coords
+from merchant.wire import WireFormatMixin
+from rider.serializers import NearbyDeliveriesSubscribeSerializer
+
+
+class OrderConsumer(WireFormatMixin, GenericAsyncAPIConsumer):
+    '''
+    Sends the changes of the orders that the rider's current session is delivering, and the delivery orders 
+    near the rider as they start and stop searching for a rider. See `merchant.fanout`.
+    '''
+    permission_classes = [IsAuthenticated]
+
+    async def websocket_connect(self, event):
+        # Set by `delivery.authentication.TokenAuthMiddleware`, with the user's rider loaded
+        self.user = self.scope['user']
+        self.nearby_location = None
+        self.nearby_groups = []
+
+        if getattr(self.user, 'rider', None) is None:
+            # Rejects the handshake. DenyConnection is only handled when raised from `connect`.
+            await self.close()
+            return
+
+        return await super().websocket_connect(event)
+
+    @action()
+    async def subscribe_to_assigned_orders(self, request_id, **kwargs):
+        session = await database_sync_to_async(lambda: self.user.rider.current_session)()
+        if session is None:
+            raise ValidationError('No session currently active')
+        await self.add_group(get_session_group(session.id))
+
+    @action()
+    async def subscribe_to_nearby_deliveries(self, request_id, **kwargs):
+        '''
+        Subscribes to the delivery orders near the given point, replacing the previous point
+        '''
+        serializer = NearbyDeliveriesSubscribeSerializer(data=kwargs)
+        serializer.is_valid(raise_exception=True)
+        latitude, longitude = serializer.validated_data['latitude'], serializer.validated_data['longitude']
+
+        groups = get_nearby_groups(latitude, longitude)
+        for group in set(self.nearby_groups) - set(groups):
+            await self.remove_group(group)
+        for group in set(groups) - set(self.nearby_groups):
+            await self.add_group(group)
+        self.nearby_location, self.nearby_groups = (latitude, longitude), groups
+
+    async def order_batch(self, event):
+        await self.send_order_activity(event)
+
+    async def delivery_batch(self, event):
+        # The groups' geohash cells cover more than the radius
+        indexes = [index for index, delivery in enumerate(event['deliveries'])
+                   if not delivery['open'] or self.is_nearby(delivery)]
+        if indexes:
+            await self.send_nearby_deliveries(event, indexes)
+
+    def is_nearby(self, delivery):
+        if self.nearby_location is None:
+            return False
+        return calc_distance_from_coords(*self.nearby_location, delivery['latitude'], delivery['longitude']) \
+            <= NEARBY_RADIUS
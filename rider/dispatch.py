@@ -0,0 +1,95 @@
+'''
+Matches delivery orders that are searching for a rider to nearby riders. Each run proposes every unproposed
+order to the best rider in a single pass over in-memory data, with one query for the orders, one for the
+riders and a bulk update of the proposals. Riders see their proposals in `rider.views.OrderList`, and proposals that
+aren't accepted expire and are proposed again by a later run.
+'''
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from merchant.models import Delivery, Order
+from merchant.utils import GeohashIndex, calc_distance_from_coords
+from rider.feed import invalidate_open_deliveries
+from rider.models import Session
+
+
+# Riders are only proposed orders from restaurants within this many meters
+DISPATCH_RADIUS = 5000
+PROPOSAL_TTL = timedelta(seconds=60)
+# Riders that haven't reported their location for this long are not dispatched to
+LOCATION_TTL = timedelta(minutes=2)
+# Each order that a rider is delivering or has been proposed counts as this many extra meters of pickup distance
+LOAD_PENALTY = 1000
+MAX_LOAD = 3
+MAX_DELIVERIES_PER_RUN = 1000
+
+DispatchSession = namedtuple('DispatchSession', ['id', 'latitude', 'longitude', 'geohash'])
+
+
+def get_available_sessions(now):
+    '''
+    Returns the current sessions with a recent location, and the number of orders each one is delivering or
+    has been proposed
+    '''
+    in_progress = Q(deliveries__order__status__in=[
+        Order.IN_KITCHEN, Order.READY_TO_PICKUP_AT_RESTAURANT, Order.DELIVERY_IN_TRANSIT
+    ])
+    proposed = Q(proposed_deliveries__order__status=Order.SEARCHING_FOR_RIDER,
+                 proposed_deliveries__proposal_expires__gt=now)
+    rows = Session.objects.current() \
+        .filter(location_updated__gte=now - LOCATION_TTL) \
+        .annotate(num_in_progress=Count('deliveries', filter=in_progress, distinct=True),
+                  num_proposed=Count('proposed_deliveries', filter=proposed, distinct=True)) \
+        .values_list('id', 'latitude', 'longitude', 'geohash', 'num_in_progress', 'num_proposed')
+
+    sessions = []
+    loads = {}
+    for session_id, latitude, longitude, geohash, num_in_progress, num_proposed in rows:
+        sessions.append(DispatchSession(session_id, float(latitude), float(longitude), geohash))
+        loads[session_id] = num_in_progress + num_proposed
+    return sessions, loads
+
+
+def dispatch_deliveries():
+    '''
+    Proposes each delivery order that is searching for a rider, and doesn't have a live proposal, to the
+    available rider with the lowest pickup distance plus load penalty, oldest orders first. Returns the number
+    of proposals made.
+    '''
+    now = timezone.now()
+    deliveries = Delivery.objects \
+        .filter(order__status=Order.SEARCHING_FOR_RIDER, session__isnull=True) \
+        .filter(Q(proposal_expires__isnull=True) | Q(proposal_expires__lte=now)) \
+        .order_by('order__created') \
+        .values_list('id', 'order__restaurant__latitude', 'order__restaurant__longitude')[:MAX_DELIVERIES_PER_RUN]
+    deliveries = list(deliveries)
+    if not deliveries:
+        return 0
+
+    sessions, loads = get_available_sessions(now)
+    index = GeohashIndex(sessions)
+    proposals = []
+    for delivery_id, latitude, longitude in deliveries:
+        latitude, longitude = float(latitude), float(longitude)
+        best_session, best_score = None, None
+        for session in index.near(latitude, longitude, DISPATCH_RADIUS):
+            if loads[session.id] >= MAX_LOAD:
+                continue
+            distance = calc_distance_from_coords(latitude, longitude, session.latitude, session.longitude)
+            if distance > DISPATCH_RADIUS:
+                continue
+            score = distance + loads[session.id] * LOAD_PENALTY
+            if best_score is None or score < best_score:
+                best_session, best_score = session, score
+        if best_session is not None:
+            loads[best_session.id] += 1
+            proposals.append(Delivery(id=delivery_id, proposed_session_id=best_session.id,
+                                      proposal_expires=now + PROPOSAL_TTL))
+
+    Delivery.objects.bulk_update(proposals, ['proposed_session', 'proposal_expires'])
+    if proposals:
+        invalidate_open_deliveries()
+    return len(proposals)
@@ -0,0 +1,82 @@
+'''
+The delivery orders that riders can accept, listed by `rider.views.OrderList`. The set of open delivery orders
+is shared by every rider, so it is cached as a `GeohashIndex` and each request only looks up the orders near
+its rider. The set is invalidated when orders join or leave it (see `rider.signals`) and when
+`rider.dispatch` proposes orders.
+'''
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from delivery.cache import LayeredCache
+from merchant.models import Delivery, Order
+from merchant.utils import GeohashIndex, calc_distance_from_coords
+
+
+OPEN_DELIVERIES_KEY = 'all'
+
+open_deliveries_cache = LayeredCache('rider.open_deliveries', timeout=10, local_timeout=2)
+
+OpenDelivery = namedtuple('OpenDelivery', [
+    'order_id', 'latitude', 'longitude', 'geohash', 'delivery_cost', 'proposed_session_id', 'proposal_expires',
+])
+
+FeedEntry = namedtuple('FeedEntry', ['order_id', 'distance', 'estimated_payout', 'proposed'])
+
+
+def build_open_deliveries():
+    rows = Delivery.objects \
+        .filter(order__status=Order.SEARCHING_FOR_RIDER, session__isnull=True) \
+        .values_list('order_id', 'order__restaurant__latitude', 'order__restaurant__longitude',
+                     'order__restaurant__geohash', 'delivery_cost', 'proposed_session_id', 'proposal_expires')
+    open_deliveries = []
+    proposals = {}
+    for order_id, latitude, longitude, geohash, delivery_cost, proposed_session_id, proposal_expires in rows:
+        delivery = OpenDelivery(order_id, float(latitude), float(longitude), geohash, delivery_cost,
+                                proposed_session_id, proposal_expires)
+        open_deliveries.append(delivery)
+        if proposed_session_id is not None:
+            proposals.setdefault(proposed_session_id, []).append(delivery)
+    return GeohashIndex(open_deliveries), proposals
+
+
+def get_open_deliveries():
+    '''
+    Returns a `GeohashIndex` of the delivery orders that are searching for a rider, located at their
+    restaurants, and a dict of session id -> the orders proposed to the session, including expired proposals
+    '''
+    return open_deliveries_cache.get_or_build(OPEN_DELIVERIES_KEY, build_open_deliveries)
+
+
+def invalidate_open_deliveries():
+    # After commit, so that the set cannot be rebuilt from the old rows in the meantime
+    transaction.on_commit(lambda: open_deliveries_cache.invalidate(OPEN_DELIVERIES_KEY))
+
+
+def get_feed(session, latitude, longitude, radius):
+    '''
+    Returns the open delivery orders that the rider in `session` at the given point can accept: the orders that
+    `rider.dispatch` proposes to the rider, then the orders from restaurants within `radius` meters that aren't
+    proposed to another rider, each group nearest restaurant first. The estimated payout is the delivery cost.
+    '''
+    now = timezone.now()
+    index, proposals = get_open_deliveries()
+
+    proposed = []
+    for delivery in proposals.get(session.id, ()):
+        if delivery.proposal_expires > now:
+            distance = calc_distance_from_coords(latitude, longitude, delivery.latitude, delivery.longitude)
+            proposed.append(FeedEntry(delivery.order_id, round(distance), delivery.delivery_cost, True))
+
+    nearby = []
+    for delivery in index.near(latitude, longitude, radius):
+        if delivery.proposed_session_id is not None and delivery.proposal_expires > now:
+            continue
+        distance = calc_distance_from_coords(latitude, longitude, delivery.latitude, delivery.longitude)
+        if distance <= radius:
+            nearby.append(FeedEntry(delivery.order_id, round(distance), delivery.delivery_cost, False))
+
+    proposed.sort(key=lambda entry: entry.distance)
+    nearby.sort(key=lambda entry: entry.distance)
+    return proposed + nearby
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rider.dispatch import dispatch_deliveries
+
+
+class Command(BaseCommand):
+    help = 'Proposes delivery orders that are searching for a rider to nearby riders, once or every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Seconds between runs. Runs once if 0.')
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            num_proposals = dispatch_deliveries()
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'Proposed {num_proposals} orders in {elapsed * 1000:.1f} ms')
+            if not options['interval']:
+                break
+            time.sleep(max(options['interval'] - elapsed, 0))
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.10 on 2026-10-18 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rider', '0005_remove_session_cancelled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='latitude',
+            field=models.DecimalField(blank=True, decimal_places=7, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='location_updated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='longitude',
+            field=models.DecimalField(blank=True, decimal_places=7, max_digits=10, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-18 04:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rider', '0006_session_location'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['rider', 'start_datetime', 'end_datetime'], name='rider_sessi_rider_i_ae78d4_idx'),
+        ),
+    ]
@@ -1,6 +1,11 @@
+from delivery.request_cache import memoize
 
 
-from functools import cache
+def get_current_session(request):
+    '''
+    Returns the rider's current session, looking it up once per request, so that permissions and views share it
+    '''
+    return memoize(request, 'current_session', lambda: request.user.rider.current_session)
 
 
 class CurrentSessionMixin:
@@ -8,6 +13,5 @@ class CurrentSessionMixin:
     Provides the `get_current_session` method
     '''
 
-    @cache
     def get_current_session(self):
-        return self.request.user.rider.current_session
+        return get_current_session(self.request)
@@ -1,7 +1,38 @@
+from copy import copy
+
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
+from delivery.cache import LayeredCache
+from merchant.utils import encode_geohash
+
+
+# Rider id -> the rider's current session, or None
+current_session_cache = LayeredCache('rider.current_session', timeout=60, local_timeout=5)
+
+
+def invalidate_current_session(rider_id):
+    # After commit, so that the session cannot be looked up from the old rows in the meantime
+    transaction.on_commit(lambda: current_session_cache.invalidate(rider_id))
+
+
+def update_cached_location(session):
+    '''
+    Copies the location of the session to the rider's entry in `current_session_cache`, if that is the session,
+    rather than invalidating the entry on every location report
+    '''
+    def update():
+        cached = current_session_cache.get(session.rider_id)
+        if cached is not None and cached.id == session.id:
+            # The cached session is shared with other requests in the local cache
+            cached = copy(cached)
+            for field in Session.LOCATION_FIELDS:
+                setattr(cached, field, getattr(session, field))
+            current_session_cache.set(session.rider_id, cached)
+    transaction.on_commit(update)
+
+
 class Rider(models.Model):
     user = models.OneToOneField("delivery.User", on_delete=models.CASCADE)
 
@@ -10,17 +41,66 @@ class Rider(models.Model):
     
     @property
     def current_session(self):
+        '''
+        Cached in `current_session_cache`, which `rider.signals` invalidates when the rider's sessions change. 
+        Views should call `rider.mixins.get_current_session`, which also memoizes it for the request.
+        '''
+        session = current_session_cache.get_or_build(self.id, self.find_current_session)
+        if session is not None and not session.is_current:
+            # The cached session has ended since
+            session = self.find_current_session()
+            current_session_cache.set(self.id, session)
+        # Callers may modify the session, which is shared with other requests in the local cache
+        return copy(session)
+
+    def find_current_session(self):
         try:
-            return Session.objects.get(rider=self, start_datetime__lte=timezone.now(),
-                                       end_datetime__gt=timezone.now())
+            return Session.objects.current().get(rider=self)
         except Session.DoesNotExist:
             return None
 
+
+class SessionQuerySet(models.QuerySet):
+
+    def current(self):
+        now = timezone.now()
+        return self.filter(start_datetime__lte=now, end_datetime__gt=now)
+
+
 class Session(models.Model):
     rider = models.ForeignKey("Rider", on_delete=models.CASCADE)
     start_datetime = models.DateTimeField(default=timezone.now)
     end_datetime = models.DateTimeField()
 
+    # The rider's last known position, reported with `update_location`. See `rider.dispatch`.
+    latitude = models.DecimalField(decimal_places=7, max_digits=9, blank=True, null=True)
+    longitude = models.DecimalField(decimal_places=7, max_digits=10, blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, null=True, editable=False)
+    location_updated = models.DateTimeField(blank=True, null=True)
+    LOCATION_FIELDS = ['latitude', 'longitude', 'geohash', 'location_updated']
+
+    objects = SessionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # For `SessionQuerySet.current` by rider
+            models.Index(fields=['rider', 'start_datetime', 'end_datetime']),
+        ]
+
     def __str__(self):
         return f'Session by {str(self.rider)}: {str(self.start_datetime)} - {str(self.end_datetime)}' 
 
+    @property
+    def is_current(self):
+        return self.start_datetime <= timezone.now() < self.end_datetime
+
+    def update_location(self, latitude, longitude):
+        '''
+        Riders report their position every few seconds, so this is a single UPDATE
+        '''
+        self.latitude = latitude
+        self.longitude = longitude
+        self.geohash = encode_geohash(float(latitude), float(longitude))
+        self.location_updated = timezone.now()
+        Session.objects.filter(id=self.id).update(**{field: getattr(self, field) for field in Session.LOCATION_FIELDS})
+        update_cached_location(self)
@@ -2,6 +2,7 @@ from rest_framework import permissions
 from django.core.exceptions import ObjectDoesNotExist
 
 from merchant.models import Order
+from rider.mixins import get_current_session
 from rider.models import Session
 
 
@@ -23,7 +24,7 @@ class IsDeliveringThisOrder(permissions.BasePermission):
     def has_permission(self, request, view):
         try: 
             order = Order.objects.get(id=view.kwargs.get('order_id'))
-            return request.user.rider.current_session == order.delivery.session
+            return get_current_session(request) == order.delivery.session
         except ObjectDoesNotExist:
             return False
 
@@ -0,0 +1,11 @@
+from django.urls import re_path
+
+from rider.consumers import OrderConsumer
+
+websocket_urlpatterns = [
+    re_path(
+        r'rider/orders/', 
+        OrderConsumer.as_asgi(), 
+        name='order_list_ws'
+    ),
+]
@@ -38,6 +38,7 @@ class SessionCreateSerializer(serializers.ModelSerializer):
     
     def validate(self, attrs):
         overlapping_sessions = Session.objects.filter(
+            rider=self.context.get('request').user.rider,
             start_datetime__lt=attrs['end_datetime'], 
             end_datetime__gt=timezone.now()
         )
@@ -65,6 +66,17 @@ class SessionExtendSerializer(serializers.ModelSerializer):
         return value
 
 
+class SessionLocationSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Session
+        fields = ['latitude', 'longitude']
+        extra_kwargs = {
+            'latitude': {'required': True, 'allow_null': False, 'min_value': -90, 'max_value': 90},
+            'longitude': {'required': True, 'allow_null': False, 'min_value': -180, 'max_value': 180},
+        }
+
+
 class OrderListSerializer(serializers.ModelSerializer):
     
     class Meta:
@@ -77,13 +89,51 @@ class OrderListSerializer(serializers.ModelSerializer):
         }
 
 
+class OrderFeedQuerySerializer(serializers.Serializer):
+    '''
+    Query parameters of the order feed. The rider's position defaults to the session's last reported location.
+    '''
+    latitude = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    longitude = serializers.FloatField(min_value=-180, max_value=180, required=False)
+    radius = serializers.FloatField(min_value=1, max_value=50000, default=5000)  # meters
+
+    def validate(self, data):
+        if ('latitude' in data) != ('longitude' in data):
+            raise ValidationError('Latitude and longitude must be given together')
+        return data
+
+
+class NearbyDeliveriesSubscribeSerializer(serializers.Serializer):
+    '''
+    Arguments of `rider.consumers.OrderConsumer.subscribe_to_nearby_deliveries`
+    '''
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+
+
+class OrderFeedSerializer(OrderListSerializer):
+    '''
+    Reads `distance` (meters from the rider to the restaurant), `estimated_payout` and `proposed` from 
+    attributes that `rider.views.OrderList` sets from the feed
+    '''
+    distance = serializers.IntegerField(read_only=True)
+    estimated_payout = serializers.FloatField(read_only=True)
+    proposed = serializers.BooleanField(read_only=True)
+
+    class Meta(OrderListSerializer.Meta):
+        fields = OrderListSerializer.Meta.fields + ['restaurant', 'distance', 'estimated_payout', 'proposed']
+
+
 class OrderDetailSerializer(serializers.ModelSerializer):
     items = OrderItemListSerializer(many=True)
+    price = serializers.FloatField(read_only=True)
     estimated_completion_datetime = serializers.SerializerMethodField(method_name='get_estimated_completion_datetime')
 
     class Meta:
         model = Order
         fields = ['id', 'restaurant', 'items', 'created', 'status', 'price', 'estimated_completion_datetime']
+        # Used by `get_estimated_completion_datetime`
+        select_related = ['delivery']
     
     def get_estimated_completion_datetime(self, obj):
         return obj.delivery.estimated_delivery_datetime
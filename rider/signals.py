@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from merchant.models import Delivery, Order
+from rider.feed import invalidate_open_deliveries
+from rider.models import Session, invalidate_current_session
+
+
+@receiver(post_save, sender=Delivery)
+def invalidate_open_deliveries_for_delivery(sender, instance, created, **kwargs):
+    # New delivery orders join the open set
+    if created:
+        invalidate_open_deliveries()
+
+
+@receiver(post_save, sender=Order)
+def invalidate_open_deliveries_for_order(sender, instance, update_fields, **kwargs):
+    # Accepted and cancelled orders leave the open set
+    if update_fields is None or 'status' in update_fields:
+        invalidate_open_deliveries()
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+def invalidate_current_session_for_session(sender, instance, **kwargs):
+    invalidate_current_session(instance.rider_id)
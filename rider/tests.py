@@ -1,3 +1,318 @@
-from django.test import TestCase
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Barrier
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from delivery.testing import clear_caches, create_client, create_order, create_restaurant, create_session, \
+    create_user
+from merchant.models import Delivery, Order
+from rider.dispatch import LOCATION_TTL, MAX_LOAD, PROPOSAL_TTL, dispatch_deliveries
+from rider.feed import get_open_deliveries
+from rider.models import Rider, Session
+
+
+class PrefetchPlanTests(TestCase):
+    '''
+    Endpoints with nested serializers take the same number of queries regardless of the payload size
+    '''
+    def test_order_detail(self):
+        client = create_client()
+        session = create_session()
+        restaurant = create_restaurant(num_items=10, num_option_groups=3, num_options=3)
+        api = APIClient()
+        api.force_authenticate(session.rider.user)
+        for num_items in (1, 10):
+            order = create_order(restaurant, client, num_items=num_items)
+            order.delivery.accept(session)
+            clear_caches()
+            with self.assertNumQueries(8):
+                response = api.get(f'/rider/orders/{order.id}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['items']), num_items)
+
+
+class SessionCreateTests(TestCase):
+    '''
+    Riders start sessions that don't overlap their own sessions
+    '''
+    def post(self, rider):
+        api = APIClient()
+        api.force_authenticate(rider.user)
+        return api.post('/rider/sessions/', {'end_datetime': (timezone.now() + timedelta(hours=4)).isoformat()})
+
+    def test_overlapping_session(self):
+        session = create_session()
+        self.assertEqual(self.post(session.rider).status_code, 400)
+
+    def test_session_of_another_rider(self):
+        create_session()
+        rider = Rider.objects.create(user=create_user())
+        self.assertEqual(self.post(rider).status_code, 201)
+        self.assertEqual(rider.session_set.count(), 1)
+
+
+class CurrentSessionCacheTests(TestCase):
+
+    def test_location_updates_the_cached_session(self):
+        clear_caches()
+        rider = create_session().rider
+        session = rider.current_session
+        with self.captureOnCommitCallbacks(execute=True):
+            session.update_location(1.3, 103.8)
+        with self.assertNumQueries(0):
+            cached_session = rider.current_session
+        self.assertEqual(cached_session.id, session.id)
+        self.assertEqual((cached_session.latitude, cached_session.longitude), (1.3, 103.8))
+        self.assertIsNotNone(cached_session.location_updated)
+
+
+class StaleOrderAcceptTests(TestCase):
+    '''
+    Writes on an order loaded before a rider accepted it don't undo the accept
+    '''
+    def setUp(self):
+        self.order = create_order(create_restaurant(), create_client())
+        self.session = create_session()
+        Order.objects.get(id=self.order.id).delivery.accept(self.session)
+
+    def test_finish_cooking(self):
+        self.order.finish_cooking()
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.READY_TO_PICKUP_AT_RESTAURANT)
+        self.assertEqual(self.order.delivery.session, self.session)
+        self.order.delivery.pick_up()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.DELIVERY_IN_TRANSIT)
+
+    def test_delay(self):
+        self.order.delay(timedelta(minutes=10))
+
+        self.order.refresh_from_db()
+        self.order.delivery.refresh_from_db()
+        self.assertEqual(self.order.status, Order.IN_KITCHEN)
+        self.assertEqual(self.order.delivery.session, self.session)
+
+
+class OrderFeedTests(TestCase):
+    '''
+    The order feed lists open delivery orders near the rider, nearest first, and the orders proposed to the rider
+    '''
+    def setUp(self):
+        clear_caches()
+        self.client_ = create_client()
+        self.session = create_session()
+        # About 110m, 1.1km and 11km east of the rider
+        self.near, self.far, self.out_of_range = (
+            create_order(create_restaurant(longitude=longitude), self.client_)
+            for longitude in ('103.801', '103.81', '103.9')
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(self.session.rider.user)
+
+    def get(self, **params):
+        return self.api.get('/rider/orders/', {'latitude': 1.3, 'longitude': 103.8, **params})
+
+    def order_ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [order['id'] for order in response.data['results']]
+
+    def propose(self, order, session, expires_in):
+        Delivery.objects.filter(order=order).update(proposed_session=session,
+                                                    proposal_expires=timezone.now() + expires_in)
+        clear_caches()
+
+    def test_nearest_first_within_radius(self):
+        response = self.get()
+        self.assertEqual(self.order_ids(response), [self.near.id, self.far.id])
+        self.assertEqual([order['distance'] for order in response.data['results']], [111, 1112])
+        self.assertEqual(self.order_ids(self.get(radius=500)), [self.near.id])
+        self.assertEqual(self.order_ids(self.get(radius=20000)), [self.near.id, self.far.id, self.out_of_range.id])
+
+    def test_session_location(self):
+        self.session.update_location(1.3, 103.9)
+        response = self.api.get('/rider/orders/')
+        self.assertEqual(self.order_ids(response), [self.out_of_range.id])
+
+    def test_no_location(self):
+        self.assertEqual(self.api.get('/rider/orders/').status_code, 400)
+        self.assertEqual(self.api.get('/rider/orders/', {'latitude': 1.3}).status_code, 400)
+
+    def test_proposals(self):
+        self.propose(self.far, create_session(), timedelta(minutes=1))
+        self.propose(self.out_of_range, self.session, timedelta(minutes=1))
+        response = self.get()
+        self.assertEqual(self.order_ids(response), [self.out_of_range.id, self.near.id])
+        self.assertEqual([order['proposed'] for order in response.data['results']], [True, False])
+
+    def test_expired_proposals(self):
+        self.propose(self.far, create_session(), -timedelta(seconds=1))
+        self.propose(self.out_of_range, self.session, -timedelta(seconds=1))
+        response = self.get()
+        self.assertEqual(self.order_ids(response), [self.near.id, self.far.id])
+        self.assertEqual([order['proposed'] for order in response.data['results']], [False, False])
+
+    def test_orders_accepted_after_the_feed_is_cached(self):
+        self.assertEqual(self.order_ids(self.get()), [self.near.id, self.far.id])
+        # The cache is invalidated on commit, which doesn't happen in this test
+        self.near.delivery.accept(create_session())
+        index, _ = get_open_deliveries()
+        self.assertIn(self.near.id, [delivery.order_id for delivery in index.near(1.3, 103.8, 5000)])
+        self.assertEqual(self.order_ids(self.get()), [self.far.id])
+
+    def test_pagination(self):
+        response = self.get(radius=20000, limit=1, offset=1)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(self.order_ids(response), [self.far.id])
+        response = self.get(radius=20000, limit=2, offset=2)
+        self.assertEqual(self.order_ids(response), [self.out_of_range.id])
+        self.assertIsNone(response.data['next'])
+
+
+class DispatchTests(TestCase):
+    '''
+    `rider.dispatch` proposes each open delivery order to the available rider with the lowest pickup distance plus
+    load penalty
+    '''
+    def setUp(self):
+        self.client_ = create_client()
+        self.restaurant = create_restaurant()
+
+    def create_session(self, longitude):
+        session = create_session()
+        session.update_location(1.3, longitude)
+        return session
+
+    def deliver(self, session, num_orders):
+        for _ in range(num_orders):
+            create_order(self.restaurant, self.client_).delivery.accept(session)
+
+    def proposed_session_id(self, order):
+        order.delivery.refresh_from_db()
+        return order.delivery.proposed_session_id
+
+    def test_nearest_rider(self):
+        order = create_order(self.restaurant, self.client_)
+        self.create_session('103.81')
+        near = self.create_session('103.801')
+        # Outside the dispatch radius
+        self.create_session('103.9')
+        self.assertEqual(dispatch_deliveries(), 1)
+        self.assertEqual(self.proposed_session_id(order), near.id)
+        self.assertAlmostEqual(order.delivery.proposal_expires, timezone.now() + PROPOSAL_TTL,
+                               delta=timedelta(seconds=5))
+
+    def test_no_rider_in_range(self):
+        order = create_order(self.restaurant, self.client_)
+        self.create_session('103.9')
+        self.assertEqual(dispatch_deliveries(), 0)
+        self.assertIsNone(self.proposed_session_id(order))
+
+    def test_load_penalty(self):
+        # About 111m away and delivering an order, so 111m + LOAD_PENALTY
+        loaded = self.create_session('103.801')
+        self.deliver(loaded, 1)
+        order = create_order(self.restaurant, self.client_)
+        # About 556m away
+        idle = self.create_session('103.805')
+        self.assertEqual(dispatch_deliveries(), 1)
+        self.assertEqual(self.proposed_session_id(order), idle.id)
+
+        # About 1668m away, which is more than the penalty
+        Delivery.objects.filter(order=order).update(proposed_session=None, proposal_expires=None)
+        idle.update_location(1.3, 103.815)
+        self.assertEqual(dispatch_deliveries(), 1)
+        self.assertEqual(self.proposed_session_id(order), loaded.id)
+
+    def test_max_load(self):
+        loaded = self.create_session('103.8')
+        self.deliver(loaded, MAX_LOAD)
+        order = create_order(self.restaurant, self.client_)
+        self.assertEqual(dispatch_deliveries(), 0)
+        self.assertIsNone(self.proposed_session_id(order))
+
+    def test_max_load_within_a_run(self):
+        session = self.create_session('103.8')
+        orders = [create_order(self.restaurant, self.client_) for _ in range(MAX_LOAD + 1)]
+        self.assertEqual(dispatch_deliveries(), MAX_LOAD)
+        # Oldest orders first
+        self.assertEqual([self.proposed_session_id(order) for order in orders], [session.id] * MAX_LOAD + [None])
+
+    def test_location_ttl(self):
+        session = self.create_session('103.8')
+        order = create_order(self.restaurant, self.client_)
+        Session.objects.filter(id=session.id) \
+            .update(location_updated=timezone.now() - LOCATION_TTL - timedelta(seconds=1))
+        self.assertEqual(dispatch_deliveries(), 0)
+        Session.objects.filter(id=session.id).update(location_updated=timezone.now() - LOCATION_TTL / 2)
+        self.assertEqual(dispatch_deliveries(), 1)
+        self.assertEqual(self.proposed_session_id(order), session.id)
+
+    def test_proposal_ttl(self):
+        first = self.create_session('103.801')
+        order = create_order(self.restaurant, self.client_)
+        self.assertEqual(dispatch_deliveries(), 1)
+        second = self.create_session('103.8')
+        # Live proposals are left alone
+        self.assertEqual(dispatch_deliveries(), 0)
+        self.assertEqual(self.proposed_session_id(order), first.id)
+
+        Delivery.objects.filter(order=order).update(proposal_expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(dispatch_deliveries(), 1)
+        self.assertEqual(self.proposed_session_id(order), second.id)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'delivery.layers.BoundedInMemoryChannelLayer'}})
+class OrderAcceptRaceTests(TransactionTestCase):
+    '''
+    When many riders accept the same order at once, exactly one of them gets it
+    '''
+    num_riders = 200
+
+    def setUp(self):
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        self.addCleanup(logging.getLogger('django.request').setLevel, logging.NOTSET)
+
+    def accept_concurrently(self, order, sessions):
+        barrier = Barrier(len(sessions))
+
+        def accept(session):
+            api = APIClient(raise_request_exception=False)
+            api.force_authenticate(session.rider.user)
+            try:
+                barrier.wait()
+                return api.post(f'/rider/orders/{order.id}/accept/').status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+            return Counter(executor.map(accept, sessions))
+
+    def test_exactly_one_rider_accepts(self):
+        order = create_order(create_restaurant(), create_client())
+        sessions = [create_session() for _ in range(self.num_riders)]
+
+        status_codes = self.accept_concurrently(order, sessions)
+
+        self.assertEqual(status_codes, {200: 1, 409: self.num_riders - 1})
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.IN_KITCHEN)
+        self.assertIn(order.delivery.session, sessions)
+        self.assertEqual(Order.objects.filter(delivery__session__isnull=False).count(), 1)
+
+    def test_cancelled_order_is_not_accepted(self):
+        order = create_order(create_restaurant(), create_client())
+        order.cancel(reason='Reason')
+        sessions = [create_session() for _ in range(10)]
+
+        status_codes = self.accept_concurrently(order, sessions)
+
+        self.assertEqual(status_codes, {400: 10})
+        order.delivery.refresh_from_db()
+        self.assertIsNone(order.delivery.session)
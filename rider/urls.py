@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.urls import include, path
 
 from rider.views import OrderAccept, OrderCancel, OrderComplete, OrderDetail, OrderList, \
-    OrderPickup, CurrentSessionEnd, CurrentSessionExtend, RiderRegister, SessionListCreate, SessionOrderList, CurrentSessionOrderList
+    OrderPickup, CurrentSessionEnd, CurrentSessionExtend, CurrentSessionLocation, RiderRegister, SessionListCreate, SessionOrderList, CurrentSessionOrderList
 
 
 app_name = 'Rider'
@@ -13,6 +13,7 @@ urlpatterns = [
     path('sessions/', SessionListCreate.as_view(), name='sessions'),
     path('sessions/current/end/', CurrentSessionEnd.as_view(), name='current_session_end'),
     path('sessions/current/extend/', CurrentSessionExtend.as_view(), name='current_session_extend'),
+    path('sessions/current/location/', CurrentSessionLocation.as_view(), name='current_session_location'),
     path('sessions/current/orders/', CurrentSessionOrderList.as_view(), name='current_session_orders_list'),
     path('sessions/<session_id>/orders/', SessionOrderList.as_view(), name='session_orders_list'),
     path('orders/', OrderList.as_view(), name='orders'),
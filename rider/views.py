@@ -4,18 +4,22 @@ from django.utils import timezone
 from datetime import timedelta
 from rest_framework import views
 from rest_framework import generics
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from delivery.mixins import PrefetchPlanMixin
 from delivery.views import BaseRegister
 
-from merchant.models import Order
+from merchant.models import Delivery, Order
 from merchant.serializers import OrderCancelSerializer
+from rider.feed import get_feed
 from rider.mixins import CurrentSessionMixin
 from rider.models import Session
 from rider.permissions import IsDeliveringThisOrder, IsRider, RiderOwnsSession
-from rider.serializers import OrderDetailSerializer, OrderListSerializer, RiderRegisterSerializer, \
-    SessionCreateSerializer, SessionExtendSerializer, SessionListSerializer
+from rider.serializers import OrderDetailSerializer, OrderFeedQuerySerializer, OrderFeedSerializer, \
+    OrderListSerializer, RiderRegisterSerializer, SessionCreateSerializer, SessionExtendSerializer, \
+    SessionListSerializer, SessionLocationSerializer
 
     
 class RiderRegister(BaseRegister):
@@ -65,6 +69,25 @@ class CurrentSessionExtend(views.APIView, CurrentSessionMixin):
         return Response(status=status.HTTP_200_OK)
 
 
+class CurrentSessionLocation(views.APIView, CurrentSessionMixin):
+    '''
+    Reports the rider's position, which `rider.dispatch` proposes orders by
+    '''
+    permission_classes = [IsAuthenticated, IsRider]
+    serializer_class = SessionLocationSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        session = self.get_current_session()
+        if session is None:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'No session currently active'})
+
+        session.update_location(**serializer.validated_data)
+        return Response(status=status.HTTP_200_OK)
+
+
 class CurrentSessionOrderList(generics.ListAPIView, CurrentSessionMixin):
     permission_classes = [IsAuthenticated, IsRider]
     serializer_class = OrderListSerializer
@@ -72,12 +95,12 @@ class CurrentSessionOrderList(generics.ListAPIView, CurrentSessionMixin):
     def get_queryset(self):
         session = self.get_current_session()
         if session is None:
-            return Order.object.empty()
+            return Order.objects.none()
 
         return Order.objects.filter(
             delivery__isnull=False,
             delivery__session=session, 
-        )
+        ).with_type()
 
 
 class SessionOrderList(generics.ListAPIView):
@@ -88,48 +111,88 @@ class SessionOrderList(generics.ListAPIView):
         return Order.objects.filter(
             delivery__isnull=False,
             delivery__session_id=self.kwargs['session_id'], 
-        )
+        ).with_type()
 
 
-class OrderList(generics.ListAPIView):
-    # TODO: Sort by closest Restaurant
-    # TODO: Cache, page, limit.
-    permission_classes = [IsAuthenticated, IsRider]
-    serializer_class = OrderListSerializer
+class OrderFeedPagination(LimitOffsetPagination):
+    default_limit = 20
+    max_limit = 100
 
-    def get_queryset(self):
-        delivery_orders_searching_for_rider = Order.objects.filter(
-            cancellation__isnull=True,
-            completed__isnull=True,
-            delivery__isnull=False, 
-            delivery__session__isnull=True
-        )
-        return delivery_orders_searching_for_rider
 
+class OrderList(generics.ListAPIView, CurrentSessionMixin):
+    '''
+    The delivery orders that the rider can accept: the orders that `rider.dispatch` proposes to the rider, then
+    the orders from restaurants near the rider, nearest first. See `rider.feed.get_feed`.
+    '''
+    permission_classes = [IsAuthenticated, IsRider]
+    serializer_class = OrderFeedSerializer
+    pagination_class = OrderFeedPagination
+
+    def list(self, request, *args, **kwargs):
+        query_serializer = OrderFeedQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        params = query_serializer.validated_data
 
-class OrderDetail(generics.RetrieveAPIView):
+        session = self.get_current_session()
+        if session is None:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'No session currently active'})
+        if 'latitude' in params:
+            latitude, longitude = params['latitude'], params['longitude']
+        elif session.latitude is not None:
+            latitude, longitude = float(session.latitude), float(session.longitude)
+        else:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'Latitude and longitude are required'})
+
+        page = self.paginate_queryset(get_feed(session, latitude, longitude, params['radius']))
+        # The feed is cached, so orders that have been accepted since are left out
+        orders = Order.objects.filter(id__in=[entry.order_id for entry in page], status=Order.SEARCHING_FOR_RIDER) \
+            .with_type().in_bulk()
+        results = []
+        for entry in page:
+            order = orders.get(entry.order_id)
+            if order is not None:
+                order.distance = entry.distance
+                order.estimated_payout = entry.estimated_payout
+                order.proposed = entry.proposed
+                results.append(order)
+        return self.get_paginated_response(self.get_serializer(results, many=True).data)
+
+
+class OrderDetail(PrefetchPlanMixin, generics.RetrieveAPIView, CurrentSessionMixin):
     permission_classes = [IsAuthenticated, IsRider, IsDeliveringThisOrder]
     serializer_class = OrderDetailSerializer
     lookup_url_kwarg = 'order_id'
 
     def get_queryset(self):
-        session = self.request.user.rider.current_session
+        session = self.get_current_session()
         delivery_orders_fulfilled_by_rider = Order.objects.filter(
             delivery__isnull=False, 
             delivery__session = session
-        )
+        ).with_type()
         return delivery_orders_fulfilled_by_rider
 
 
-class OrderAccept(views.APIView):
+class OrderAccept(views.APIView, CurrentSessionMixin):
+    '''
+    Not atomic, since `Delivery.accept` must start its own transaction with a write
+    '''
     permission_classes = [IsAuthenticated, IsRider]
 
-    @transaction.atomic
     def post(self, request, *args, **kwargs):
-        order = Order.objects.get(id=self.kwargs['order_id'])
-        order.delivery.session = self.request.user.rider.current_session
-        order.delivery.estimated_delivery_datetime = timezone.now()
-        order.delivery.save()
+        session = self.get_current_session()
+        if session is None:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'No session currently active'})
+
+        try:
+            delivery = Delivery.objects.select_related('order').get(order_id=self.kwargs['order_id'])
+        except Delivery.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        try:
+            delivery.accept(session)
+        except Delivery.AlreadyAccepted as e:
+            return Response(status=status.HTTP_409_CONFLICT, data={e.message})
+        except ValidationError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={e.message})
         return Response(status=status.HTTP_200_OK)
 
 